@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 """
-MoSeq Usage Tool (no external libraries) v20250907
+MoSeq Usage Tool (standard library; NumPy used when available) v20250907
 
 Menu options:
 1) Analyze + export:
@@ -13,6 +13,20 @@ Menu options:
    - <base>_syl<syllable>_wide_byID.csv  (rows=subjectID, columns=treats, values=mean usage)
    - <base>_syl<syllable>_wide_packed.csv (columns=treats, values stacked per treat; ignores IDs)
 
+3) Create "wide" CSVs for ALL syllables in one pass:
+   - <base>_wide_all_syllables.zip with both tables per syllable inside,
+     or the same per-syllable CSVs written next to the input
+
+Selecting several input files (e.g. "1,3,4" or "a" for all) merges them into
+one cohort, parsed in parallel, and runs the chosen option on the merged rows
+(outputs are named after the cohort). Parsed files are cached in
+.zMoSeq_cache next to the script, keyed by file hash, so unchanged files are
+not re-parsed.
+
+Rows are held column-wise (categorical codes + a float column); with NumPy
+installed the per-(syllable,treat) mean/SEM and row sorting are grouped array
+reductions, otherwise the same results come from plain Python loops.
+
 Run:
     python moseq_usage_tool.py
 """
@@ -23,6 +37,15 @@ import csv
 import math
 import io
 import zipfile
+import hashlib
+import pickle
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import numpy as np
+except ImportError:  # pure-stdlib fallback
+    np = None
 
 # ------------------ Utilities ------------------
 
@@ -131,15 +154,179 @@ def sanitize_for_filename(s: str) -> str:
             out.append("_")
     return "".join(out) if out else "unknown"
 
+# ------------------ Column store ------------------
+
+CATEGORIES = ("subject", "group", "syllable", "treat")
+
+class UsageTable:
+    """
+    Column store for a parsed usage file.
+    subject/group/syllable/treat are categorical codes into per-column level
+    lists (first-seen order) and usage is a float column; rows stay in file
+    order. Columns are array.array so NumPy can view them without copying.
+    """
+    def __init__(self):
+        self.lookup = {c: {} for c in CATEGORIES}   # level -> code, in first-seen order
+        self.codes = {c: array("i") for c in CATEGORIES}
+        self.usage = array("d")
+        self.skipped = 0
+        self._levels = None
+
+    def __len__(self):
+        return len(self.usage)
+
+    def append(self, subject, group, syll, treat, usage: float):
+        lookup, codes = self.lookup, self.codes
+        for col, val in (("subject", subject), ("group", group), ("syllable", syll), ("treat", treat)):
+            levels = lookup[col]
+            codes[col].append(levels.setdefault(val, len(levels)))
+        self.usage.append(usage)
+        self._levels = None
+
+    @property
+    def levels(self):
+        """Level lists per categorical column, indexed by code."""
+        if self._levels is None:
+            self._levels = {c: list(self.lookup[c]) for c in CATEGORIES}
+        return self._levels
+
+    def row(self, i: int):
+        """(subject, group, syllable, treat, usage) of row i."""
+        return tuple(self.levels[c][self.codes[c][i]] for c in CATEGORIES) + (self.usage[i],)
+
+    def ranks(self, col: str, key=None):
+        """Sort rank of every level of a categorical column, indexed by code."""
+        levels = self.levels[col]
+        order = sorted(range(len(levels)), key=(lambda c: key(levels[c])) if key else levels.__getitem__)
+        rank = [0] * len(levels)
+        for r, code in enumerate(order):
+            rank[code] = r
+        return rank
+
+    def state(self):
+        """Plain-data form for the parse cache (arrays pickle as raw bytes)."""
+        return {"levels": self.levels, "codes": self.codes, "usage": self.usage, "skipped": self.skipped}
+
+    @classmethod
+    def from_state(cls, state):
+        table = cls()
+        table.lookup = {c: {v: i for i, v in enumerate(state["levels"][c])} for c in CATEGORIES}
+        table.codes = state["codes"]
+        table.usage = state["usage"]
+        table.skipped = state["skipped"]
+        return table
+
+    @classmethod
+    def concat(cls, tables):
+        """Rows of all tables, in order, with codes remapped onto merged levels."""
+        merged = cls()
+        for t in tables:
+            for c in CATEGORIES:
+                lookup = merged.lookup[c]
+                remap = [lookup.setdefault(v, len(lookup)) for v in t.levels[c]]
+                if np is not None and len(t):
+                    merged.codes[c].frombytes(np.asarray(remap, dtype=np.intc)[t.column(c)].tobytes())
+                else:
+                    merged.codes[c].extend(remap[code] for code in t.codes[c])
+            merged.usage.extend(t.usage)
+            merged.skipped += t.skipped
+        return merged
+
+    def column(self, col: str):
+        """A column as a NumPy array (zero-copy view), or the raw array without NumPy."""
+        data = self.usage if col == "usage" else self.codes[col]
+        if np is None:
+            return data
+        dtype = np.float64 if col == "usage" else np.intc
+        return np.frombuffer(data, dtype=dtype) if len(data) else np.zeros(0, dtype=dtype)
+
+def grouped_mean_sem(group_codes, values, n_groups: int):
+    """
+    n, mean and SEM per group code (0..n_groups-1) as three lists.
+    NumPy: bincount reductions (mean first, then squared deviations, which is
+    as stable as Welford). Fallback: one OnlineStats per group.
+    Groups without rows get n=0 and NaN mean/SEM.
+    """
+    if np is not None:
+        g = np.asarray(group_codes, dtype=np.intp)
+        v = np.asarray(values, dtype=np.float64)
+        n = np.bincount(g, minlength=n_groups)
+        sums = np.bincount(g, weights=v, minlength=n_groups)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = sums / n
+            dev = v - mean[g]
+            ss = np.bincount(g, weights=dev * dev, minlength=n_groups)
+            sem = np.sqrt(ss / (n - 1) / n)
+        sem[n == 1] = 0.0
+        return n.tolist(), mean.tolist(), sem.tolist()
+
+    stats = [OnlineStats() for _ in range(n_groups)]
+    for g, x in zip(group_codes, values):
+        stats[g].add(x)
+    pairs = [s.mean_sem() for s in stats]
+    return [s.n for s in stats], [p[0] for p in pairs], [p[1] for p in pairs]
+
+def summarize(table: UsageTable):
+    """
+    Per-(syllable, treat) rows (syll, treat, n, mean, sem), sorted by syllable
+    then treat, from a single grouped reduction over syllable*n_treat+treat.
+    """
+    sylls, treats = table.levels["syllable"], table.levels["treat"]
+    n_treat = len(treats)
+    n_groups = len(sylls) * n_treat
+    syll_col, treat_col = table.column("syllable"), table.column("treat")
+    if np is not None:
+        group = syll_col.astype(np.intp) * n_treat + treat_col
+    else:
+        group = [s * n_treat + t for s, t in zip(syll_col, treat_col)]
+    n, mean, sem = grouped_mean_sem(group, table.column("usage"), n_groups)
+
+    rows = []
+    for g in range(n_groups):
+        if n[g]:
+            s, t = divmod(g, n_treat)
+            rows.append((sylls[s], treats[t], n[g], mean[g], sem[g]))
+    rows.sort(key=lambda r: (int_or_str_key(r[0]), r[1]))
+    return rows
+
+def relative_occurrence(rows):
+    """
+    (syll, total_mean, relative, percent) per syllable from summarize() rows,
+    where total_mean is the sum of that syllable's per-treatment means.
+    Sorted by total_mean descending.
+    """
+    syll_total_mean = {}
+    for (syll, treat, n, mean, sem) in rows:
+        syll_total_mean[syll] = syll_total_mean.get(syll, 0.0) + (0.0 if math.isnan(mean) else mean)
+
+    grand_total = sum(syll_total_mean.values())
+    rel_rows = []
+    for syll, total_mean in syll_total_mean.items():
+        rel = (total_mean / grand_total) if grand_total > 0 else float("nan")
+        rel_rows.append((syll, total_mean, rel, rel * 100 if not math.isnan(rel) else float("nan")))
+    rel_rows.sort(key=lambda x: (-x[1], int_or_str_key(x[0])))
+    return rel_rows
+
+def sorted_row_order(table: UsageTable):
+    """Row indices ordered by syllable, treat, subjectID; ties keep file order."""
+    syll_rank = table.ranks("syllable", int_or_str_key)
+    treat_rank = table.ranks("treat")
+    subj_rank = table.ranks("subject")
+    syll_col, treat_col, subj_col = table.column("syllable"), table.column("treat"), table.column("subject")
+    if np is not None:
+        key = np.asarray(syll_rank, dtype=np.int64)[syll_col] * len(treat_rank)
+        key += np.asarray(treat_rank, dtype=np.int64)[treat_col]
+        key *= len(subj_rank)
+        key += np.asarray(subj_rank, dtype=np.int64)[subj_col]
+        return np.argsort(key, kind="stable")
+    return sorted(range(len(table)),
+                  key=lambda i: (syll_rank[syll_col[i]], treat_rank[treat_col[i]], subj_rank[subj_col[i]]))
+
 # ------------------ Parsing ------------------
 
-def parse_dataset(in_path: str):
+def parse_dataset(in_path: str) -> UsageTable:
     """
-    Returns:
-      stats: dict[(syll, treat)] -> OnlineStats of usage
-      rows_by_syllable: dict[syll] -> list of (subject, group, treat, usage)
-      all_rows: list of (subject, group, syll, treat, usage)
-      skipped: int
+    Parse a usage file into a UsageTable (table.skipped counts malformed rows).
     """
     if not os.path.isfile(in_path):
         raise FileNotFoundError(f"File not found: {in_path}")
@@ -150,10 +337,8 @@ def parse_dataset(in_path: str):
             raise ValueError("Input file is empty.")
         delim = detect_delimiter(first_line)
 
-    stats = {}
-    rows_by_syllable = {}
-    all_rows = []
-    skipped = 0
+    table = UsageTable()
+    append = table.append
 
     with open(in_path, "r", encoding="utf-8-sig", newline="") as f:
         if delim is not None:
@@ -175,11 +360,9 @@ def parse_dataset(in_path: str):
                         treat  = row[field_ix["treat"]].strip()
                         usage  = float(row[field_ix["usage"]])
                     except Exception:
-                        skipped += 1
+                        table.skipped += 1
                         continue
-                    stats.setdefault((syll, treat), OnlineStats()).add(usage)
-                    rows_by_syllable.setdefault(syll, []).append((subject, group, treat, usage))
-                    all_rows.append((subject, group, syll, treat, usage))
+                    append(subject, group, syll, treat, usage)
 
         if delim is None:
             # whitespace fallback
@@ -205,38 +388,108 @@ def parse_dataset(in_path: str):
                     treat   = parts[field_ix_ws["treat"]]
                     usage   = float(parts[field_ix_ws["usage"]])
                 except Exception:
-                    skipped += 1
+                    table.skipped += 1
                     continue
-                stats.setdefault((syll, treat), OnlineStats()).add(usage)
-                rows_by_syllable.setdefault(syll, []).append((subject, group, treat, usage))
-                all_rows.append((subject, group, syll, treat, usage))
+                append(subject, group, syll, treat, usage)
+
+    return table
 
-    return stats, rows_by_syllable, all_rows, skipped
+# ------------------ Cache & cohorts ------------------
+
+CACHE_DIR = os.path.join(script_dir(), ".zMoSeq_cache")
+CACHE_VERSION = 1
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_table(in_path: str) -> UsageTable:
+    """
+    parse_dataset, reusing the cached table when the file content is unchanged.
+    """
+    if not os.path.isfile(in_path):
+        raise FileNotFoundError(f"File not found: {in_path}")
+    cache_file = os.path.join(CACHE_DIR, f"{file_hash(in_path)}_v{CACHE_VERSION}.pickle")
+    try:
+        with open(cache_file, "rb") as f:
+            return UsageTable.from_state(pickle.load(f))
+    except (OSError, pickle.UnpicklingError, EOFError, KeyError):
+        pass
+
+    table = parse_dataset(in_path)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_file = cache_file + ".tmp"
+        with open(tmp_file, "wb") as f:
+            pickle.dump(table.state(), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        print(f"[Note] Could not write cache for {os.path.basename(in_path)}: {e}")
+    return table
+
+def load_cohort(paths, workers=None) -> UsageTable:
+    """
+    Load every file (parsed in worker processes, or from cache) and merge
+    them in the given order. Identical subject IDs in different files are
+    treated as the same animal; a note is printed when that happens.
+    """
+    if len(paths) == 1:
+        return load_table(paths[0])
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        tables = list(pool.map(load_table, paths))
+
+    seen_subjects = set()
+    shared = set()
+    for path, t in zip(paths, tables):
+        subjects = set(t.levels["subject"])
+        shared |= seen_subjects & subjects
+        seen_subjects |= subjects
+        print(f"  {os.path.basename(path)}: {len(t)} rows, {len(subjects)} subjects, "
+              f"{len(t.levels['syllable'])} syllables")
+    if shared:
+        print(f"[Note] {len(shared)} subject ID(s) appear in more than one file and are merged as one subject.")
+    return UsageTable.concat(tables)
 
 # ------------------ Features ------------------
 
-def do_full_analysis(in_path: str):
-    base, _ = os.path.splitext(in_path)
-    stats, rows_by_syllable, all_rows, skipped = parse_dataset(in_path)
+def write_per_syllable_zip(table: UsageTable, order, zip_path: str, stem: str):
+    """
+    One <stem>_syl<syllable>.csv member per syllable (subjectID, treat, usage).
+    `order` is sorted_row_order(table), which already groups rows by syllable
+    and sorts them by treat then subjectID, so each member is streamed through
+    a ZipFile.open(..., "w") handle and only one member is open at a time.
+    """
+    syll_col, subj_col, treat_col = table.codes["syllable"], table.codes["subject"], table.codes["treat"]
+    sylls, subjects, treats = table.levels["syllable"], table.levels["subject"], table.levels["treat"]
+    usage = table.usage
+    with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        current, member, w = None, None, None
+        try:
+            for i in order:
+                if syll_col[i] != current:
+                    if member is not None:
+                        member.close()
+                    current = syll_col[i]
+                    safe_s = sanitize_for_filename(str(sylls[current]))
+                    member = io.TextIOWrapper(zf.open(f"{stem}_syl{safe_s}.csv", "w"), encoding="utf-8", newline="")
+                    w = csv.writer(member)
+                    w.writerow(["subjectID", "treat", "usage"])
+                w.writerow([subjects[subj_col[i]], treats[treat_col[i]], f"{usage[i]:.6f}"])
+        finally:
+            if member is not None:
+                member.close()
+
+def do_full_analysis(base: str, table: UsageTable):
+    skipped = table.skipped
 
     # Per-(syll,treat) mean/SEM rows
-    rows = []
-    for (syll, treat), s in stats.items():
-        mean, sem = s.mean_sem()
-        rows.append((syll, treat, s.n, mean, sem))
-    rows.sort(key=lambda r: (int_or_str_key(r[0]), r[1]))
+    rows = summarize(table)
 
     # Relative occurrence FIRST (sum of treat means per syllable)
-    syll_total_mean = {}
-    for (syll, treat, n, mean, sem) in rows:
-        syll_total_mean[syll] = syll_total_mean.get(syll, 0.0) + (0.0 if math.isnan(mean) else mean)
-
-    grand_total = sum(syll_total_mean.values())
-    rel_rows = []
-    for syll, total_mean in syll_total_mean.items():
-        rel = (total_mean / grand_total) if grand_total > 0 else float("nan")
-        rel_rows.append((syll, total_mean, rel, rel * 100 if not math.isnan(rel) else float("nan")))
-    rel_rows.sort(key=lambda x: (-x[1], int_or_str_key(x[0])))
+    rel_rows = relative_occurrence(rows)
 
     # Print relative and pause
     print("# Relative occurrence by syllable across all treatments")
@@ -265,13 +518,14 @@ def do_full_analysis(in_path: str):
 
     press_enter("\n(2/4) Press Enter to write the consolidated CSV of all rows...")
 
-    # Consolidated CSV with all rows
-    all_rows.sort(key=lambda r: (int_or_str_key(r[2]), r[3], r[0]))  # by syllable, treat, subjectID
+    # Consolidated CSV with all rows, by syllable, treat, subjectID
+    order = sorted_row_order(table)
     allcsv_path = f"{base}_allrows.csv"
     with open(allcsv_path, "w", encoding="utf-8", newline="") as fcsv:
         writer = csv.writer(fcsv)
         writer.writerow(["subjectID", "group", "syllable", "treat", "usage"])
-        for subject, group, syll, treat, usage in all_rows:
+        for i in order:
+            subject, group, syll, treat, usage = table.row(i)
             writer.writerow([subject, group, syll, treat, f"{usage:.6f}"])
     print(f"Wrote consolidated CSV: {allcsv_path}")
 
@@ -279,16 +533,7 @@ def do_full_analysis(in_path: str):
     ans = input("\nWould you also like a single ZIP with per-syllable CSVs inside? [y/N]: ").strip().lower()
     if ans == "y":
         zip_path = f"{base}_per_syllables.zip"
-        with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
-            for syll in sorted(rows_by_syllable.keys(), key=int_or_str_key):
-                safe_s = sanitize_for_filename(str(syll))
-                inner_name = f"{os.path.basename(base)}_syl{safe_s}.csv"
-                buf = io.StringIO()
-                w = csv.writer(buf)
-                w.writerow(["subjectID", "treat", "usage"])
-                for subject, group, treat, usage in sorted(rows_by_syllable[syll], key=lambda x: (x[2], x[0])):
-                    w.writerow([subject, treat, f"{usage:.6f}"])
-                zf.writestr(inner_name, buf.getvalue())
+        write_per_syllable_zip(table, order, zip_path, os.path.basename(base))
         print(f"Created: {zip_path}")
     else:
         print("Skipped creating per-syllable ZIP.")
@@ -306,9 +551,9 @@ def do_full_analysis(in_path: str):
 
     press_enter("\n(4/4) Press Enter to exit...")
 
-def choose_syllable(rows_by_syllable):
+def choose_syllable(syllables):
     """Interactive picker: returns chosen syllable (string)."""
-    sylls = sorted(rows_by_syllable.keys(), key=int_or_str_key)
+    sylls = sorted(syllables, key=int_or_str_key)
     if not sylls:
         raise ValueError("No syllables found in dataset.")
     print("\nAvailable syllables:")
@@ -323,72 +568,139 @@ def choose_syllable(rows_by_syllable):
             else:
                 print("Out of range.")
         elif raw:
-            if raw in rows_by_syllable:
+            if raw in sylls:
                 return raw
             else:
                 print("Not found. Please enter a valid number or exact syllable ID.")
         else:
             print("Please enter a choice.")
 
-def do_wide_one_syllable(in_path: str):
-    base, _ = os.path.splitext(in_path)
-    stats, rows_by_syllable, all_rows, skipped = parse_dataset(in_path)
-    syll = choose_syllable(rows_by_syllable)
+def syllable_slices(table: UsageTable, codes):
+    """
+    Yield (syllable code, subject codes, treat codes, usage) for each wanted
+    syllable code, rows in file order, from one grouping pass over the table.
+    """
+    syll_col, subj_col = table.column("syllable"), table.column("subject")
+    treat_col, usage = table.column("treat"), table.column("usage")
+    if np is not None:
+        order = np.argsort(syll_col, kind="stable")
+        counts = np.bincount(syll_col, minlength=len(table.levels["syllable"]))
+        bounds = np.concatenate(([0], np.cumsum(counts)))
+        for c in codes:
+            idx = order[bounds[c]:bounds[c + 1]]
+            yield c, subj_col[idx], treat_col[idx], usage[idx]
+        return
+
+    parts = {c: ([], [], []) for c in codes}
+    for s, u, t, x in zip(syll_col, subj_col, treat_col, usage):
+        part = parts.get(s)
+        if part is not None:
+            part[0].append(u)
+            part[1].append(t)
+            part[2].append(x)
+    for c in codes:
+        yield (c,) + parts[c]
+
+def wide_tables(table: UsageTable, syllables=None):
+    """
+    Yield (syll, byid_header, byid_rows, packed_header, packed_rows) for each
+    syllable (default: all, in syllable order) with formatted CSV cells.
+    byID: rows=subjectID, columns=treats, values=mean usage ("" if missing).
+    packed: columns=treats, raw values stacked per treat in file order.
+    Only one syllable's tables are built at a time.
+    """
+    lookup = table.lookup["syllable"]
+    wanted = sorted(table.levels["syllable"] if syllables is None else syllables, key=int_or_str_key)
+    codes = [lookup[s] for s in wanted if s in lookup]
+    subj_levels, treat_levels = table.levels["subject"], table.levels["treat"]
+    n_treat = len(treat_levels)
+
+    for code, subj, treat, usage in syllable_slices(table, codes):
+        # ---------- (A) BY-ID: mean per (subject, treat) ----------
+        if np is not None:
+            keys, inverse = np.unique(subj.astype(np.int64) * n_treat + treat, return_inverse=True)
+            keys = keys.tolist()
+        else:
+            compact = {}
+            inverse = [compact.setdefault(u * n_treat + t, len(compact)) for u, t in zip(subj, treat)]
+            keys = list(compact)
+        _, means, _ = grouped_mean_sem(inverse, usage, len(keys))
+        cells = {divmod(k, n_treat): m for k, m in zip(keys, means)}
+
+        treat_codes = sorted({t for _, t in cells}, key=lambda t: int_or_str_key(treat_levels[t]))
+        subj_codes = sorted({u for u, _ in cells}, key=lambda u: int_or_str_key(subj_levels[u]))
+        treat_cols = [treat_levels[t] for t in treat_codes]
+        byid_rows = [[subj_levels[u]] + [f"{cells[u, t]:.6f}" if (u, t) in cells else "" for t in treat_codes]
+                     for u in subj_codes]
+
+        # ---------- (B) PACKED: raw usage per treat, ignoring IDs ----------
+        if np is not None:
+            values = [usage[treat == t].tolist() for t in treat_codes]
+        else:
+            by_treat = {t: [] for t in treat_codes}
+            for t, x in zip(treat, usage):
+                by_treat[t].append(x)
+            values = [by_treat[t] for t in treat_codes]
+        max_len = max((len(v) for v in values), default=0)
+        packed_rows = [[f"{v[i]:.6f}" if i < len(v) else "" for v in values] for i in range(max_len)]
+
+        yield table.levels["syllable"][code], ["subjectID"] + treat_cols, byid_rows, treat_cols, packed_rows
 
-    # ---------- (A) BY-ID wide table ----------
-    # Build treat set and subject→treat aggregator (mean if multiple entries)
-    treat_set = set()
-    subj_treat_stats = {}  # subject -> treat -> OnlineStats
-    for (subject, group, treat, usage) in rows_by_syllable.get(syll, []):
-        treat_set.add(treat)
-        subj_treat_stats.setdefault(subject, {}).setdefault(treat, OnlineStats()).add(usage)
+def write_csv_rows(fcsv, header, rows):
+    writer = csv.writer(fcsv)
+    writer.writerow(header)
+    writer.writerows(rows)
 
-    treat_cols = sorted(treat_set, key=int_or_str_key)
-    subjects = sorted(subj_treat_stats.keys(), key=int_or_str_key)
+def do_wide_one_syllable(base: str, table: UsageTable):
+    skipped = table.skipped
+    syll = choose_syllable(table.levels["syllable"])
+    _, byid_header, byid_rows, packed_header, packed_rows = next(wide_tables(table, [syll]))
 
     safe_s = sanitize_for_filename(str(syll))
     out_byid = f"{base}_syl{safe_s}_wide_byID.csv"
     with open(out_byid, "w", encoding="utf-8", newline="") as fcsv:
-        writer = csv.writer(fcsv)
-        writer.writerow(["subjectID"] + treat_cols)
-        for subj in subjects:
-            row = [subj]
-            for t in treat_cols:
-                st = subj_treat_stats[subj].get(t)
-                if st is None or st.n == 0:
-                    row.append("")  # blank for missing data
-                else:
-                    mean, _ = st.mean_sem()
-                    row.append(f"{mean:.6f}")
-            writer.writerow(row)
-
-    # ---------- (B) PACKED wide table (ignores IDs) ----------
-    # For each treat, collect *raw* usage values (no grouping by subject).
-    treat_values = {}  # treat -> list[usage]
-    for (subject, group, treat, usage) in rows_by_syllable.get(syll, []):
-        treat_values.setdefault(treat, []).append(usage)
-
-    treat_cols2 = sorted(treat_values.keys(), key=int_or_str_key)
-    max_len = max((len(v) for v in treat_values.values()), default=0)
+        write_csv_rows(fcsv, byid_header, byid_rows)
 
     out_packed = f"{base}_syl{safe_s}_wide_packed.csv"
     with open(out_packed, "w", encoding="utf-8", newline="") as fcsv:
-        writer = csv.writer(fcsv)
-        writer.writerow(treat_cols2)  # header = treat names only
-        for i in range(max_len):
-            row = []
-            for t in treat_cols2:
-                vals = treat_values.get(t, [])
-                if i < len(vals):
-                    row.append(f"{vals[i]:.6f}")
-                else:
-                    row.append("")  # pad shorter columns
-            writer.writerow(row)
+        write_csv_rows(fcsv, packed_header, packed_rows)  # header = treat names only
 
     print(f"\nWrote syllable-wide CSV (by ID): {out_byid}")
     print(f"Wrote syllable-wide CSV (packed, ignores IDs): {out_packed}")
-    print(f"Subjects in byID table: {len(subjects)} | Treat columns: {len(treat_cols)}")
-    print(f"Packed rows: {max_len} | Treat columns: {len(treat_cols2)}")
+    print(f"Subjects in byID table: {len(byid_rows)} | Treat columns: {len(byid_header) - 1}")
+    print(f"Packed rows: {len(packed_rows)} | Treat columns: {len(packed_header)}")
+
+    if skipped:
+        print(f"[Note] Skipped {skipped} malformed row(s).")
+
+    press_enter("\nPress Enter to exit...")
+
+def do_wide_all_syllables(base: str, table: UsageTable):
+    skipped = table.skipped
+    stem = os.path.basename(base)
+
+    ans = input("\nWrite all wide tables into one ZIP (z) or as separate CSV files (f)? [Z/f]: ").strip().lower()
+    n_sylls = 0
+    if ans == "f":
+        for syll, byid_header, byid_rows, packed_header, packed_rows in wide_tables(table):
+            safe_s = sanitize_for_filename(str(syll))
+            for suffix, header, rows in (("byID", byid_header, byid_rows), ("packed", packed_header, packed_rows)):
+                with open(f"{base}_syl{safe_s}_wide_{suffix}.csv", "w", encoding="utf-8", newline="") as fcsv:
+                    write_csv_rows(fcsv, header, rows)
+            n_sylls += 1
+        print(f"\nWrote {2 * n_sylls} wide CSVs ({n_sylls} syllables) in: {os.path.dirname(base) or '.'}")
+    else:
+        zip_path = f"{base}_wide_all_syllables.zip"
+        with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            for syll, byid_header, byid_rows, packed_header, packed_rows in wide_tables(table):
+                safe_s = sanitize_for_filename(str(syll))
+                for suffix, header, rows in (("byID", byid_header, byid_rows), ("packed", packed_header, packed_rows)):
+                    # Stream each member straight into the archive
+                    with io.TextIOWrapper(zf.open(f"{stem}_syl{safe_s}_wide_{suffix}.csv", "w"),
+                                          encoding="utf-8", newline="") as fcsv:
+                        write_csv_rows(fcsv, header, rows)
+                n_sylls += 1
+        print(f"\nCreated: {zip_path} ({2 * n_sylls} wide CSVs, {n_sylls} syllables)")
 
     if skipped:
         print(f"[Note] Skipped {skipped} malformed row(s).")
@@ -397,7 +709,8 @@ def do_wide_one_syllable(in_path: str):
 
 # ------------------ UI: File chooser & Menu ------------------
 
-def choose_input_file():
+def choose_input_files():
+    """Returns a list of input paths; more than one means a cohort."""
     base = script_dir()
     txts = list_txt_files(base)
 
@@ -407,33 +720,44 @@ def choose_input_file():
         for i, name in enumerate(txts, 1):
             print(f"  {i}) {name}")
         default_hint = " (press Enter for 1)" if len(txts) == 1 else ""
-        choice = input(f"Enter number 1-{len(txts)} to select, or type a path{default_hint}: ").strip()
+        choice = input(f"Enter number 1-{len(txts)} to select (several like 1,3 or 'a' for all = cohort), "
+                       f"or type a path{default_hint}: ").strip()
         if choice == "" and len(txts) == 1:
-            return os.path.join(base, txts[0])
-        if choice.isdigit():
-            num = int(choice)
-            if 1 <= num <= len(txts):
-                return os.path.join(base, txts[num - 1])
+            return [os.path.join(base, txts[0])]
+        if choice.lower() == "a":
+            return [os.path.join(base, t) for t in txts]
+        parts = choice.replace(",", " ").split()
+        if parts and all(p.isdigit() for p in parts):
+            nums = [int(p) for p in parts]
+            if all(1 <= num <= len(txts) for num in nums):
+                return [os.path.join(base, txts[num - 1]) for num in dict.fromkeys(nums)]
             else:
                 print("Invalid selection number.")
-        if choice:
-            return choice
+        elif choice:
+            return [choice]
         print("No valid selection provided.")
     else:
         print("No .txt files found in the script folder.")
     path = input("Please type the path to the input .txt file: ").strip()
-    return path
+    return [path] if path else []
+
+def cohort_base(paths) -> str:
+    """Output base path for a merged cohort, next to the first file."""
+    name = input(f"Name for the merged cohort outputs [cohort_{len(paths)}files]: ").strip()
+    name = sanitize_for_filename(name) if name else f"cohort_{len(paths)}files"
+    return os.path.join(os.path.dirname(paths[0]), name)
 
 def main_menu() -> str:
     print("\nSelect an option:")
     print("  1) Analyze + export (relative occurrence, summary, consolidated CSV, optional ZIP)")
     print("  2) Create wide CSVs for one syllable (byID + packed, ignores IDs)")
+    print("  3) Create wide CSVs for all syllables in one pass (ZIP or separate files)")
     print("  0) Exit")
     while True:
-        c = input("Enter choice [1/2/0]: ").strip()
-        if c in {"1", "2", "0"}:
+        c = input("Enter choice [1/2/3/0]: ").strip()
+        if c in {"1", "2", "3", "0"}:
             return c
-        print("Please enter 1, 2, or 0.")
+        print("Please enter 1, 2, 3, or 0.")
 
 def main():
     try:
@@ -442,15 +766,25 @@ def main():
             print("Goodbye.")
             return
 
-        in_path = choose_input_file()
-        if not in_path:
+        paths = choose_input_files()
+        if not paths:
             print("No input provided. Exiting.")
             sys.exit(1)
 
+        if len(paths) == 1:
+            base, _ = os.path.splitext(paths[0])
+            table = load_table(paths[0])
+        else:
+            print(f"\nMerging a cohort of {len(paths)} files...")
+            table = load_cohort(paths)
+            base = cohort_base(paths)
+
         if choice == "1":
-            do_full_analysis(in_path)
+            do_full_analysis(base, table)
         elif choice == "2":
-            do_wide_one_syllable(in_path)
+            do_wide_one_syllable(base, table)
+        elif choice == "3":
+            do_wide_all_syllables(base, table)
 
     except Exception as e:
         print(f"ERROR: {e}")
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+zMoSeqStats.py — per-syllable treatment contrasts for MoSeq usage files.
+
+For every syllable and every pair of treatments (A vs B) it reports:
+  - n, mean usage of each group and the difference (mean_A - mean_B)
+  - a percentile bootstrap confidence interval of the difference
+    (each group resampled with replacement, independently)
+  - a two-sided permutation p-value (group labels shuffled within the pair)
+  - Benjamini-Hochberg q-values across all contrasts of the run
+
+Groups are independent (unpaired); pairs with fewer than 2 values on either
+side are skipped. Input files are read with zMoSeq (same parser and parse
+cache); several files are merged into one cohort.
+
+With NumPy the resampling is batched: one (resamples x n) index / permutation
+matrix per chunk, reduced with a row mean. Without NumPy the same statistics
+come from plain random-module loops (much slower). Syllables are spread over
+worker processes; every syllable gets its own generator seeded from --seed
+and its position, so results do not depend on --workers.
+
+Run:  python zMoSeqStats.py usage.txt [more.txt ...]
+                           [--reference D1_KND_Veh | --pairs A:B,C:D]
+                           [--n-boot 2000] [--n-perm 5000] [--ci 95]
+                           [--seed 1] [--workers 4] [--out contrasts.csv]
+"""
+
+import argparse
+import csv
+import math
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+from zMoSeq import np, int_or_str_key, load_cohort, syllable_slices
+
+# Upper bound on resample-matrix elements held at once (NumPy path)
+CHUNK_ELEMENTS = 2_000_000
+
+RESULT_FIELDS = ["syllable", "treat_a", "treat_b", "n_a", "n_b", "mean_a", "mean_b",
+                 "diff", "ci_low", "ci_high", "p_perm", "q_bh"]
+
+
+def treatment_groups(table):
+    """[(syllable, {treat: [usage, ...]}), ...] for every syllable, in syllable order."""
+    sylls, treat_levels = table.levels["syllable"], table.levels["treat"]
+    codes = sorted(range(len(sylls)), key=lambda c: int_or_str_key(sylls[c]))
+    groups = []
+    for code, _, treat, usage in syllable_slices(table, codes):
+        by_treat = {}
+        for t, x in zip(treat, usage):
+            by_treat.setdefault(treat_levels[t], []).append(float(x))
+        groups.append((sylls[code], by_treat))
+    return groups
+
+
+def choose_pairs(treats, reference=None, pairs=None):
+    """
+    Treatment pairs to contrast: explicit "A:B" pairs, every treat against a
+    reference, or (default) all pairs in treat order.
+    """
+    treats = sorted(treats, key=int_or_str_key)
+    if pairs:
+        chosen = []
+        for item in pairs.split(","):
+            a, sep, b = item.strip().partition(":")
+            if not sep or a not in treats or b not in treats:
+                raise ValueError(f"Unknown treatment pair '{item}' (treats: {', '.join(treats)})")
+            chosen.append((a, b))
+        return chosen
+    if reference:
+        if reference not in treats:
+            raise ValueError(f"Unknown reference treatment '{reference}' (treats: {', '.join(treats)})")
+        return [(t, reference) for t in treats if t != reference]
+    return [(a, b) for i, a in enumerate(treats) for b in treats[i + 1:]]
+
+
+def percentile(sorted_values, q):
+    """Linear-interpolated percentile (q in 0..1) of a sorted list, as numpy's default."""
+    pos = q * (len(sorted_values) - 1)
+    lo = int(math.floor(pos))
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (pos - lo)
+
+
+def bootstrap_diff_ci(a, b, n_boot, ci, rng):
+    """Percentile bootstrap CI of mean(a) - mean(b)."""
+    alpha = (1.0 - ci / 100.0) / 2.0
+    if np is not None:
+        a, b = np.asarray(a), np.asarray(b)
+        rows = max(1, CHUNK_ELEMENTS // (len(a) + len(b)))
+        diffs = []
+        for start in range(0, n_boot, rows):
+            k = min(rows, n_boot - start)
+            mean_a = a[rng.integers(0, len(a), size=(k, len(a)))].mean(axis=1)
+            mean_b = b[rng.integers(0, len(b), size=(k, len(b)))].mean(axis=1)
+            diffs.append(mean_a - mean_b)
+        diffs = np.concatenate(diffs)
+        return float(np.percentile(diffs, 100 * alpha)), float(np.percentile(diffs, 100 * (1 - alpha)))
+
+    diffs = sorted(sum(rng.choices(a, k=len(a))) / len(a) - sum(rng.choices(b, k=len(b))) / len(b)
+                   for _ in range(n_boot))
+    return percentile(diffs, alpha), percentile(diffs, 1 - alpha)
+
+
+def permutation_p(a, b, n_perm, rng):
+    """Two-sided permutation p-value of mean(a) - mean(b), (hits + 1) / (n_perm + 1)."""
+    n_a = len(a)
+    pooled = list(a) + list(b)
+    observed = abs(sum(a) / n_a - sum(b) / len(b))
+    # Differences within float noise of the observed one count as hits
+    threshold = observed - 1e-12 * max(1.0, observed)
+    hits = 0
+    if np is not None:
+        pooled = np.asarray(pooled)
+        rows = max(1, CHUNK_ELEMENTS // len(pooled))
+        for start in range(0, n_perm, rows):
+            k = min(rows, n_perm - start)
+            perm = rng.permuted(np.broadcast_to(pooled, (k, len(pooled))), axis=1)
+            d = perm[:, :n_a].mean(axis=1) - perm[:, n_a:].mean(axis=1)
+            hits += int(np.count_nonzero(np.abs(d) >= threshold))
+    else:
+        for _ in range(n_perm):
+            rng.shuffle(pooled)
+            d = sum(pooled[:n_a]) / n_a - sum(pooled[n_a:]) / (len(pooled) - n_a)
+            if abs(d) >= threshold:
+                hits += 1
+    return (hits + 1) / (n_perm + 1)
+
+
+def contrast_syllable(job):
+    """All contrasts of one syllable. job = (index, syllable, groups, pairs, n_boot, n_perm, ci, seed)."""
+    index, syll, groups, pairs, n_boot, n_perm, ci, seed = job
+    rng = np.random.default_rng([seed, index]) if np is not None else random.Random(seed * 1_000_003 + index)
+    results = []
+    for treat_a, treat_b in pairs:
+        a, b = groups.get(treat_a, []), groups.get(treat_b, [])
+        if len(a) < 2 or len(b) < 2:
+            continue
+        mean_a, mean_b = sum(a) / len(a), sum(b) / len(b)
+        ci_low, ci_high = bootstrap_diff_ci(a, b, n_boot, ci, rng)
+        results.append({
+            "syllable": syll, "treat_a": treat_a, "treat_b": treat_b,
+            "n_a": len(a), "n_b": len(b), "mean_a": mean_a, "mean_b": mean_b,
+            "diff": mean_a - mean_b, "ci_low": ci_low, "ci_high": ci_high,
+            "p_perm": permutation_p(a, b, n_perm, rng),
+        })
+    return results
+
+
+def bh_qvalues(pvalues):
+    """Benjamini-Hochberg adjusted p-values, in input order."""
+    m = len(pvalues)
+    order = sorted(range(m), key=lambda i: pvalues[i], reverse=True)
+    q = [0.0] * m
+    running = 1.0
+    for rank_from_top, i in enumerate(order):
+        rank = m - rank_from_top
+        running = min(running, pvalues[i] * m / rank)
+        q[i] = running
+    return q
+
+
+def run_contrasts(table, pairs, n_boot=2000, n_perm=5000, ci=95.0, seed=1, workers=None):
+    jobs = [(k, syll, groups, pairs, n_boot, n_perm, ci, seed)
+            for k, (syll, groups) in enumerate(treatment_groups(table))]
+    if workers == 1:
+        per_syllable = [contrast_syllable(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            per_syllable = list(pool.map(contrast_syllable, jobs, chunksize=max(1, len(jobs) // 64)))
+    results = [r for rows in per_syllable for r in rows]
+    for r, q in zip(results, bh_qvalues([r["p_perm"] for r in results])):
+        r["q_bh"] = q
+    return results
+
+
+def write_csv(results, path):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(RESULT_FIELDS)
+        for r in results:
+            writer.writerow([r["syllable"], r["treat_a"], r["treat_b"], r["n_a"], r["n_b"]]
+                            + [f"{r[k]:.6g}" for k in RESULT_FIELDS[5:]])
+    print(f"\nWrote {len(results)} contrasts to: {path}")
+
+
+def print_top(results, top=20):
+    print(f"# Top {min(top, len(results))} contrasts by permutation p")
+    print("# Columns: syllable\ttreat_a\ttreat_b\tdiff\tci_low\tci_high\tp_perm\tq_bh")
+    for r in sorted(results, key=lambda r: (r["p_perm"], -abs(r["diff"])))[:top]:
+        print(f"{r['syllable']}\t{r['treat_a']}\t{r['treat_b']}\t{r['diff']:.6f}\t"
+              f"{r['ci_low']:.6f}\t{r['ci_high']:.6f}\t{r['p_perm']:.4g}\t{r['q_bh']:.4g}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Bootstrap / permutation treatment contrasts per MoSeq syllable")
+    ap.add_argument("inputs", nargs="+", help="MoSeq usage .txt file(s); several are merged into one cohort")
+    group = ap.add_mutually_exclusive_group()
+    group.add_argument("--reference", help="contrast every treatment against this one")
+    group.add_argument("--pairs", help="comma-separated A:B treatment pairs (default: all pairs)")
+    ap.add_argument("--n-boot", type=int, default=2000, help="bootstrap resamples per contrast")
+    ap.add_argument("--n-perm", type=int, default=5000, help="label permutations per contrast")
+    ap.add_argument("--ci", type=float, default=95.0, help="confidence level of the bootstrap interval (%%)")
+    ap.add_argument("--seed", type=int, default=1, help="RNG seed (results do not depend on --workers)")
+    ap.add_argument("--workers", type=int, default=None, help="worker processes (1 = no pool; default: CPU count)")
+    ap.add_argument("--out", default=None, help="output CSV (default: <first input>_contrasts.csv)")
+    ap.add_argument("--top", type=int, default=20, help="contrasts to print, smallest p first")
+    args = ap.parse_args()
+
+    table = load_cohort(args.inputs, workers=args.workers)
+    pairs = choose_pairs(table.levels["treat"], args.reference, args.pairs)
+    n_sylls = len(table.levels["syllable"])
+    print(f"{len(table)} rows, {n_sylls} syllables, {len(pairs)} treatment pairs "
+          f"({args.n_boot} bootstrap / {args.n_perm} permutation resamples, seed {args.seed}, "
+          f"{'NumPy' if np is not None else 'pure Python'})")
+
+    results = run_contrasts(table, pairs, args.n_boot, args.n_perm, args.ci, args.seed, args.workers)
+    skipped = n_sylls * len(pairs) - len(results)
+    if skipped:
+        print(f"[Note] Skipped {skipped} contrast(s) with fewer than 2 values in a group.")
+    print_top(results, args.top)
+    out = args.out or f"{os.path.splitext(args.inputs[0])[0]}_contrasts.csv"
+    write_csv(results, out)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,60 +1,1064 @@
+import argparse
+import bisect
+import datetime
 import itertools
+import json
+import os
 import random
 import time
 import csv
+from concurrent.futures import ProcessPoolExecutor
 
-def allocation(filename, number_of_groups):
-    if not 1 < number_of_groups <= 10:
-        print("Invalid number of groups")
-        return
+# NumPy is optional: with it, all swap partners of an animal are scored in
+# one vectorised step during multi-variable refinement
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
-    print(f"Filename: {filename}")
-    index = {}
+# Balanced allocation: independent starts (plain greedy seed first, then
+# greedy seeds on jittered weights), each refined by pairwise swaps; the
+# best one wins. Starts run in worker processes unless WORKERS is 1.
+STARTS = 8
+WORKERS = None
+SEED_JITTER = 0.02
+# v1.0 random search, kept as the baseline the result is compared against
+BASELINE_SHUFFLES = 500
+MAX_GROUPS = 20
+# Multi-variable mode: weight of the variance imbalance of each column
+# relative to its mean imbalance
+VARIANCE_WEIGHT = 0.5
+# Interactive output; each run also writes <output stem>_report.json with
+# the seed, per-start objective trajectories, balance statistics and runtime
+OUTPUT_FILE = 'OUTPUT_zAllocator.txt'
+# Cohort files picked up by --batch
+BATCH_EXTENSIONS = ('.csv', '.txt')
 
-    # Creates an index, dictionary with {ID:Weights}
+
+def new_seed():
+    """Fresh seed for a run that was not given one (recorded in the report)."""
+    return random.SystemRandom().randrange(2 ** 32)
+
+
+def start_rng(seed, start):
+    """Generator of one start, from the run seed and the start number, so
+    a seed reproduces the same allocation whatever the number of workers."""
+    return random.Random(seed * 1_000_003 + start)
+
+
+def read_weights(filename):
+    """{ID: weight} from 'ID,weight' lines."""
+    index = {}
     with open(filename, 'r') as text_file:
         for l in text_file:
             result = l.strip('\n').strip().split(',')
-            index[result[0]] = int(result[1])
+            if len(result) < 2 or not result[0]:
+                continue
+            value = float(result[1])
+            index[result[0]] = int(value) if value.is_integer() else value
+    return index
+
+
+def group_sizes(n_animals, number_of_groups):
+    """Round-robin group sizes: the first n % groups groups get one more."""
+    base, extra = divmod(n_animals, number_of_groups)
+    return [base + (1 if i < extra else 0) for i in range(number_of_groups)]
+
+
+def check_groups(n_animals, number_of_groups):
+    if not 1 < number_of_groups <= MAX_GROUPS:
+        raise ValueError("Invalid number of groups")
+    if n_animals < number_of_groups:
+        raise ValueError(f"Only {n_animals} animals for {number_of_groups} groups")
 
+
+def mean_pairwise_diff(means):
+    """Mean |m_i - m_j| over all group pairs (the v1.0 balance score),
+    from the sorted means in O(G log G)."""
+    ordered = sorted(means)
+    g = len(ordered)
+    total = sum(m * (2 * k - (g - 1)) for k, m in enumerate(ordered))
+    return total / (g * (g - 1) // 2)
+
+
+def random_search(index, number_of_groups, iterations=BASELINE_SHUFFLES, rng=random):
+    """v1.0 allocation: best of `iterations` random round-robin shuffles.
+    Returns (score, groups)."""
     animal_IDs = list(index.keys())
 
     best_group_diff = float('inf')
     best_groups = [None] * number_of_groups
 
-    for _ in range(500):
-        random.shuffle(animal_IDs)
+    for _ in range(iterations):
+        rng.shuffle(animal_IDs)
         groups = [[] for _ in range(number_of_groups)]
 
         for i, animal_id in enumerate(animal_IDs):
             groups[i % number_of_groups].append(animal_id)
 
         avg_bws = [sum(index[animal_id] for animal_id in group) / len(group) for group in groups]
-        group_diff = sum(abs(avg_bws[i] - avg_bws[j]) for i in range(number_of_groups) for j in range(i + 1, number_of_groups)) / (number_of_groups * (number_of_groups - 1) // 2)
+        group_diff = mean_pairwise_diff(avg_bws)
 
         if group_diff < best_group_diff:
             best_group_diff = group_diff
             best_groups = [list(group) for group in groups]
+    return best_group_diff, best_groups
+
+
+def greedy_groups(index, sizes, rng=None):
+    """Heaviest animal first, each to the open group furthest below its
+    share of the total weight (largest-first / LPT seeding). With an rng
+    the order uses weights jittered by up to SEED_JITTER, for diverse
+    starts."""
+    mean_weight = sum(index.values()) / len(index)
+    groups = [[] for _ in sizes]
+    sums = [0.0] * len(sizes)
+    if rng is None:
+        order = sorted(index, key=index.get, reverse=True)
+    else:
+        jitter = {a: index[a] * (1 + rng.uniform(-SEED_JITTER, SEED_JITTER)) for a in index}
+        order = sorted(index, key=jitter.get, reverse=True)
+    for animal_id in order:
+        open_groups = [g for g in range(len(sizes)) if len(groups[g]) < sizes[g]]
+        g = min(open_groups, key=lambda g: sums[g] - mean_weight * sizes[g])
+        groups[g].append(animal_id)
+        sums[g] += index[animal_id]
+    return groups
+
+
+def _best_shift(means, sizes, g1, g2):
+    """
+    Weight difference d = w_in - w_out of a g1 <-> g2 swap that minimises
+    the score. Only the means of g1 and g2 move (by +d/s1 and -d/s2), so
+    the score is a convex piecewise-linear function of d and its minimum
+    lies on one of the breakpoints where two means meet.
+    """
+    s1, s2 = sizes[g1], sizes[g2]
+    m1, m2 = means[g1], means[g2]
+    breakpoints = [(m2 - m1) / (1 / s1 + 1 / s2)]
+    for j, m in enumerate(means):
+        if j != g1 and j != g2:
+            breakpoints.append((m - m1) * s1)
+            breakpoints.append((m2 - m) * s2)
+
+    def score(d):
+        shifted = list(means)
+        shifted[g1] = m1 + d / s1
+        shifted[g2] = m2 - d / s2
+        return mean_pairwise_diff(shifted)
+
+    return min(breakpoints, key=score)
+
+
+def refine_groups(index, groups):
+    """
+    Pairwise-exchange (Kernighan-Lin style) refinement: for each pair of
+    groups in turn, apply the best swap of two animals between them if it
+    improves the score; repeat rounds until a whole round improves nothing.
+    Each animal of the first group is only tried against the two animals
+    of the second group whose weights bracket the ideal weight difference
+    (_best_shift), found by bisection. Returns (score, groups, trajectory),
+    the trajectory being the score of the seed and after every round that
+    improved it.
+    """
+    groups = [list(group) for group in groups]
+    sizes = [len(group) for group in groups]
+    sums = [sum(index[a] for a in group) for group in groups]
+    means = [s / n for s, n in zip(sums, sizes)]
+    current = mean_pairwise_diff(means)
+    trajectory = [current]
+
+    improved = True
+    while improved:
+        improved = False
+        for g1, g2 in itertools.combinations(range(len(groups)), 2):
+            shift = _best_shift(means, sizes, g1, g2)
+            weights2 = sorted((index[b], b) for b in groups[g2])
+            keys2 = [w for w, _ in weights2]
+            best = None
+            for a in groups[g1]:
+                wa = index[a]
+                k = bisect.bisect_left(keys2, wa + shift)
+                for wb, b in weights2[max(0, k - 1):k + 1]:
+                    shifted = list(means)
+                    shifted[g1] = (sums[g1] - wa + wb) / sizes[g1]
+                    shifted[g2] = (sums[g2] - wb + wa) / sizes[g2]
+                    score = mean_pairwise_diff(shifted)
+                    if score < current - 1e-12 and (best is None or score < best[0]):
+                        best = (score, a, b)
+            if best is None:
+                continue
+            current, a, b = best
+            groups[g1][groups[g1].index(a)] = b
+            groups[g2][groups[g2].index(b)] = a
+            sums[g1] += index[b] - index[a]
+            sums[g2] += index[a] - index[b]
+            means[g1] = sums[g1] / sizes[g1]
+            means[g2] = sums[g2] / sizes[g2]
+            improved = True
+        if improved:
+            trajectory.append(current)
+    return current, groups, trajectory
+
+
+def run_starts(worker, jobs, workers=WORKERS):
+    """Run start jobs (in worker processes unless workers is 1). Returns
+    (best, results); ties go to the lowest start number."""
+    if workers == 1 or len(jobs) == 1:
+        results = [worker(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(worker, jobs))
+    return min(results, key=lambda result: result['score']), results
+
+
+def _allocation_start(job):
+    """One start of balanced_allocation: plain greedy seed for start 0,
+    jittered greedy seeds after that, then swap refinement."""
+    index, number_of_groups, seed, start = job
+    sizes = group_sizes(len(index), number_of_groups)
+    groups = greedy_groups(index, sizes, start_rng(seed, start) if start else None)
+    score, groups, trajectory = refine_groups(index, groups)
+    return {'start': start, 'score': score, 'trajectory': trajectory, 'groups': groups}
+
+
+def balanced_allocation(index, number_of_groups, starts=STARTS, workers=WORKERS, seed=None):
+    """Best of `starts` refined starts, as (best, results): result dicts
+    with the start number, score, objective trajectory and groups."""
+    seed = new_seed() if seed is None else seed
+    jobs = [(index, number_of_groups, seed, start) for start in range(starts)]
+    return run_starts(_allocation_start, jobs, workers)
 
-    print(f"\n\n\n{'=' * 40}")
-    for i, best_group in enumerate(best_groups):
-        print(f"Group {i + 1}: {best_group}")
-    print(f"{'=' * 40}\n")
 
-    with open('OUTPUT_zAllocator.txt', 'w') as results:
+def describe(values):
+    """n, mean, SD (population, as the balance score), min and max."""
+    n = len(values)
+    mean = sum(values) / n
+    return {'n': n, 'mean': mean,
+            'sd': (sum((x - mean) ** 2 for x in values) / n) ** 0.5,
+            'min': min(values), 'max': max(values)}
+
+
+def balance_stats(columns, groups):
+    """{column: [describe() of group 1, ..., of all animals]} from
+    per-column lists of values per group."""
+    stats = {}
+    for name, per_group in zip(columns, groups):
+        rows = [dict(group=str(g + 1), **describe(values)) for g, values in enumerate(per_group)]
+        rows.append(dict(group='All', **describe([x for values in per_group for x in values])))
+        stats[name] = rows
+    return stats
+
+
+def start_log(results):
+    """Per-start score and objective trajectory for the report."""
+    return [{'start': r['start'], 'score': r['score'], 'trajectory': r['trajectory']}
+            for r in results]
+
+
+def allocate_weights(index, number_of_groups, seed=None, starts=STARTS, workers=WORKERS):
+    """
+    Seeded weight-only allocation. Returns the report dict: seed, score,
+    best start, runtime, per-start trajectories, random-search baseline
+    (seeded from the same seed), weight statistics per group and the
+    groups themselves (lists of IDs under 'allocation').
+    """
+    check_groups(len(index), number_of_groups)
+    seed = new_seed() if seed is None else seed
+    t0 = time.perf_counter()
+    baseline_diff, _ = random_search(index, number_of_groups, rng=random.Random(seed))
+    t1 = time.perf_counter()
+    best, results = balanced_allocation(index, number_of_groups, starts, workers, seed)
+    t2 = time.perf_counter()
+    groups = best['groups']
+    return {
+        'mode': 'weight',
+        'objective': 'mean pairwise difference of group mean weights',
+        'animals': len(index),
+        'groups': number_of_groups,
+        'seed': seed,
+        'starts': starts,
+        'score': best['score'],
+        'best_start': best['start'],
+        'runtime_s': t2 - t1,
+        'baseline': {'method': 'random search', 'shuffles': BASELINE_SHUFFLES,
+                     'score': baseline_diff, 'runtime_s': t1 - t0},
+        'trajectories': start_log(results),
+        'balance': balance_stats(['weight'], [[[index[a] for a in group] for group in groups]]),
+        'allocation': {str(g + 1): group for g, group in enumerate(groups)},
+    }
+
+
+def report_path(output):
+    return f"{os.path.splitext(output)[0]}_report.json"
+
+
+def write_report(report, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=1)
+
+
+def run_details(report, filename, workers):
+    """Input file, date and environment, added to a report before writing."""
+    report['input'] = os.path.abspath(filename)
+    report['date'] = datetime.datetime.now().isoformat(timespec='seconds')
+    report['workers'] = workers
+    report['numpy'] = np is not None
+    return report
+
+
+def write_weight_output(index, groups, output):
+    with open(output, 'w') as results:
         results.write('\nOriginal input\n')
         for key, value in sorted(index.items()):
             results.write(f"{key},{value}\n")
 
-        for i, best_group in enumerate(best_groups):
+        for i, best_group in enumerate(groups):
             results.write(f"\nGroup {i + 1}\n")
             for key in best_group:
                 results.write(f"{key},{index[key]}\n")
 
-print("\n" + "=" * 80)
-print("LBS Animal Allocator Applet v1.0")
-print("=" * 80 + "\n\n")
-filename_input = input('Filename: ')
-number_of_groups = int(input('Number of groups (2 to 10): '))
-allocation(filename_input, number_of_groups)
-time.sleep(5)
+
+def allocation(filename, number_of_groups, starts=STARTS, workers=WORKERS, seed=None,
+               output=OUTPUT_FILE):
+    print(f"Filename: {filename}")
+    # Creates an index, dictionary with {ID:Weights}
+    index = read_weights(filename)
+    try:
+        report = allocate_weights(index, number_of_groups, seed, starts, workers)
+    except ValueError as e:
+        print(e)
+        return None
+    best_groups = list(report['allocation'].values())
+
+    print(f"\n\n\n{'=' * 40}")
+    for i, best_group in enumerate(best_groups):
+        print(f"Group {i + 1}: {best_group}")
+    print(f"{'=' * 40}")
+    print(f"Mean pairwise difference of group means: {report['score']:.4g} "
+          f"({starts} starts, {report['runtime_s']:.2f} s)")
+    print(f"Random search baseline ({BASELINE_SHUFFLES} shuffles): "
+          f"{report['baseline']['score']:.4g} ({report['baseline']['runtime_s']:.2f} s)")
+    print(f"Seed: {report['seed']} (pass it again to reproduce this allocation)")
+    print(f"{'=' * 40}\n")
+
+    write_weight_output(index, best_groups, output)
+    write_report(run_details(report, filename, workers), report_path(output))
+    return report
+
+
+
+# ---- multi-variable stratified allocation
+#
+# Input is a CSV with a header row and the animal ID in the first column,
+# e.g.  ID,weight,score,sex,cage
+# Numeric columns are balanced on group means and variances; stratification
+# columns (e.g. sex) and a block column (e.g. cage) are hard constraints:
+# every stratum and every block is spread over the groups as evenly as
+# possible (counts per group differ by at most one).
+
+def has_header(filename):
+    """True if the second field of the first line is not a number."""
+    with open(filename, 'r', newline='') as f:
+        first = next(csv.reader(f), [])
+    if len(first) < 2:
+        return False
+    try:
+        float(first[1])
+    except ValueError:
+        return True
+    return False
+
+
+def read_table(filename):
+    """(header, rows) of a CSV with a header row; blank rows skipped."""
+    with open(filename, 'r', newline='') as f:
+        reader = csv.reader(f)
+        header = [name.strip() for name in next(reader)]
+        rows = [[cell.strip() for cell in row] for row in reader
+                if row and any(cell.strip() for cell in row)]
+    return header, rows
+
+
+def parse_balance_spec(text, header):
+    """'weight:2,score' -> [('weight', 2.0), ('score', 1.0)]."""
+    spec = []
+    for item in text.split(','):
+        name, _, weight = item.strip().partition(':')
+        name = name.strip()
+        if not name:
+            continue
+        if name not in header:
+            raise ValueError(f"Unknown column '{name}' (columns: {', '.join(header)})")
+        spec.append((name, float(weight) if weight.strip() else 1.0))
+    return spec
+
+
+def parse_columns(text, header):
+    columns = [name.strip() for name in text.split(',') if name.strip()]
+    for name in columns:
+        if name not in header:
+            raise ValueError(f"Unknown column '{name}' (columns: {', '.join(header)})")
+    return columns
+
+
+def build_cohort(header, rows, balance, strata=(), block=None):
+    """
+    Cohort dict for stratified_allocation:
+      ids, rows        - animal IDs (first column) and raw CSV rows
+      columns, weights - balanced numeric columns and their weights
+      values           - per animal, one float per balanced column
+      cells            - (stratum, block) key per animal; swaps never
+                         cross cells, so the stratum and block spread of
+                         the seed is kept
+      mean, var        - cohort mean / variance per balanced column
+    Columns with no spread are dropped (nothing to balance).
+    """
+    col_index = {name: i for i, name in enumerate(header)}
+    values = []
+    bad = []
+    for row in rows:
+        try:
+            values.append([float(row[col_index[name]]) for name, _ in balance])
+        except (ValueError, IndexError):
+            bad.append(row[0] if row else '?')
+    if bad:
+        raise ValueError(f"Non-numeric or missing values for: {', '.join(bad[:10])}"
+                         + (" ..." if len(bad) > 10 else ""))
+
+    n = len(rows)
+    columns, weights, keep = [], [], []
+    means, variances = [], []
+    for k, (name, weight) in enumerate(balance):
+        column = [v[k] for v in values]
+        mean = sum(column) / n
+        var = sum((x - mean) ** 2 for x in column) / n
+        if var <= 0:
+            print(f"[Note] Column '{name}' has the same value for every animal; not balanced.")
+            continue
+        columns.append(name)
+        weights.append(weight)
+        keep.append(k)
+        means.append(mean)
+        variances.append(var)
+
+    cells = [(tuple(row[col_index[name]] for name in strata),
+              row[col_index[block]] if block else '') for row in rows]
+    return {
+        'ids': [row[0] for row in rows],
+        'rows': rows,
+        'header': header,
+        'columns': columns,
+        'weights': weights,
+        'values': [[v[k] for k in keep] for v in values],
+        'cells': cells,
+        'strata': list(strata),
+        'block': block,
+        'mean': means,
+        'var': variances,
+    }
+
+
+def stratified_seed(cohort, number_of_groups, rng=None):
+    """
+    Deal the animals cyclically to the groups in (stratum, block) order,
+    the group pointer carrying on from one cell to the next. Every
+    contiguous run of the deal - a cell, a stratum, the whole cohort -
+    ends up spread with at most one animal difference between groups.
+    Without an rng each cell is dealt heaviest-first on the first balanced
+    column; with one, in random order. When the blocks cross the strata a
+    block is not contiguous in the deal, and even_spread evens it out.
+    """
+    by_cell = {}
+    for i, cell in enumerate(cohort['cells']):
+        by_cell.setdefault(cell, []).append(i)
+    assignment = [0] * len(cohort['ids'])
+    pointer = 0
+    for cell in sorted(by_cell):
+        members = by_cell[cell]
+        if rng is None:
+            members.sort(key=lambda i: cohort['values'][i][0] if cohort['columns'] else 0,
+                         reverse=True)
+        else:
+            rng.shuffle(members)
+        for i in members:
+            assignment[i] = pointer
+            pointer = (pointer + 1) % number_of_groups
+    return even_spread(cohort, assignment, number_of_groups)
+
+
+def _uneven_pair(cohort, assignment, number_of_groups):
+    """(a, b): two groups more than one animal apart in some stratum, some
+    block or in size, a having more; None when everything is even."""
+    counts = {}
+    for (stratum, block), g in zip(cohort['cells'], assignment):
+        for node in (('stratum', stratum), ('block', block), ('all',)):
+            counts.setdefault(node, [0] * number_of_groups)[g] += 1
+    for per_group in counts.values():
+        a = max(range(number_of_groups), key=per_group.__getitem__)
+        b = min(range(number_of_groups), key=per_group.__getitem__)
+        if per_group[a] - per_group[b] > 1:
+            return a, b
+    return None
+
+
+def _recolour(cohort, assignment, a, b):
+    """
+    Reassign the animals of groups a and b so that a and b differ by at
+    most one animal in every stratum, every block and in size. Animals are
+    edges between their stratum and their block; every odd-degree vertex
+    gets an edge to one dummy vertex, the Euler circuits of the result are
+    cut at the dummy edges into trails, and each trail is dealt a, b, a, ...
+    A vertex inside a trail takes one a and one b per visit and is the end
+    of at most one trail; odd-length trails start with whichever group is
+    behind so far.
+    """
+    edges = [i for i, g in enumerate(assignment) if g in (a, b)]
+    ends = []
+    adjacency = {}
+    for i in edges:
+        stratum, block = cohort['cells'][i]
+        ends.append((('stratum', stratum), ('block', block)))
+        for node in ends[-1]:
+            adjacency.setdefault(node, []).append(len(ends) - 1)
+    for node in list(adjacency):
+        if len(adjacency[node]) % 2:
+            ends.append((node, None))
+            adjacency[node].append(len(ends) - 1)
+            adjacency.setdefault(None, []).append(len(ends) - 1)
+
+    used = [False] * len(ends)
+    position = dict.fromkeys(adjacency, 0)
+    trails = []
+    for start in adjacency:
+        # Hierholzer: the edges come off the stack as a closed trail
+        circuit = []
+        stack = [(start, None)]
+        while stack:
+            node, edge = stack[-1]
+            incident = adjacency[node]
+            while position[node] < len(incident) and used[incident[position[node]]]:
+                position[node] += 1
+            if position[node] == len(incident):
+                stack.pop()
+                if edge is not None:
+                    circuit.append(edge)
+                continue
+            e = incident[position[node]]
+            used[e] = True
+            u, v = ends[e]
+            stack.append((v if u == node else u, e))
+        dummies = [k for k, e in enumerate(circuit) if e >= len(edges)]
+        if not dummies:
+            trails.append(circuit)
+            continue
+        circuit = circuit[dummies[0] + 1:] + circuit[:dummies[0] + 1]
+        trail = []
+        for e in circuit:
+            if e < len(edges):
+                trail.append(e)
+            elif trail:
+                trails.append(trail)
+                trail = []
+
+    lead = 0
+    for trail in trails:
+        first, second = (a, b) if lead <= 0 else (b, a)
+        for k, e in enumerate(trail):
+            assignment[edges[e]] = second if k % 2 else first
+        if len(trail) % 2:
+            lead += 1 if first == a else -1
+
+
+def even_spread(cohort, assignment, number_of_groups):
+    """
+    Even out a block column that crosses the strata (e.g. cages or boxes
+    shared by both sexes), where dealing cell by cell leaves the blocks
+    uneven: while two groups are more than one animal apart in a stratum,
+    a block or in size, _recolour evens them out everywhere. This is an
+    equitable edge colouring of the stratum-block graph (de Werra), which
+    always exists; each step lowers the sum of squared counts, so the
+    loop ends. A nested design is already even and left as dealt.
+    """
+    pair = _uneven_pair(cohort, assignment, number_of_groups)
+    while pair is not None:
+        _recolour(cohort, assignment, *pair)
+        pair = _uneven_pair(cohort, assignment, number_of_groups)
+    return assignment
+
+
+def group_term(cohort, count, sums, sumsq):
+    """Imbalance of one group from its count and per-column sums / sums
+    of squares: standardised squared deviation of the group mean plus
+    VARIANCE_WEIGHT x relative squared deviation of the group variance,
+    weighted per column."""
+    term = 0.0
+    for k, weight in enumerate(cohort['weights']):
+        mean = sums[k] / count
+        var = sumsq[k] / count - mean * mean
+        pop_var = cohort['var'][k]
+        term += weight * ((mean - cohort['mean'][k]) ** 2 / pop_var
+                          + VARIANCE_WEIGHT * ((var - pop_var) / pop_var) ** 2)
+    return term
+
+
+def group_stats(cohort, assignment, number_of_groups):
+    n_cols = len(cohort['columns'])
+    counts = [0] * number_of_groups
+    sums = [[0.0] * n_cols for _ in range(number_of_groups)]
+    sumsq = [[0.0] * n_cols for _ in range(number_of_groups)]
+    for i, g in enumerate(assignment):
+        counts[g] += 1
+        for k, x in enumerate(cohort['values'][i]):
+            sums[g][k] += x
+            sumsq[g][k] += x * x
+    return counts, sums, sumsq
+
+
+def multi_objective(cohort, assignment, number_of_groups):
+    """Mean group imbalance (see group_term); 0 = perfectly balanced."""
+    counts, sums, sumsq = group_stats(cohort, assignment, number_of_groups)
+    return sum(group_term(cohort, counts[g], sums[g], sumsq[g])
+               for g in range(number_of_groups)) / number_of_groups
+
+
+class GroupState:
+    """
+    Running per-group counts, column sums and sums of squares of an
+    assignment, plus each group's imbalance term (group_term). A swap only
+    changes two groups, so candidates are scored from these sums without
+    touching the other groups, and applying a swap updates two rows.
+    With NumPy, best_swap scores all partners of an animal at once.
+    """
+
+    def __init__(self, cohort, assignment, number_of_groups):
+        self.cohort = cohort
+        self.number_of_groups = number_of_groups
+        self.assignment = list(assignment)
+        counts, sums, sumsq = group_stats(cohort, assignment, number_of_groups)
+        if np is not None:
+            n_cols = len(cohort['columns'])
+            self.values = np.asarray(cohort['values'], dtype=float).reshape(len(assignment), n_cols)
+            self.groups = np.asarray(assignment, dtype=np.intp)
+            self.counts = np.asarray(counts, dtype=float)
+            self.sums = np.asarray(sums, dtype=float).reshape(number_of_groups, n_cols)
+            self.sumsq = np.asarray(sumsq, dtype=float).reshape(number_of_groups, n_cols)
+            self.weights = np.asarray(cohort['weights'], dtype=float)
+            self.mean = np.asarray(cohort['mean'], dtype=float)
+            self.var = np.asarray(cohort['var'], dtype=float)
+            self.terms = self._terms(self.counts, self.sums, self.sumsq)
+        else:
+            self.values = cohort['values']
+            self.counts, self.sums, self.sumsq = counts, sums, sumsq
+            self.terms = [group_term(cohort, counts[g], sums[g], sumsq[g])
+                          for g in range(number_of_groups)]
+
+    def _terms(self, counts, sums, sumsq):
+        """group_term for a stack of (count, sums, sumsq) rows."""
+        mean = sums / counts[:, None]
+        var = sumsq / counts[:, None] - mean * mean
+        return (self.weights * ((mean - self.mean) ** 2 / self.var
+                                + VARIANCE_WEIGHT * ((var - self.var) / self.var) ** 2)).sum(axis=1)
+
+    def score(self):
+        return float(sum(self.terms)) / self.number_of_groups
+
+    def best_swap(self, i, members):
+        """(delta, j) of the best improving swap of animal i with one of
+        `members` (same cell) in another group, or None."""
+        g1 = self.assignment[i]
+        if np is not None:
+            candidates = members[self.groups[members] != g1]
+            if not len(candidates):
+                return None
+            g2 = self.groups[candidates]
+            xi, xj = self.values[i], self.values[candidates]
+            d = xj - xi
+            d2 = xj * xj - xi * xi
+            t1 = self._terms(np.full(len(candidates), self.counts[g1]),
+                             self.sums[g1] + d, self.sumsq[g1] + d2)
+            t2 = self._terms(self.counts[g2], self.sums[g2] - d, self.sumsq[g2] - d2)
+            delta = t1 + t2 - self.terms[g1] - self.terms[g2]
+            k = int(np.argmin(delta))
+            if delta[k] < -1e-12:
+                return float(delta[k]), int(candidates[k])
+            return None
+
+        cohort = self.cohort
+        xi = self.values[i]
+        best = None
+        for j in members:
+            g2 = self.assignment[j]
+            if g2 == g1:
+                continue
+            xj = self.values[j]
+            s1 = [s + b - a for s, a, b in zip(self.sums[g1], xi, xj)]
+            q1 = [q + b * b - a * a for q, a, b in zip(self.sumsq[g1], xi, xj)]
+            s2 = [s + a - b for s, a, b in zip(self.sums[g2], xi, xj)]
+            q2 = [q + a * a - b * b for q, a, b in zip(self.sumsq[g2], xi, xj)]
+            delta = (group_term(cohort, self.counts[g1], s1, q1)
+                     + group_term(cohort, self.counts[g2], s2, q2)
+                     - self.terms[g1] - self.terms[g2])
+            if delta < -1e-12 and (best is None or delta < best[0]):
+                best = (delta, j)
+        return best
+
+    def swap(self, i, j):
+        g1, g2 = self.assignment[i], self.assignment[j]
+        self.assignment[i], self.assignment[j] = g2, g1
+        if np is not None:
+            self.groups[i], self.groups[j] = g2, g1
+            d = self.values[j] - self.values[i]
+            d2 = self.values[j] ** 2 - self.values[i] ** 2
+            self.sums[g1] += d
+            self.sumsq[g1] += d2
+            self.sums[g2] -= d
+            self.sumsq[g2] -= d2
+            rows = [g1, g2]
+            self.terms[rows] = self._terms(self.counts[rows], self.sums[rows], self.sumsq[rows])
+            return
+        xi, xj = self.values[i], self.values[j]
+        self.sums[g1] = [s + b - a for s, a, b in zip(self.sums[g1], xi, xj)]
+        self.sumsq[g1] = [q + b * b - a * a for q, a, b in zip(self.sumsq[g1], xi, xj)]
+        self.sums[g2] = [s + a - b for s, a, b in zip(self.sums[g2], xi, xj)]
+        self.sumsq[g2] = [q + a * a - b * b for q, a, b in zip(self.sumsq[g2], xi, xj)]
+        for g in (g1, g2):
+            self.terms[g] = group_term(self.cohort, self.counts[g], self.sums[g], self.sumsq[g])
+
+
+def refine_stratified(cohort, assignment, number_of_groups):
+    """
+    Swap refinement under the stratification constraints: only two animals
+    of the same (stratum, block) cell in different groups are swapped, so
+    every count constraint of the seed holds throughout. Each animal in
+    turn is swapped with its best partner in the cell if that improves
+    the score; rounds repeat until none does. Candidates are scored
+    incrementally from the running group sums (GroupState).
+    Returns (score, assignment, trajectory), the trajectory being the
+    score of the seed and after every round that improved it.
+    """
+    state = GroupState(cohort, assignment, number_of_groups)
+    trajectory = [state.score()]
+
+    by_cell = {}
+    for i, cell in enumerate(cohort['cells']):
+        by_cell.setdefault(cell, []).append(i)
+    cells = [members for members in by_cell.values() if len(members) > 1]
+    if np is not None:
+        cells = [np.asarray(members, dtype=np.intp) for members in cells]
+
+    improved = True
+    while improved:
+        improved = False
+        for members in cells:
+            for i in members:
+                best = state.best_swap(int(i), members)
+                if best is not None:
+                    state.swap(int(i), best[1])
+                    improved = True
+        if improved:
+            trajectory.append(state.score())
+    return state.score(), state.assignment, trajectory
+
+
+def _stratified_start(job):
+    cohort, number_of_groups, seed, start = job
+    assignment = stratified_seed(cohort, number_of_groups,
+                                 start_rng(seed, start) if start else None)
+    score, assignment, trajectory = refine_stratified(cohort, assignment, number_of_groups)
+    return {'start': start, 'score': score, 'trajectory': trajectory, 'assignment': assignment}
+
+
+def stratified_allocation(cohort, number_of_groups, starts=STARTS, workers=WORKERS, seed=None):
+    """Best of `starts` refined stratified starts, as (best, results):
+    result dicts with the start number, score, objective trajectory and
+    assignment (assignment[i] is the group index of animal i)."""
+    seed = new_seed() if seed is None else seed
+    jobs = [(cohort, number_of_groups, seed, start) for start in range(starts)]
+    return run_starts(_stratified_start, jobs, workers)
+
+
+def spread_counts(cohort, assignment, number_of_groups):
+    """{label: {level: [count per group]}} for the stratification columns
+    (levels joined with '/') and the block column."""
+    spread = {}
+    for label, key in ((', '.join(cohort['strata']), lambda cell: cell[0]),
+                       (cohort['block'], lambda cell: cell[1])):
+        if not label:
+            continue
+        counts = {}
+        for cell, g in zip(cohort['cells'], assignment):
+            level = key(cell)
+            name = '/'.join(level) if isinstance(level, tuple) else level
+            counts.setdefault(name, [0] * number_of_groups)[g] += 1
+        spread[label] = dict(sorted(counts.items()))
+    return spread
+
+
+def check_spread(spread):
+    """ValueError unless every stratum and block level is spread over the
+    groups with at most one animal difference."""
+    for label, levels in spread.items():
+        for name, per_group in levels.items():
+            if max(per_group) - min(per_group) > 1:
+                raise ValueError(f"{label} {name} is spread unevenly over the groups: {per_group}")
+
+
+def balance_lines(cohort, assignment, number_of_groups):
+    """Per-group n, mean (SD) of each balanced column and stratum / block
+    counts, as text lines."""
+    counts, sums, sumsq = group_stats(cohort, assignment, number_of_groups)
+    lines = ["Group\tn\t" + "\t".join(f"{name} mean (SD)" for name in cohort['columns'])]
+    for g in range(number_of_groups):
+        cells = []
+        for k in range(len(cohort['columns'])):
+            mean = sums[g][k] / counts[g]
+            sd = max(0.0, sumsq[g][k] / counts[g] - mean * mean) ** 0.5
+            cells.append(f"{mean:.4g} ({sd:.3g})")
+        lines.append(f"{g + 1}\t{counts[g]}\t" + "\t".join(cells))
+    lines.append("All\t" + f"{len(assignment)}\t" + "\t".join(
+        f"{m:.4g} ({v ** 0.5:.3g})" for m, v in zip(cohort['mean'], cohort['var'])))
+
+    for label, levels in spread_counts(cohort, assignment, number_of_groups).items():
+        lines.append("")
+        lines.append(f"{label}\t" + "\t".join(f"G{g + 1}" for g in range(number_of_groups)))
+        for name, per_group in levels.items():
+            lines.append(f"{name}\t" + "\t".join(str(c) for c in per_group))
+    return lines
+
+
+def allocate_stratified(cohort, number_of_groups, seed=None, starts=STARTS, workers=WORKERS):
+    """
+    Seeded multi-variable allocation. Returns (report, assignment); the
+    report dict holds the settings, seed, score, best start, runtime,
+    per-start trajectories, statistics of every balanced column per group,
+    stratum / block spread and the groups (lists of IDs, 'allocation').
+    The reported score is recomputed from scratch (multi_objective) rather
+    than taken from the running sums the refinement updates swap by swap.
+    """
+    check_groups(len(cohort['ids']), number_of_groups)
+    seed = new_seed() if seed is None else seed
+    t0 = time.perf_counter()
+    best, results = stratified_allocation(cohort, number_of_groups, starts, workers, seed)
+    runtime = time.perf_counter() - t0
+    assignment = best['assignment']
+    members = [[i for i, a in enumerate(assignment) if a == g] for g in range(number_of_groups)]
+    spread = spread_counts(cohort, assignment, number_of_groups)
+    check_spread(spread)
+    report = {
+        'mode': 'stratified',
+        'objective': 'mean group imbalance of column means and variances',
+        'settings': {'columns': dict(zip(cohort['columns'], cohort['weights'])),
+                     'strata': cohort['strata'], 'block': cohort['block'],
+                     'variance_weight': VARIANCE_WEIGHT},
+        'animals': len(cohort['ids']),
+        'groups': number_of_groups,
+        'seed': seed,
+        'starts': starts,
+        'score': multi_objective(cohort, assignment, number_of_groups),
+        'best_start': best['start'],
+        'runtime_s': runtime,
+        'trajectories': start_log(results),
+        'balance': balance_stats(cohort['columns'], [
+            [[cohort['values'][i][k] for i in group] for group in members]
+            for k in range(len(cohort['columns']))]),
+        'spread': spread,
+        'allocation': {str(g + 1): [cohort['ids'][i] for i in group]
+                       for g, group in enumerate(members)},
+    }
+    return report, assignment
+
+
+def write_table_output(cohort, assignment, number_of_groups, lines, output):
+    with open(output, 'w', newline='') as results:
+        writer = csv.writer(results)
+        results.write('\nOriginal input\n')
+        writer.writerow(cohort['header'])
+        writer.writerows(cohort['rows'])
+
+        for g in range(number_of_groups):
+            results.write(f"\nGroup {g + 1}\n")
+            writer.writerows(row for row, a in zip(cohort['rows'], assignment) if a == g)
+
+        results.write("\nBalance\n")
+        results.write("\n".join(lines) + "\n")
+
+
+def stratified_mode(filename, number_of_groups, balance, strata=(), block=None,
+                    starts=STARTS, workers=WORKERS, seed=None, output=OUTPUT_FILE):
+    header, rows = read_table(filename)
+    cohort = build_cohort(header, rows, balance, strata, block)
+    try:
+        report, assignment = allocate_stratified(cohort, number_of_groups, seed, starts, workers)
+    except ValueError as e:
+        print(e)
+        return None
+    lines = balance_lines(cohort, assignment, number_of_groups)
+
+    print(f"\n\n\n{'=' * 40}")
+    for g, ids in report['allocation'].items():
+        print(f"Group {g}: {ids}")
+    print(f"{'=' * 40}")
+    print("\n".join(lines))
+    print(f"{'=' * 40}")
+    print(f"Imbalance score: {report['score']:.4g} ({starts} starts, {report['runtime_s']:.2f} s)")
+    print(f"Seed: {report['seed']} (pass it again to reproduce this allocation)")
+    print(f"{'=' * 40}\n")
+
+    write_table_output(cohort, assignment, number_of_groups, lines, output)
+    write_report(run_details(report, filename, workers), report_path(output))
+    return report
+
+
+# ---- batch mode: every cohort file of a folder, one worker process each
+
+def numeric_columns(header, rows, exclude=()):
+    """Columns after the ID whose every value is a number (default balance
+    set for --batch)."""
+    columns = []
+    for k, name in enumerate(header[1:], 1):
+        if name in exclude:
+            continue
+        try:
+            for row in rows:
+                float(row[k])
+        except (ValueError, IndexError):
+            continue
+        columns.append(name)
+    return columns
+
+
+def _batch_cohort(job):
+    """
+    Allocate one cohort file of a batch: 'ID,weight' files by weight,
+    files with a header row on the requested (or all numeric) columns.
+    Starts run in this process; the batch is parallel over cohorts.
+    Returns a summary dict for the batch summary.
+    """
+    filename, number_of_groups, balance_text, strata_text, block, seed, starts, out_dir = job
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    output = os.path.join(out_dir, f"{stem}_allocation.txt")
+    summary = {'file': os.path.basename(filename), 'mode': '', 'animals': '', 'score': '',
+               'baseline': '', 'runtime_s': '', 'output': os.path.basename(output), 'status': 'OK'}
+    try:
+        if has_header(filename):
+            header, rows = read_table(filename)
+            strata = parse_columns(strata_text, header)
+            if block:
+                parse_columns(block, header)
+            balance = (parse_balance_spec(balance_text, header) if balance_text else
+                       [(name, 1.0) for name in
+                        numeric_columns(header, rows, set(strata) | {block})])
+            cohort = build_cohort(header, rows, balance, strata, block)
+            report, assignment = allocate_stratified(cohort, number_of_groups, seed, starts, 1)
+            write_table_output(cohort, assignment, number_of_groups,
+                               balance_lines(cohort, assignment, number_of_groups), output)
+        else:
+            index = read_weights(filename)
+            report = allocate_weights(index, number_of_groups, seed, starts, 1)
+            write_weight_output(index, list(report['allocation'].values()), output)
+            summary['baseline'] = f"{report['baseline']['score']:.6g}"
+    except (OSError, ValueError, IndexError, ZeroDivisionError) as e:
+        summary.update(output='', status=f"ERROR: {e}")
+        return summary
+    write_report(run_details(report, filename, 1), report_path(output))
+    summary.update(mode=report['mode'], animals=report['animals'],
+                   score=f"{report['score']:.6g}", runtime_s=f"{report['runtime_s']:.3f}")
+    return summary
+
+
+def batch_allocate(folder, number_of_groups, balance_text='', strata_text='', block=None,
+                   seed=None, starts=STARTS, workers=WORKERS, out_dir=None):
+    """
+    Allocate every .csv / .txt cohort in `folder` in parallel worker
+    processes. Each cohort gets <name>_allocation.txt and
+    <name>_allocation_report.json in out_dir (default: <folder>/zAllocator_output),
+    and batch_summary.csv lists them all. Every cohort uses the same seed,
+    so a cohort's allocation does not depend on the rest of the folder.
+    """
+    out_dir = out_dir or os.path.join(folder, 'zAllocator_output')
+    files = sorted(os.path.join(folder, name) for name in os.listdir(folder)
+                   if name.lower().endswith(BATCH_EXTENSIONS)
+                   and not name.startswith('OUTPUT_zAllocator')
+                   and os.path.isfile(os.path.join(folder, name)))
+    if not files:
+        print(f"No cohort files in {folder}.")
+        return None
+    os.makedirs(out_dir, exist_ok=True)
+    seed = new_seed() if seed is None else seed
+
+    print(f"Allocating {len(files)} cohorts into {number_of_groups} groups (seed {seed})...")
+    jobs = [(filename, number_of_groups, balance_text, strata_text, block, seed, starts, out_dir)
+            for filename in files]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        summaries = list(pool.map(_batch_cohort, jobs))
+
+    summary_file = os.path.join(out_dir, 'batch_summary.csv')
+    with open(summary_file, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=['seed', 'groups'] + list(summaries[0]))
+        writer.writeheader()
+        for summary in summaries:
+            writer.writerow(dict(summary, seed=seed, groups=number_of_groups))
+
+    failed = [s for s in summaries if s['status'] != 'OK']
+    for summary in failed:
+        print(f"  {summary['file']}: {summary['status']}")
+    print(f"Done: {len(summaries) - len(failed)} cohorts allocated, {len(failed)} failed.")
+    print(f"Summary saved as: {summary_file}")
+    return summaries
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Balanced allocation of animals to groups")
+    ap.add_argument("--batch", metavar="FOLDER",
+                    help="allocate every .csv / .txt cohort file in this folder")
+    ap.add_argument("--groups", type=int, default=None, help="number of groups (--batch)")
+    ap.add_argument("--balance", default='',
+                    help="columns to balance for header files, e.g. weight:2,score "
+                         "(default: all numeric columns)")
+    ap.add_argument("--strata", default='', help="stratification columns, e.g. sex")
+    ap.add_argument("--block", default=None, help="block column, e.g. cage")
+    ap.add_argument("--seed", type=int, default=None,
+                    help="RNG seed (default: a fresh one, recorded in the report)")
+    ap.add_argument("--starts", type=int, default=STARTS, help="refined starts per cohort")
+    ap.add_argument("--workers", type=int, default=WORKERS,
+                    help="worker processes (1 = no pool; default: CPU count)")
+    ap.add_argument("--out", default=None, help="output folder for --batch")
+    args = ap.parse_args()
+    if args.batch:
+        if args.groups is None:
+            ap.error("--batch needs --groups")
+        if not 1 < args.groups <= MAX_GROUPS:
+            ap.error(f"--groups must be 2 to {MAX_GROUPS}")
+        batch_allocate(args.batch, args.groups, args.balance, args.strata, args.block,
+                       args.seed, args.starts, args.workers, args.out)
+        return
+
+    print("\n" + "=" * 80)
+    print("LBS Animal Allocator Applet v1.0")
+    print("=" * 80 + "\n\n")
+    filename_input = input('Filename: ')
+    number_of_groups = int(input(f'Number of groups (2 to {MAX_GROUPS}): '))
+    seed = args.seed
+    if seed is None:
+        seed_text = input('Seed (blank for a new one): ').strip()
+        seed = int(seed_text) if seed_text else None
+    if has_header(filename_input):
+        header, _ = read_table(filename_input)
+        print(f"Columns: {', '.join(header)}")
+        balance = parse_balance_spec(
+            input('Numeric columns to balance, optional weight after ":" (e.g. weight:2,score): '),
+            header)
+        strata = parse_columns(input('Stratify by (e.g. sex, blank for none): '), header)
+        block = input('Block by (e.g. cage, blank for none): ').strip() or None
+        if block:
+            parse_columns(block, header)
+        stratified_mode(filename_input, number_of_groups, balance, strata, block,
+                        args.starts, args.workers, seed)
+    else:
+        allocation(filename_input, number_of_groups, args.starts, args.workers, seed)
+    time.sleep(5)
+
+
+if __name__ == "__main__":
+    main()
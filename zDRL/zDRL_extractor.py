@@ -2,12 +2,25 @@
 # v2 20250908 - added pellet cap on top of time cap to schedule and fixed what directory this thing looks for data.
 # v3 20251006 - corrected the binned data sorter so that time bins are represented in seconds instead. function bin_irts(irt_strings) has been modified for this and it now filters 0.200 as well
 # v4 20251009 - added per-animal IRT statistics (median, mean, SEM) using IRTs >= 2s, no external libraries
+# v5 20261019 - MedPC exports are parsed line by line (one session in memory at a time); every scalar (A-Z) and array (F:, T:, ...) is kept per session
+# v6 20261019 - batch mode: `python zDRL_extractor.py --batch FOLDER` processes every MedPC export in a folder in parallel, skips exports whose CSV is up to date, and writes one longitudinal CSV
+# v7 20261019 - IRTs are converted once per session and binned with bisect; bin schemes (e.g. 2 s, 1 s, log-spaced) are read from zDRL_bins.txt and all emitted in the same pass
+# v8 20261019 - batch mode keeps per-session summaries in FOLDER/zDRL_sessions.sqlite (only new or changed exports are parsed) and writes per-animal trajectories (efficiency B/A, IRT distribution, bursts)
 
 import os
 import re
 import csv
 import sys
 import math
+import bisect
+import hashlib
+import json
+import sqlite3
+import argparse
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from itertools import chain
 
 # ----- Configuration: IRT bins -----
 BIN_LABELS = [
@@ -19,41 +32,144 @@ BIN_LABELS = [
 BIN_EDGES = [(0,2),(2,4),(4,6),(6,8),(8,10),(10,12),(12,14),(14,16),
              (16,18),(18,20),(20,22),(22,24),(24,26),(26,28),(28,30),(30,32),(32,34)]
 
-def parse_sessions(text):
-    """Yield session dicts with parsed fields and raw IRT values (as strings)."""
-    chunks = re.split(r'(?=Start Date:)', text)
-    for chunk in chunks:
-        if not chunk.strip():
-            continue
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+# Optional bin schemes, one per line "name: edge edge edge ..." (seconds).
+# The first scheme gives the plain bin columns; the others add <name>_<bin> columns.
+BIN_CONFIG = 'zDRL_bins.txt'
 
-        m = {
-            'Date':                re.search(r'Start Date:\s*(\S+)', chunk),
-            'AnimalID':            re.search(r'Box:\s*(\d+)', chunk),
-            'StartTime':           re.search(r'Start Time:\s*([\d:]+)', chunk),
-            'EndTime':             re.search(r'End Time:\s*([\d:]+)', chunk),
-            'TotalResponses':      re.search(r'^\s*A:\s*([\d.]+)', chunk, re.MULTILINE),
-            'ReinforcedResponses': re.search(r'^\s*B:\s*([\d.]+)', chunk, re.MULTILINE),
-        }
-        if not all(m.values()):
-            continue
+class BinScheme:
+    """
+    A named set of IRT bins. edges are sorted, non-overlapping (start, end)
+    pairs in seconds: start <= x < end, and the last bin also includes its end.
+    Each value is placed with one bisect over the bin starts.
+    """
+    def __init__(self, name, edges, labels=None):
+        self.name = name
+        self.edges = list(edges)
+        self.labels = labels or [f"{lo:g}-{hi:g}s" for lo, hi in self.edges]
+        self.starts = [lo for lo, _ in self.edges]
+
+    def count(self, irts):
+        """Counts per bin (list, in bin order); out-of-range values are ignored."""
+        counts = [0] * len(self.edges)
+        last = len(self.edges) - 1
+        for v in irts:
+            i = bisect.bisect_right(self.starts, v) - 1
+            if i < 0:
+                continue
+            hi = self.edges[i][1]
+            if v < hi or (i == last and v == hi):
+                counts[i] += 1
+        return counts
+
+DEFAULT_BIN_SCHEME = BinScheme('2s', BIN_EDGES, BIN_LABELS)
+
+def read_bin_schemes(filename):
+    """
+    Bin schemes from lines like "1s: 0 1 2 3 ... 34" (increasing edges in
+    seconds; '#' starts a comment). Returns a list of BinScheme, or None when
+    the file is missing or holds no valid scheme.
+    """
+    try:
+        with open(filename, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+    except OSError:
+        return None
 
-        # Pull out IRT values after the "T:" block
-        lines = chunk.splitlines()
+    schemes = []
+    for n, line in enumerate(lines, 1):
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        name, sep, rest = line.partition(':')
         try:
-            t_index = next(i for i, L in enumerate(lines) if L.strip() == 'T:')
-        except StopIteration:
-            t_values_raw = []
-        else:
-            t_values_raw = []
-            for L in lines[t_index+1:]:
-                if re.match(r'^\s*\d+:', L):
-                    vals = L.split(':', 1)[1].strip().split()
-                    t_values_raw.extend(vals)
+            edges = [float(tok) for tok in rest.replace(',', ' ').split()]
+        except ValueError:
+            edges = []
+        name = name.strip()
+        if (not sep or not name or len(edges) < 2
+                or any(b <= a for a, b in zip(edges, edges[1:]))
+                or any(name == other.name for other in schemes)):
+            print(f"▶ {os.path.basename(filename)} line {n}: expected 'name: edge edge ...' "
+                  f"with a new name and increasing edges; skipped.")
+            continue
+        schemes.append(BinScheme(name, list(zip(edges, edges[1:]))))
+    return schemes or None
+
+BIN_SCHEMES = read_bin_schemes(os.path.join(SCRIPT_DIR, BIN_CONFIG)) or [DEFAULT_BIN_SCHEME]
+
+def bin_columns(scheme, primary):
+    return list(scheme.labels) if primary else [f"{scheme.name}_{label}" for label in scheme.labels]
+
+# ----- MedPC export parsing -----
+ARRAY_ROW_RE = re.compile(r'^\s*\d+:(.*)$')                 # "    10:   25.100   11.100 ..."
+VARIABLE_RE  = re.compile(r'^\s*([A-Z]):\s*(.*?)\s*$')       # "A:     423.000" or "T:" (array start)
+HEADER_RE    = re.compile(r'^\s*([A-Za-z][A-Za-z ]*?):\s*(.*?)\s*$')  # "Start Date: 09/02/25", "MSN: ..."
+
+# Summary fields: (session key, section, name, pattern the value must start with)
+SESSION_FIELDS = [
+    ('Date',                'header',  'Start Date', re.compile(r'\S+')),
+    ('AnimalID',            'header',  'Box',        re.compile(r'\d+')),
+    ('StartTime',           'header',  'Start Time', re.compile(r'[\d:]+')),
+    ('EndTime',             'header',  'End Time',   re.compile(r'[\d:]+')),
+    ('TotalResponses',      'scalars', 'A',          re.compile(r'[\d.]+')),
+    ('ReinforcedResponses', 'scalars', 'B',          re.compile(r'[\d.]+')),
+]
+
+def finish_session(session):
+    """Fill the summary fields of a parsed session; None if any is missing."""
+    for key, section, name, pattern in SESSION_FIELDS:
+        m = pattern.match(session[section].get(name, ''))
+        if not m:
+            return None
+        session[key] = m.group(0)
+    session['IRT_values_raw'] = session['arrays'].get('T', [])
+    return session
+
+def parse_sessions(lines):
+    """
+    Yield session dicts from a MedPC export, reading it line by line.
+    `lines` is any iterable of text lines (an open file streams in constant
+    memory; only the session being read is held).
+    Each session holds 'header' (Start Date, Box, MSN, ...), 'scalars'
+    (A-Z -> raw string), 'arrays' (F, T, ... -> list of raw value strings),
+    the summary fields Date, AnimalID, StartTime, EndTime, TotalResponses,
+    ReinforcedResponses and 'IRT_values_raw' (the T: array).
+    Sessions missing a summary field are skipped.
+    """
+    session = None
+    array = None        # value list of the array block being read, if any
+    for line in lines:
+        if array is not None:
+            m = ARRAY_ROW_RE.match(line)
+            if m:
+                array.extend(m.group(1).split())
+                continue
+            array = None
+
+        m = VARIABLE_RE.match(line)
+        if m:
+            if session is not None:
+                name, value = m.groups()
+                if value:
+                    session['scalars'].setdefault(name, value)
+                elif name in session['arrays']:
+                    array = []  # repeated block: keep the first one
                 else:
-                    break
+                    array = session['arrays'][name] = []
+            continue
+
+        m = HEADER_RE.match(line)
+        if m:
+            label, value = m.groups()
+            if label == 'Start Date':
+                if session is not None and finish_session(session):
+                    yield session
+                session = {'header': {}, 'scalars': {}, 'arrays': {}}
+            if session is not None:
+                session['header'].setdefault(label, value)
 
-        session = {k: v.group(1) for k, v in m.items()}
-        session['IRT_values_raw'] = t_values_raw
+    if session is not None and finish_session(session):
         yield session
 
 def convert_filter_irts_seconds(irt_strings):
@@ -77,29 +193,6 @@ def convert_filter_irts_seconds(irt_strings):
             continue
     return irts_sec
 
-def bin_irts(irt_strings):
-    """Convert list of IRT strings to counts per configured bins (in seconds)."""
-    counts = {label: 0 for label in BIN_LABELS}
-    irts = convert_filter_irts_seconds(irt_strings)
-
-    # Tally into bins
-    for v in irts:
-        placed = False
-        for i, (lo, hi) in enumerate(BIN_EDGES):
-            if i < len(BIN_EDGES) - 1:
-                if lo <= v < hi:
-                    counts[BIN_LABELS[i]] += 1
-                    placed = True
-                    break
-            else:
-                # Last bin: include the upper bound
-                if lo <= v <= hi:
-                    counts[BIN_LABELS[i]] += 1
-                    placed = True
-                    break
-        # If not placed, ignore out-of-range values
-    return counts
-
 def median(values):
     """Compute median of a non-empty list without external libs."""
     n = len(values)
@@ -147,66 +240,423 @@ def choose_file(script_dir):
             return files[idx-1]
         print(f"▶ Number must be between 1 and {len(files)}.")
 
+# CSV columns: session metadata + IRT bin counts + stats (>=2s)
+FIELDNAMES = [
+    'Date','AnimalID','StartTime','EndTime','TotalResponses','ReinforcedResponses',
+    'Median_IRT_ge2s','Mean_IRT_ge2s','SEM_IRT_ge2s'
+] + [col for i, scheme in enumerate(BIN_SCHEMES) for col in bin_columns(scheme, i == 0)]
+
+def session_row(sess, irts_sec=None):
+    """One output CSV row (dict keyed by FIELDNAMES) for a parsed session."""
+    row = {
+        'Date': sess['Date'],
+        'AnimalID': sess['AnimalID'],
+        'StartTime': sess['StartTime'],
+        'EndTime': sess['EndTime'],
+        'TotalResponses': sess['TotalResponses'],
+        'ReinforcedResponses': sess['ReinforcedResponses'],
+    }
+
+    # Stats: compute from IRTs in seconds, excluding values < 2 s
+    if irts_sec is None:
+        irts_sec = convert_filter_irts_seconds(sess.get('IRT_values_raw', []))
+    irts_ge2 = [x for x in irts_sec if x >= 2.0]
+
+    m_med = median(irts_ge2)
+    m_mean = mean(irts_ge2)
+    m_sem  = sem(irts_ge2)
+
+    # Store as strings with sensible formatting; blanks if None
+    row['Median_IRT_ge2s'] = (f"{m_med:.3f}" if m_med is not None else "")
+    row['Mean_IRT_ge2s']   = (f"{m_mean:.3f}" if m_mean is not None else "")
+    row['SEM_IRT_ge2s']    = (f"{m_sem:.3f}" if m_sem is not None else "")
+
+    # Histogram bins, every scheme from the same converted IRTs
+    for i, scheme in enumerate(BIN_SCHEMES):
+        row.update(zip(bin_columns(scheme, i == 0), scheme.count(irts_sec)))
+    return row
+
+def write_session_csv(infile, outfile, summaries=None):
+    """
+    Parse one export and write its per-session CSV (no CSV if outfile is None).
+    If a summaries list is given, a session_summary() is appended to it for
+    every session. Returns the number of sessions.
+    """
+    with ExitStack() as stack:
+        f = stack.enter_context(open(infile, 'r', encoding='utf-8'))
+        sessions = parse_sessions(f)
+        first = next(sessions, None)
+        if first is None:
+            raise ValueError(f"No valid DRL sessions found in {os.path.basename(infile)}.")
+
+        writer = None
+        if outfile:
+            csvf = stack.enter_context(open(outfile, 'w', newline='', encoding='utf-8'))
+            writer = csv.DictWriter(csvf, fieldnames=FIELDNAMES)
+            writer.writeheader()
+
+        # Rows are written as sessions are read; IRTs are converted once per session
+        n = 0
+        for sess in chain([first], sessions):
+            irts_sec = convert_filter_irts_seconds(sess.get('IRT_values_raw', []))
+            if writer:
+                writer.writerow(session_row(sess, irts_sec))
+            if summaries is not None:
+                summaries.append(session_summary(sess, irts_sec))
+            n += 1
+    return n
+
 def main():
     print("\n=== DRL Output Parser (IRT-binned) ===\n")
-    script_dir = os.path.dirname(os.path.abspath(__file__))
+    script_dir = SCRIPT_DIR
     infile = choose_file(script_dir)
     print(f"\nParsing → {infile}\n")
 
-    with open(os.path.join(script_dir, infile), 'r', encoding='utf-8') as f:
-        text = f.read()
-
-    sessions = list(parse_sessions(text))
-    if not sessions:
-        raise ValueError("No valid DRL sessions found in the chosen file.")
-
     root, _ = os.path.splitext(infile)
     outfile = os.path.join(script_dir, root + '.csv')
+    write_session_csv(os.path.join(script_dir, infile), outfile)
 
-    # CSV columns: session metadata + IRT bin counts + stats (>=2s)
-    fieldnames = [
-        'Date','AnimalID','StartTime','EndTime','TotalResponses','ReinforcedResponses',
-        'Median_IRT_ge2s','Mean_IRT_ge2s','SEM_IRT_ge2s'
-    ] + BIN_LABELS
+    print(f"✅ Summary written to {outfile}")
 
+# ----- Longitudinal analytics -----
+SESSION_CACHE_DB = 'zDRL_sessions.sqlite'
+# Bumped when the cache layout changes; an older cache is dropped and rebuilt
+SESSION_CACHE_VERSION = 1
+# A burst is a run of at least BURST_MIN_IRTS consecutive IRTs shorter than BURST_MAX_IRT_S
+BURST_MAX_IRT_S = 1.0
+BURST_MIN_IRTS = 2
+# Rolling window (sessions) for the smoothed efficiency trajectory
+ROLLING_SESSIONS = 3
+DRL_RE = re.compile(r'DRL\s*(\d+(?:\.\d+)?)', re.IGNORECASE)   # "DRL 10_BR 5_1hr" -> 10 s
+
+def detect_bursts(irts_sec):
+    """(number of bursts, responses inside bursts) for IRTs in session order."""
+    bursts = responses = run = 0
+    for v in list(irts_sec) + [float('inf')]:
+        if v < BURST_MAX_IRT_S:
+            run += 1
+            continue
+        if run >= BURST_MIN_IRTS:
+            bursts += 1
+            responses += run + 1
+        run = 0
+    return bursts, responses
+
+def session_summary(sess, irts_sec):
+    """Compact per-session record for the session cache."""
+    m = DRL_RE.search(sess['header'].get('MSN', ''))
+    drl_s = float(m.group(1)) if m else None
+    total = float(sess['TotalResponses'])
+    reinforced = float(sess['ReinforcedResponses'])
+    irts_ge2 = [x for x in irts_sec if x >= 2.0]
+    bursts, burst_responses = detect_bursts(irts_sec)
+    primary = BIN_SCHEMES[0]
+    day = date_key(sess['Date'])
+    return {
+        'date': sess['Date'],
+        'day': day.strftime('%Y-%m-%d') if day != datetime.max else sess['Date'],
+        'box': int(sess['AnimalID']),
+        'start_time': sess['StartTime'],
+        'end_time': sess['EndTime'],
+        'msn': sess['header'].get('MSN', ''),
+        'drl_s': drl_s,
+        'total': total,
+        'reinforced': reinforced,
+        'efficiency': reinforced / total if total > 0 else None,
+        'n_irts': len(irts_sec),
+        'median_ge2': median(irts_ge2),
+        'mean_ge2': mean(irts_ge2),
+        'sem_ge2': sem(irts_ge2),
+        'pct_ge_drl': (100.0 * sum(1 for x in irts_sec if x >= drl_s) / len(irts_sec)
+                       if drl_s is not None and irts_sec else None),
+        'bursts': bursts,
+        'burst_responses': burst_responses,
+        'irt_bins': json.dumps(dict(zip(primary.labels, primary.count(irts_sec)))),
+    }
+
+SUMMARY_COLUMNS = ['date', 'day', 'box', 'start_time', 'end_time', 'msn', 'drl_s', 'total', 'reinforced',
+                   'efficiency', 'n_irts', 'median_ge2', 'mean_ge2', 'sem_ge2', 'pct_ge_drl',
+                   'bursts', 'burst_responses', 'irt_bins']
+
+def file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def open_session_cache(folder):
+    conn = sqlite3.connect(os.path.join(folder, SESSION_CACHE_DB))
+    if conn.execute('PRAGMA user_version').fetchone()[0] != SESSION_CACHE_VERSION:
+        conn.executescript('DROP TABLE IF EXISTS sessions; DROP TABLE IF EXISTS files;')
+        conn.execute(f'PRAGMA user_version = {SESSION_CACHE_VERSION}')
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS files (
+            filename    TEXT PRIMARY KEY,
+            file_hash   TEXT NOT NULL,
+            ingested_at TEXT NOT NULL,
+            sessions    INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS sessions (
+            source_file     TEXT NOT NULL,
+            date            TEXT NOT NULL,
+            day             TEXT NOT NULL,
+            box             INTEGER NOT NULL,
+            start_time      TEXT NOT NULL,
+            end_time        TEXT NOT NULL,
+            msn             TEXT NOT NULL,
+            drl_s           REAL,
+            total           REAL NOT NULL,
+            reinforced      REAL NOT NULL,
+            efficiency      REAL,
+            n_irts          INTEGER NOT NULL,
+            median_ge2      REAL,
+            mean_ge2        REAL,
+            sem_ge2         REAL,
+            pct_ge_drl      REAL,
+            bursts          INTEGER NOT NULL,
+            burst_responses INTEGER NOT NULL,
+            irt_bins        TEXT NOT NULL,
+            UNIQUE (source_file, day, box, start_time)
+        );
+        CREATE INDEX IF NOT EXISTS sessions_box_day ON sessions (box, day, start_time);
+        CREATE INDEX IF NOT EXISTS sessions_source ON sessions (source_file);
+    ''')
+    return conn
+
+def store_summaries(conn, filename, digest, summaries):
+    """Replace the cached sessions of one export with its new summaries."""
+    placeholders = ', '.join('?' * (len(SUMMARY_COLUMNS) + 1))
+    with conn:
+        conn.execute('DELETE FROM sessions WHERE source_file = ?', (filename,))
+        conn.executemany(
+            f'INSERT OR REPLACE INTO sessions (source_file, {", ".join(SUMMARY_COLUMNS)}) VALUES ({placeholders})',
+            ([filename] + [s[c] for c in SUMMARY_COLUMNS] for s in summaries),
+        )
+        conn.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)',
+                     (filename, digest, datetime.now().isoformat(' ', 'seconds'), len(summaries)))
+
+def forget_missing_files(conn, filenames):
+    """Drop cached sessions of exports no longer in the folder."""
+    gone = [name for (name,) in conn.execute('SELECT filename FROM files') if name not in filenames]
+    with conn:
+        for name in gone:
+            conn.execute('DELETE FROM sessions WHERE source_file = ?', (name,))
+            conn.execute('DELETE FROM files WHERE filename = ?', (name,))
+    return gone
+
+TRAJECTORY_FIELDNAMES = [
+    'AnimalID', 'SessionNumber', 'Date', 'StartTime', 'MSN', 'DRL_s',
+    'TotalResponses', 'ReinforcedResponses', 'EfficiencyRatio', f'Efficiency_rolling{ROLLING_SESSIONS}',
+    'IRTs', 'Median_IRT_ge2s', 'Mean_IRT_ge2s', 'Pct_IRT_ge_DRL', 'Bursts', 'BurstResponses', 'SourceFile',
+]
+
+def fmt(value, spec='.3f'):
+    return '' if value is None else format(value, spec)
+
+def write_trajectories(conn, outfile):
+    """
+    Per-animal trajectories from the session cache: one row per session in
+    time order, numbered per animal, with a rolling mean of the efficiency
+    ratio over the last ROLLING_SESSIONS sessions that have one (blank for
+    a session without responses) and the IRT distribution of the first bin
+    scheme as proportions.
+    A session found in several (overlapping) exports is written once, from
+    the first of them by name.
+    Returns {box: (sessions, first efficiency, last efficiency)}, the first
+    and last of the sessions that have an efficiency ratio.
+    """
+    labels = BIN_SCHEMES[0].labels
+    fieldnames = TRAJECTORY_FIELDNAMES + [f'p_{label}' for label in labels]
+    # MedPC start times are not zero-padded ('8:10:48'), so sessions are
+    # ordered with time_key rather than by SQLite's text comparison
+    rows = sorted(conn.execute(
+        'SELECT box, day, date, start_time, msn, drl_s, total, reinforced, efficiency, n_irts, median_ge2, '
+        'mean_ge2, pct_ge_drl, bursts, burst_responses, source_file, irt_bins FROM sessions'
+    ), key=lambda r: (r[0], r[1], time_key(r[3]), r[15]))
+    animals = {}
     with open(outfile, 'w', newline='', encoding='utf-8') as csvf:
-        writer = csv.DictWriter(csvf, fieldnames=fieldnames)
-        writer.writeheader()
-        for sess in sessions:
-            row = {
-                'Date': sess['Date'],
-                'AnimalID': sess['AnimalID'],
-                'StartTime': sess['StartTime'],
-                'EndTime': sess['EndTime'],
-                'TotalResponses': sess['TotalResponses'],
-                'ReinforcedResponses': sess['ReinforcedResponses'],
-            }
-
-            # Stats: compute from IRTs in seconds, excluding values < 2 s
-            irts_sec = convert_filter_irts_seconds(sess.get('IRT_values_raw', []))
-            irts_ge2 = [x for x in irts_sec if x >= 2.0]
+        writer = csv.writer(csvf)
+        writer.writerow(fieldnames)
+        box = previous = None
+        for (row_box, day, date, start, msn, drl_s, total, reinforced, efficiency, n_irts, med, mn,
+             pct_drl, bursts, burst_responses, source, irt_bins) in rows:
+            if (row_box, day, start) == previous:
+                continue
+            previous = (row_box, day, start)
+            if row_box != box:
+                box, number, window = row_box, 0, []
+            number += 1
+            first, _, last = animals.get(box, (None, None, None))
+            rolling = None
+            if efficiency is not None:
+                window = (window + [efficiency])[-ROLLING_SESSIONS:]
+                rolling = sum(window) / len(window)
+                first = efficiency if first is None else first
+                last = efficiency
+            animals[box] = (first, number, last)
 
-            m_med = median(irts_ge2)
-            m_mean = mean(irts_ge2)
-            m_sem  = sem(irts_ge2)
+            bins = json.loads(irt_bins)
+            n_binned = sum(bins.values())
+            writer.writerow(
+                [box, number, date, start, msn, fmt(drl_s, 'g'), fmt(total, 'g'), fmt(reinforced, 'g'),
+                 fmt(efficiency), fmt(rolling),
+                 n_irts, fmt(med), fmt(mn), fmt(pct_drl, '.1f'), bursts, burst_responses, source]
+                + [fmt(bins[label] / n_binned, '.4f') if n_binned and label in bins else '' for label in labels]
+            )
+    return {b: (n, first, last) for b, (first, n, last) in animals.items()}
 
-            # Store as strings with sensible formatting; blanks if None
-            row['Median_IRT_ge2s'] = (f"{m_med:.3f}" if m_med is not None else "")
-            row['Mean_IRT_ge2s']   = (f"{m_mean:.3f}" if m_mean is not None else "")
-            row['SEM_IRT_ge2s']    = (f"{m_sem:.3f}" if m_sem is not None else "")
+# ----- Batch mode -----
+# Never MedPC exports, whatever they contain
+NON_EXPORT_EXTENSIONS = {'.csv', '.py', '.bat', '.zip', '.xlsx', '.xls', '.mpc'}
+
+LONGITUDINAL_FIELDNAMES = ['Date', 'AnimalID', 'Session'] + FIELDNAMES[2:] + ['SourceFile']
+
+def is_medpc_export(path):
+    """True if the file looks like a MedPC data export (a 'Start Date:' line near the top)."""
+    if os.path.splitext(path)[1].lower() in NON_EXPORT_EXTENSIONS:
+        return False
+    try:
+        with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+            for _, line in zip(range(50), f):
+                if line.strip().startswith('Start Date:'):
+                    return True
+    except OSError:
+        pass
+    return False
 
-            # Histogram bins
-            counts = bin_irts(sess.get('IRT_values_raw', []))
-            row.update(counts)
+def output_csv_path(infile):
+    root, _ = os.path.splitext(infile)
+    return root + '.csv'
+
+def is_up_to_date(infile, outfile):
+    """The per-file CSV exists, is newer than the export and has the current columns."""
+    try:
+        if os.path.getmtime(outfile) < os.path.getmtime(infile):
+            return False
+        with open(outfile, 'r', newline='', encoding='utf-8') as f:
+            return next(csv.reader(f), None) == FIELDNAMES
+    except OSError:
+        return False
+
+def _batch_worker(job):
+    infile, write_csv = job
+    summaries = []
+    try:
+        n = write_session_csv(infile, output_csv_path(infile) if write_csv else None, summaries)
+        return infile, n, summaries, None
+    except (OSError, ValueError) as e:
+        return infile, 0, None, str(e)
 
+def date_key(date_str):
+    try:
+        return datetime.strptime(date_str, '%m/%d/%y')
+    except ValueError:
+        return datetime.max
+
+def time_key(time_str):
+    return tuple(int(part) for part in time_str.split(':') if part.isdigit())
+
+def write_longitudinal(exports, outfile):
+    """
+    Merge the per-file CSVs of all exports into one CSV sorted by date, box
+    and start time. Session numbers count the sessions of a box on one date.
+    A session found in several (overlapping) exports is written once, from
+    the first of them by name, as in write_trajectories.
+    Returns the number of rows written.
+    """
+    rows = []
+    for infile in exports:
+        csv_path = output_csv_path(infile)
+        if not os.path.isfile(csv_path):
+            continue
+        with open(csv_path, 'r', newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                row['SourceFile'] = os.path.basename(infile)
+                rows.append(row)
+
+    rows.sort(key=lambda r: (date_key(r['Date']), int(r['AnimalID']), time_key(r['StartTime']), r['SourceFile']))
+    seen = set()
+    session_counts = {}
+    with open(outfile, 'w', newline='', encoding='utf-8') as csvf:
+        writer = csv.DictWriter(csvf, fieldnames=LONGITUDINAL_FIELDNAMES)
+        writer.writeheader()
+        for row in rows:
+            session = (row['Date'], row['AnimalID'], row['StartTime'])
+            if session in seen:
+                continue
+            seen.add(session)
+            key = (row['Date'], row['AnimalID'])
+            session_counts[key] = session_counts.get(key, 0) + 1
+            row['Session'] = session_counts[key]
             writer.writerow(row)
+    return len(seen)
 
-    print(f"✅ Summary written to {outfile}")
+def batch_process(folder, outfile=None, workers=None, force=False):
+    """
+    Process every MedPC export in a folder (in parallel worker processes),
+    then write the longitudinal CSV (default: DRL_longitudinal.csv) and the
+    per-animal trajectories (DRL_trajectories.csv) in the folder.
+    An export is only parsed when its per-file CSV is out of date or its
+    contents changed since its sessions were cached in zDRL_sessions.sqlite,
+    so adding a day's export only processes that file.
+    """
+    names = sorted(os.listdir(folder))
+    exports = [os.path.join(folder, n) for n in names
+               if os.path.isfile(os.path.join(folder, n)) and is_medpc_export(os.path.join(folder, n))]
+    if not exports:
+        raise FileNotFoundError(f"No MedPC exports found in {folder}.")
 
-if __name__ == '__main__':
+    conn = open_session_cache(folder)
     try:
-        main()
-    except Exception as e:
-        print(f"\n❌ Error: {e}", file=sys.stderr)
+        forget_missing_files(conn, {os.path.basename(f) for f in exports})
+        cached = dict(conn.execute('SELECT filename, file_hash FROM files'))
+        digests = {f: file_hash(f) for f in exports}
+        need_csv = {f for f in exports if force or not is_up_to_date(f, output_csv_path(f))}
+        need_summary = {f for f in exports if force or cached.get(os.path.basename(f)) != digests[f]}
+        todo = [f for f in exports if f in need_csv or f in need_summary]
+        print(f"{len(exports)} exports found, {len(exports) - len(todo)} up to date, {len(todo)} to process.")
+
+        failed = []
+        if todo:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                for infile, n, summaries, error in pool.map(_batch_worker, [(f, f in need_csv) for f in todo]):
+                    if error:
+                        failed.append(infile)
+                        print(f"  ❌ {os.path.basename(infile)}: {error}")
+                        continue
+                    store_summaries(conn, os.path.basename(infile), digests[infile], summaries)
+                    print(f"  {os.path.basename(infile)}: {n} sessions")
+
+        outfile = outfile or os.path.join(folder, 'DRL_longitudinal.csv')
+        n_rows = write_longitudinal([f for f in exports if f not in failed], outfile)
+        print(f"✅ Longitudinal summary ({n_rows} sessions) written to {outfile}")
+
+        trajectory_file = os.path.join(os.path.dirname(outfile) or folder, 'DRL_trajectories.csv')
+        animals = write_trajectories(conn, trajectory_file)
+        print(f"✅ Per-animal trajectories ({len(animals)} animals) written to {trajectory_file}")
+        for box, (n, first, last) in sorted(animals.items()):
+            print(f"  Box {box}: {n} sessions, efficiency B/A {fmt(first)} → {fmt(last)}")
     finally:
-        input("\nPress Enter to exit...")
+        conn.close()
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description="DRL Output Parser (IRT-binned)")
+    ap.add_argument("--batch", metavar="FOLDER", help="process every MedPC export in FOLDER into one longitudinal CSV")
+    ap.add_argument("--out", default=None, help="longitudinal CSV for --batch (default: FOLDER/DRL_longitudinal.csv)")
+    ap.add_argument("--workers", type=int, default=None, help="worker processes for --batch (default: CPU count)")
+    ap.add_argument("--force", action="store_true", help="with --batch, reprocess exports even if their CSV is up to date")
+    args = ap.parse_args()
+    if args.batch:
+        try:
+            batch_process(args.batch, args.out, args.workers, args.force)
+        except Exception as e:
+            print(f"\n❌ Error: {e}", file=sys.stderr)
+            sys.exit(1)
+    else:
+        try:
+            main()
+        except Exception as e:
+            print(f"\n❌ Error: {e}", file=sys.stderr)
+        finally:
+            input("\nPress Enter to exit...")
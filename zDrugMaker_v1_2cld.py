@@ -15,16 +15,56 @@ Changes from v1.1:
 - Window size and last compound remembered between sessions
 - Refactored tab construction (one builder for all calculation tabs)
 - Visual refresh using only ttk styling (no external libraries)
+- Headless batch planner: a study plan CSV is turned into every stock,
+  vehicle and serial-dilution step in one run (see below)
+- Formulation history: every calculation is also appended to an indexed
+  SQLite log (zDrugMakerHistory.sqlite); the History tab searches it by
+  compound and date and re-loads a past calculation into its tab. Entries
+  of the old text log are imported once when the database is created.
+- Dilution Scheme tab: solver for multi-step serial dilutions. Given a
+  stock and a set of target concentrations it searches over intermediate
+  stocks and over which solution each one is made from, and returns the
+  scheme that uses the least compound (then the fewest solutions) while
+  every pipetted volume stays above the minimum pipettable volume and
+  every solution fits the largest tube.
+- BEW table backed by an indexed store: prefix and trigram (substring /
+  fuzzy) search, rows updated in place instead of rebuilding the table,
+  and zDrugMakerBEW.txt written atomically (temp file + rename)
+
+Batch planning (no window):
+    python zDrugMaker_v1_2cld.py --plan study.csv [--out folder]
+                                 [--overage 10]
+
+study.csv has one row per compound x route x cohort:
+    compound,bew,doses,avg_bw,animals,trials,route
+    Cocaine HCl,1.13,3;10;30,350,8,2,Rats
+    Cocaine HCl,,0;3;10,30,6,1,Mice
+- doses: mg/kg separated by ';' (0 = vehicle group)
+- animals: one count for every dose, or one count per dose (';')
+- trials: injections per animal (default 1)
+- route: a VOLUME_FACTORS label (Rats / Oral / Mice) or a number in ml/kg
+- bew: blank to use the value of an earlier row of the same compound,
+  else the one stored in zDrugMakerBEW.txt
+Rows of the same compound and route are pooled. The highest dose of each
+is weighed out and every lower dose is made from the next higher one
+(serial dilution). Writes formulation_plan.csv plus one prep sheet per
+compound and route into the output folder (default: <plan>_formulations).
 
 Requires: Python 3.8+ (standard library only)
 """
 
+import argparse
+import bisect
 import csv
 import json
+import math
 import os
 import re
+import sqlite3
 import time
 import tkinter as tk
+from collections import Counter
+from itertools import combinations
 from tkinter import ttk, messagebox, filedialog
 
 # ---------------------------------------------------------------- constants
@@ -33,6 +73,19 @@ SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 BEW_FILE = os.path.join(SCRIPT_DIR, "zDrugMakerBEW.txt")
 LOG_FILE = os.path.join(SCRIPT_DIR, "zDrugMakerLog.txt")
 SETTINGS_FILE = os.path.join(SCRIPT_DIR, "zDrugMakerSettings.json")
+HISTORY_DB = os.path.join(SCRIPT_DIR, "zDrugMakerHistory.sqlite")
+
+HISTORY_LIMIT = 500       # rows shown in the History tab per search
+
+# Dilution scheme solver: intermediate stocks are tried at every 10-fold
+# dilution of the stock and at every target concentration divided by these
+# factors, and a scheme with fewer solutions is preferred while it uses at
+# most SCHEME_STEP_TOLERANCE more compound than the cheapest one
+DILUTION_FACTORS = (10, 100)
+SCHEME_STEP_TOLERANCE = 0.05
+# Every combination of up to this many intermediates is tried, and the
+# solver runs on the GUI thread; 4 already takes seconds for a dozen targets
+MAX_SCHEME_INTERMEDIATES = 3
 
 # (label, ml per kg) - edit here to change the standard dosing volumes
 VOLUME_FACTORS = [
@@ -63,6 +116,753 @@ class InputError(Exception):
     """Raised when a user-supplied value is missing or invalid."""
 
 
+# ---------------------------------------------------------------- formulas
+
+def drug_amount(bew, dose, avgbw, animals, trials):
+    """mg of compound (as weighed) for a dose over animals x trials."""
+    return bew * dose * 0.001 * avgbw * animals * trials
+
+
+def dosing_volume(factor, avgbw, animals, trials):
+    """ml of solution injected at `factor` ml/kg over animals x trials."""
+    return factor * 0.001 * avgbw * animals * trials
+
+
+def vehicle_volume(factor, bew, dose, amt):
+    """ml of vehicle that turns `amt` mg into a `factor` ml/kg solution."""
+    return (factor * amt) / (dose * bew)
+
+
+def dilution_volumes(conc_stock, conc_final, vol_final):
+    """(ml of stock, ml of vehicle) for vol_final ml at conc_final."""
+    vol_needed = (conc_final / conc_stock) * vol_final
+    return vol_needed, vol_final - vol_needed
+
+
+def safe_filename(name):
+    return re.sub(r"[^\w\-]+", "_", name).strip("_")
+
+
+# --------------------------------------------------------------- BEW store
+
+def read_bew_file(path):
+    """Read BEW values as {compound: (bew, date_str)}. Supports the old
+    'name - value' format and the new tab-separated
+    'name<TAB>value<TAB>date' format. Raises OSError if unreadable."""
+    data = {}
+    if not os.path.exists(path):
+        return data
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            name = value = date = None
+            if "\t" in line:
+                parts = line.split("\t")
+                if len(parts) >= 2:
+                    name, value = parts[0], parts[1]
+                    date = parts[2] if len(parts) > 2 else ""
+            elif " - " in line:
+                name, value = line.rsplit(" - ", 1)
+                date = ""
+            if name is None:
+                continue
+            try:
+                data[name.strip()] = (float(value), date)
+            except ValueError:
+                continue
+    return data
+
+
+def _trigrams(text):
+    """Trigrams of a space-padded string ('  ab', ' abc', ..., 'yz ')."""
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class BewStore:
+    """Compound -> (bew, date_str) map with a search index.
+
+    Names are kept in a case-insensitively sorted list for prefix lookups
+    (bisect) and in a trigram -> names index for substring and fuzzy
+    lookups; both are updated in place as entries are added, so a search
+    never scans the whole list once the query has three characters.
+    """
+
+    # share of the query's trigrams a name needs to count as a fuzzy match
+    FUZZY_MIN_SCORE = 0.5
+
+    def __init__(self, entries=None):
+        self.entries = {}
+        self._sorted = []          # (name.lower(), name)
+        self._trigram_index = {}   # trigram -> set of names
+        for name, (bew, date) in (entries or {}).items():
+            self.set(name, bew, date)
+
+    @classmethod
+    def load(cls, path):
+        return cls(read_bew_file(path))
+
+    def save(self, path):
+        """Write the store as 'name<TAB>value<TAB>date' lines, atomically."""
+        tmp_file = path + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            for _key, name in self._sorted:
+                bew, date = self.entries[name]
+                f.write(f"{name}\t{bew:.6g}\t{date}\n")
+        os.replace(tmp_file, path)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def get(self, name):
+        return self.entries.get(name)
+
+    def names(self):
+        return [name for _key, name in self._sorted]
+
+    def set(self, name, bew, date):
+        """Add or update an entry. Returns True if the name is new."""
+        is_new = name not in self.entries
+        self.entries[name] = (bew, date)
+        if is_new:
+            bisect.insort(self._sorted, (name.lower(), name))
+            for gram in _trigrams(name.lower()):
+                self._trigram_index.setdefault(gram, set()).add(name)
+        return is_new
+
+    def search(self, query):
+        """Names matching query, best first: names starting with it, then
+        names containing it, then fuzzy matches ranked by shared trigrams
+        (so typos still find the compound). Case-insensitive; an empty
+        query returns every name."""
+        query = query.strip().lower()
+        if not query:
+            return self.names()
+
+        prefix = []
+        i = bisect.bisect_left(self._sorted, (query,))
+        while i < len(self._sorted) and self._sorted[i][0].startswith(query):
+            prefix.append(self._sorted[i][1])
+            i += 1
+        seen = set(prefix)
+        if len(query) < 3:
+            return prefix + [name for key, name in self._sorted
+                             if query in key and name not in seen]
+
+        # Every name containing the query holds all of its inner trigrams
+        postings = sorted((self._trigram_index.get(query[j:j + 3], set())
+                           for j in range(len(query) - 2)), key=len)
+        candidates = postings[0].intersection(*postings[1:])
+        contains = sorted((name for name in candidates
+                           if name not in seen and query in name.lower()),
+                          key=str.lower)
+        seen.update(contains)
+
+        grams = _trigrams(query)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._trigram_index.get(gram, ()))
+        needed = self.FUZZY_MIN_SCORE * len(grams)
+        fuzzy = sorted((name for name, count in shared.items()
+                        if count >= needed and name not in seen),
+                       key=lambda name: (-shared[name], name.lower()))
+        return prefix + contains + fuzzy
+
+
+# --------------------------------------------------------- dilution solver
+
+def _scheme_volumes(concs, needs, parents, stock_conc, min_volume):
+    """Volumes of one scheme. concs are in descending order and
+    parents[i] is the index of the solution node i is diluted from (always
+    a lower index) or -1 for the stock. Nodes are sized from the lowest
+    concentration up: each holds its own need plus what later dilutions
+    draw from it, raised where needed so that both the aliquot and the
+    vehicle added are at least min_volume.
+    Returns (mg of compound used, volumes, aliquots)."""
+    volumes = list(needs)
+    draws = [0.0] * len(concs)
+    for i in range(len(concs) - 1, -1, -1):
+        parent = parents[i]
+        ratio = concs[i] / (stock_conc if parent < 0 else concs[parent])
+        volumes[i] = max(volumes[i], min_volume / ratio,
+                         min_volume / (1.0 - ratio))
+        draws[i] = ratio * volumes[i]
+        if parent >= 0:
+            volumes[parent] += draws[i]
+    mg = stock_conc * sum(d for d, parent in zip(draws, parents)
+                          if parent < 0)
+    return mg, volumes, draws
+
+
+def _scheme_cost(concs, needs, parents, stock_conc, min_volume,
+                 max_volume):
+    """mg of compound a scheme uses, or inf if a solution would not fit
+    in max_volume ml."""
+    mg, volumes, _draws = _scheme_volumes(concs, needs, parents, stock_conc,
+                                          min_volume)
+    return mg if max(volumes) <= max_volume else math.inf
+
+
+def _best_parents(concs, needs, stock_conc, min_volume, max_volume):
+    """Cheapest parent assignment for a fixed set of solutions, by
+    coordinate descent (re-pick one node's parent at a time until nothing
+    improves) from two starts: a plain serial chain and everything made
+    straight from the stock. Returns (mg, parents)."""
+    best = None
+    n = len(concs)
+    for start in ([i - 1 for i in range(n)], [-1] * n):
+        parents = list(start)
+        current = _scheme_cost(concs, needs, parents, stock_conc,
+                               min_volume, max_volume)
+        improved = True
+        while improved:
+            improved = False
+            for i in range(n):
+                keep = parents[i]
+                for parent in range(-1, i):
+                    if parent == keep:
+                        continue
+                    parents[i] = parent
+                    mg = _scheme_cost(concs, needs, parents, stock_conc,
+                                      min_volume, max_volume)
+                    if mg < current * (1 - 1e-9):
+                        current, keep, improved = mg, parent, True
+                parents[i] = keep
+        if best is None or current < best[0]:
+            best = (current, parents)
+    return best
+
+
+def solve_dilution_scheme(stock_conc, targets, min_volume,
+                          max_intermediates=2, max_volume=math.inf):
+    """Cheapest serial dilution scheme for targets [(conc mg/ml, ml)] made
+    from a stock of stock_conc mg/ml, every pipetted volume (aliquot or
+    vehicle) being at least min_volume ml and no solution larger than
+    max_volume ml. Every set of up to
+    max_intermediates intermediate stocks is tried; the result is the
+    least compound, or the fewest solutions within SCHEME_STEP_TOLERANCE
+    of it. Returns a dict with mg, stock_ml, steps in preparation order
+    and the best mg per number of solutions, where adding solutions
+    saves compound ('alternatives')."""
+    needs_by_conc = {}
+    for conc, volume in targets:
+        if conc <= 0 or volume <= 0:
+            raise InputError("Target concentrations and volumes must be "
+                             "greater than zero.")
+        if conc >= stock_conc:
+            raise InputError(f"Target {conc:g} mg/ml is not lower than the "
+                             f"stock ({stock_conc:g} mg/ml).")
+        needs_by_conc[conc] = needs_by_conc.get(conc, 0.0) + volume
+    target_concs = sorted(needs_by_conc, reverse=True)
+    lowest = target_concs[-1]
+    candidates = {c / f for c in target_concs for f in DILUTION_FACTORS}
+    decade = stock_conc / 10
+    while decade > lowest:
+        candidates.add(decade)
+        decade /= 10
+    candidates = sorted({float(f"{c:.6g}") for c in candidates
+                         if lowest < c < stock_conc} - set(target_concs),
+                        reverse=True)
+
+    best_by_size = {}
+    for k in range(max_intermediates + 1):
+        for extra in combinations(candidates, k):
+            concs = sorted(target_concs + list(extra), reverse=True)
+            needs = [needs_by_conc.get(c, 0.0) for c in concs]
+            mg, parents = _best_parents(concs, needs, stock_conc,
+                                        min_volume, max_volume)
+            size = len(concs)
+            if size not in best_by_size or mg < best_by_size[size][0]:
+                best_by_size[size] = (mg, concs, needs, parents)
+
+    cheapest = min(mg for mg, *_rest in best_by_size.values())
+    if cheapest == math.inf:
+        raise InputError(f"No scheme keeps every solution under "
+                         f"{max_volume:g} ml. Allow more intermediate "
+                         f"stocks or larger tubes.")
+    size = min(size for size, (mg, *_rest) in best_by_size.items()
+               if mg <= cheapest * (1 + SCHEME_STEP_TOLERANCE))
+    mg, concs, needs, parents = best_by_size[size]
+    _mg, volumes, draws = _scheme_volumes(concs, needs, parents, stock_conc,
+                                          min_volume)
+    steps = []
+    for i, conc in enumerate(concs):
+        steps.append({
+            "conc": conc,
+            "source_conc": stock_conc if parents[i] < 0
+            else concs[parents[i]],
+            "source_ml": draws[i],
+            "vehicle_ml": volumes[i] - draws[i],
+            "volume": volumes[i],
+            "target_ml": needs[i],
+        })
+    # Larger schemes are only worth listing if they save compound
+    alternatives = []
+    for n in sorted(best_by_size):
+        if best_by_size[n][0] == math.inf:
+            continue
+        if not alternatives or best_by_size[n][0] < alternatives[-1][1] * (
+                1 - 1e-9):
+            alternatives.append((n, best_by_size[n][0]))
+    return {
+        "mg": mg,
+        "stock_ml": mg / stock_conc,
+        "steps": steps,
+        "alternatives": alternatives,
+    }
+
+
+# ------------------------------------------------------------- history log
+
+LOG_TIME_FORMAT = "%Y/%m/%d - %H:%M:%S"     # text log / Output tab
+HISTORY_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"   # database (sorts as text)
+
+# Input fields recovered from result lines of entries imported from the
+# text log, which has no structured inputs
+LEGACY_INPUTS = [
+    ("bew", re.compile(r"^BEW: (\S+)$", re.M)),
+    ("dose", re.compile(r"^Dose: (\S+) mg/kg$", re.M)),
+    ("amt", re.compile(r"^Drug weighed: (\S+) mg$", re.M)),
+]
+
+
+def log_block(timestamp, calc_type, comments, result):
+    """Text log / Output tab block of one calculation."""
+    return (f"Date: {timestamp}\n"
+            f"Calculation Type: {calc_type}\n"
+            f"Comments: {comments}\n"
+            f"{result}\n" + "=" * 50 + "\n\n")
+
+
+def append_text_log(block):
+    with open(LOG_FILE, "a", encoding="utf-8") as log_file:
+        log_file.write(block)
+
+
+def read_text_log(path):
+    """Parse the text log into history rows (date, type, compound,
+    comments, inputs, result). Handles the v1.1 format without a
+    Comments line."""
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        lines = f.read().splitlines()
+    starts = [i for i in range(len(lines) - 1)
+              if lines[i].startswith("Date: ")
+              and lines[i + 1].startswith("Calculation Type: ")]
+    rows = []
+    for start, end in zip(starts, starts[1:] + [len(lines)]):
+        block = lines[start:end]
+        raw_date = block[0][len("Date: "):].strip()
+        calc_type = block[1][len("Calculation Type: "):].strip()
+        body = block[2:]
+        comments = ""
+        if body and body[0].startswith("Comments: "):
+            comments = body.pop(0)[len("Comments: "):].strip()
+        # Drop the trailing separator the log adds after every result
+        while body and not body[-1].strip():
+            body.pop()
+        if body and body[-1] == "=" * 50:
+            body.pop()
+        result = "\n".join(body).strip()
+        try:
+            date = time.strftime(HISTORY_TIME_FORMAT,
+                                 time.strptime(raw_date, LOG_TIME_FORMAT))
+        except ValueError:
+            date = raw_date
+        compound = re.search(r"^Compound: (.*)$", result, re.M)
+        inputs = {key: m.group(1) for key, pattern in LEGACY_INPUTS
+                  for m in [pattern.search(result)] if m}
+        rows.append((date, calc_type,
+                     compound.group(1).strip() if compound else "",
+                     comments, json.dumps(inputs), result))
+    return rows
+
+
+def open_history(path=None):
+    """Open (and on first use create) the formulation history database.
+    The table is append-only: triggers reject UPDATE and DELETE. A new
+    database is seeded once from the existing text log."""
+    conn = sqlite3.connect(path or HISTORY_DB)
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS formulations (
+            id       INTEGER PRIMARY KEY,
+            date     TEXT NOT NULL,
+            type     TEXT NOT NULL,
+            compound TEXT NOT NULL COLLATE NOCASE,
+            comments TEXT NOT NULL,
+            inputs   TEXT NOT NULL,
+            result   TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS formulations_compound_date
+            ON formulations (compound, date);
+        CREATE INDEX IF NOT EXISTS formulations_date
+            ON formulations (date);
+        CREATE TRIGGER IF NOT EXISTS formulations_no_update
+            BEFORE UPDATE ON formulations
+            BEGIN SELECT RAISE(ABORT, 'formulation log is append-only'); END;
+        CREATE TRIGGER IF NOT EXISTS formulations_no_delete
+            BEFORE DELETE ON formulations
+            BEGIN SELECT RAISE(ABORT, 'formulation log is append-only'); END;
+    ''')
+    if conn.execute("PRAGMA user_version").fetchone()[0] == 0:
+        rows = read_text_log(LOG_FILE) if os.path.exists(LOG_FILE) else []
+        with conn:
+            conn.executemany(
+                "INSERT INTO formulations "
+                "(date, type, compound, comments, inputs, result) "
+                "VALUES (?, ?, ?, ?, ?, ?)", rows)
+            conn.execute("PRAGMA user_version = 1")
+    return conn
+
+
+def append_history(conn, when, calc_type, compound, comments, result,
+                   inputs=None):
+    """Append one calculation; `when` is a time.struct_time."""
+    with conn:
+        conn.execute(
+            "INSERT INTO formulations "
+            "(date, type, compound, comments, inputs, result) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (time.strftime(HISTORY_TIME_FORMAT, when), calc_type,
+             compound.strip(), comments, json.dumps(inputs or {}),
+             result.strip()))
+
+
+def search_history(conn, query="", date_from="", date_to="",
+                   limit=HISTORY_LIMIT):
+    """Newest-first (id, date, type, compound, comments) rows whose
+    compound starts with `query` (case-insensitive, served by the
+    compound index) within an inclusive date range given as YYYY,
+    YYYY-MM or YYYY-MM-DD."""
+    where, params = [], []
+    if query:
+        escaped = re.sub(r"([\\%_])", r"\\\1", query)
+        where.append("compound LIKE ? ESCAPE '\\'")
+        params.append(escaped + "%")
+    if date_from:
+        where.append("date >= ?")
+        params.append(date_from)
+    if date_to:
+        # '~' sorts after every digit, so a partial date covers its period
+        where.append("date <= ?")
+        params.append(date_to + "~")
+    sql = "SELECT id, date, type, compound, comments FROM formulations"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY date DESC, id DESC LIMIT ?"
+    return conn.execute(sql, params + [limit]).fetchall()
+
+
+def get_history(conn, row_id):
+    row = conn.execute(
+        "SELECT date, type, compound, comments, inputs, result "
+        "FROM formulations WHERE id = ?", (row_id,)).fetchone()
+    if row is None:
+        return None
+    date, calc_type, compound, comments, inputs, result = row
+    return {"date": date, "type": calc_type, "compound": compound,
+            "comments": comments, "inputs": json.loads(inputs or "{}"),
+            "result": result}
+
+
+# ----------------------------------------------------------- batch planner
+
+PLAN_FIELDS = ["compound", "route", "ml_per_kg", "bew", "dose_mg_kg",
+               "conc_mg_ml", "dosed_ml", "prepared_ml", "source",
+               "source_ml", "vehicle_ml", "drug_mg"]
+
+# Plan CSV headers are matched case-insensitively, ignoring spaces,
+# underscores and units in brackets
+PLAN_HEADERS = {
+    "compound": "compound", "drug": "compound",
+    "bew": "bew",
+    "doses": "doses", "dose": "doses", "dosesmgkg": "doses",
+    "avgbw": "avg_bw", "avgbwg": "avg_bw", "bodyweight": "avg_bw",
+    "animals": "animals", "n": "animals",
+    "trials": "trials",
+    "route": "route", "volume": "route",
+}
+
+
+def _plan_number(raw, label, row_no, positive=True):
+    raw = raw.strip()
+    if not raw:
+        raise InputError(f"Row {row_no}: '{label}' is empty.")
+    try:
+        value = float(raw)
+    except ValueError:
+        raise InputError(f"Row {row_no}: '{label}' must be a number "
+                         f"(got '{raw}').")
+    if value < 0 or (positive and value == 0):
+        raise InputError(f"Row {row_no}: '{label}' must be greater than "
+                         f"zero.")
+    return value
+
+
+def _plan_numbers(raw, label, row_no, positive=True):
+    return [_plan_number(item, label, row_no, positive)
+            for item in re.split(r"[;|]", raw) if item.strip()]
+
+
+def route_factor(route, row_no):
+    """(label, ml/kg) for a VOLUME_FACTORS label or a plain ml/kg number."""
+    route = route.strip()
+    for name, factor in VOLUME_FACTORS:
+        if route.lower() == name.lower():
+            return name, factor
+    try:
+        factor = float(route)
+    except ValueError:
+        known = ", ".join(name for name, _factor in VOLUME_FACTORS)
+        raise InputError(f"Row {row_no}: unknown route '{route}' "
+                         f"(use {known} or a number in ml/kg).")
+    if factor <= 0:
+        raise InputError(f"Row {row_no}: route volume must be greater "
+                         f"than zero.")
+    return f"{factor:g} ml/kg", factor
+
+
+def read_study_plan(path, bew_data=None):
+    """Read a study plan CSV into a list of cohort dicts (compound, bew,
+    route, factor, doses, animals, avgbw, trials). A blank BEW takes the
+    BEW of an earlier row of the same compound, then the one stored in
+    bew_data. Raises InputError naming the offending row."""
+    bew_data = bew_data or {}
+    plan_bew = {}
+    cohorts = []
+    with open(path, "r", newline="", encoding="utf-8-sig") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            raise InputError(f"{path} is empty.")
+        columns = {}
+        for i, name in enumerate(header):
+            key = re.sub(r"\(.*?\)|[^a-z]", "", name.lower())
+            if key in PLAN_HEADERS:
+                columns[PLAN_HEADERS[key]] = i
+        missing = [c for c in ("compound", "doses", "avg_bw", "animals",
+                               "route") if c not in columns]
+        if missing:
+            raise InputError(f"{path}: missing column(s) "
+                             f"{', '.join(missing)}.")
+
+        for row_no, row in enumerate(reader, start=2):
+            if not any(cell.strip() for cell in row) or \
+                    row[0].lstrip().startswith("#"):
+                continue
+            cell = {key: (row[i] if i < len(row) else "")
+                    for key, i in columns.items()}
+            compound = cell["compound"].strip()
+            if not compound:
+                raise InputError(f"Row {row_no}: 'compound' is empty.")
+            if cell.get("bew", "").strip():
+                bew = plan_bew[compound] = _plan_number(cell["bew"], "bew",
+                                                        row_no)
+            elif compound in plan_bew:
+                bew = plan_bew[compound]
+            elif compound in bew_data:
+                bew = bew_data[compound][0]
+            else:
+                raise InputError(f"Row {row_no}: no BEW given for "
+                                 f"'{compound}' and none stored.")
+            doses = _plan_numbers(cell["doses"], "doses", row_no,
+                                  positive=False)
+            if not doses:
+                raise InputError(f"Row {row_no}: 'doses' is empty.")
+            animals = _plan_numbers(cell["animals"], "animals", row_no)
+            if len(animals) == 1:
+                animals = animals * len(doses)
+            elif len(animals) != len(doses):
+                raise InputError(f"Row {row_no}: {len(animals)} animal "
+                                 f"counts for {len(doses)} doses.")
+            trials = cell.get("trials", "").strip()
+            route, factor = route_factor(cell["route"], row_no)
+            cohorts.append({
+                "compound": compound,
+                "bew": bew,
+                "route": route,
+                "factor": factor,
+                "doses": doses,
+                "animals": animals,
+                "avgbw": _plan_number(cell["avg_bw"], "avg_bw", row_no),
+                "trials": (_plan_number(trials, "trials", row_no)
+                           if trials else 1.0),
+                "row": row_no,
+            })
+    return cohorts
+
+
+def plan_formulations(cohorts, overage=0.0):
+    """Pool cohorts by (compound, route) and work out the serial dilution
+    chain of each: the highest dose is weighed out, every lower dose is
+    made from the next higher concentration, vehicle groups get plain
+    vehicle. Volumes are worked out from the lowest dose up, so each
+    solution also covers what the next step draws from it. overage is a
+    percentage added to every dosed volume.
+    Returns {(compound, route): formulation dict}, in plan order."""
+    pooled = {}
+    for c in cohorts:
+        key = (c["compound"], c["route"])
+        form = pooled.setdefault(key, {
+            "compound": c["compound"], "route": c["route"],
+            "factor": c["factor"], "bew": c["bew"], "dosed": {},
+            "animals": {}, "rows": []})
+        if abs(form["bew"] - c["bew"]) > 1e-9:
+            raise InputError(f"Row {c['row']}: BEW {c['bew']:g} for "
+                             f"'{c['compound']}' differs from "
+                             f"{form['bew']:g} on row {form['rows'][0]}.")
+        form["rows"].append(c["row"])
+        for dose, n in zip(c["doses"], c["animals"]):
+            vol = dosing_volume(c["factor"], c["avgbw"], n, c["trials"])
+            form["dosed"][dose] = form["dosed"].get(dose, 0.0) + vol
+            form["animals"][dose] = form["animals"].get(dose, 0) + n
+
+    scale = 1.0 + overage / 100.0
+    for form in pooled.values():
+        factor, bew = form["factor"], form["bew"]
+        steps = []
+        lower = None
+        for dose in sorted(d for d in form["dosed"] if d > 0):
+            conc = dose * bew / factor
+            prepared = form["dosed"][dose] * scale
+            if lower is not None:
+                stock_ml, vehicle_ml = dilution_volumes(
+                    conc, lower["conc"], lower["prepared"])
+                lower.update(source=f"{conc:.6g} mg/ml", source_ml=stock_ml,
+                             vehicle_ml=vehicle_ml, drug_mg=None)
+                prepared += stock_ml
+            lower = {"dose": dose, "conc": conc,
+                     "dosed": form["dosed"][dose], "prepared": prepared}
+            steps.append(lower)
+        if lower is not None:
+            drug_mg = lower["conc"] * lower["prepared"]
+            lower.update(source="weigh", source_ml=None, drug_mg=drug_mg,
+                         vehicle_ml=vehicle_volume(factor, bew,
+                                                   lower["dose"], drug_mg))
+        steps.reverse()
+        form["steps"] = steps
+        vehicle_group = form["dosed"].get(0.0, 0.0) * scale
+        form["vehicle_group_ml"] = vehicle_group
+        form["drug_mg"] = steps[0]["drug_mg"] if steps else 0.0
+        form["vehicle_ml"] = (sum(s["vehicle_ml"] for s in steps)
+                              + vehicle_group)
+    return pooled
+
+
+def _fmt(value):
+    return "" if value is None else f"{value:.6g}"
+
+
+def plan_rows(form):
+    """Consolidated-plan CSV rows (PLAN_FIELDS order) of one formulation."""
+    base = [form["compound"], form["route"], f"{form['factor']:g}",
+            f"{form['bew']:.6g}"]
+    rows = [base + [f"{s['dose']:g}", _fmt(s["conc"]), _fmt(s["dosed"]),
+                    _fmt(s["prepared"]), s["source"], _fmt(s["source_ml"]),
+                    _fmt(s["vehicle_ml"]), _fmt(s["drug_mg"])]
+            for s in form["steps"]]
+    if form["vehicle_group_ml"]:
+        rows.append(base + ["0", "0", _fmt(form["dosed"][0.0]),
+                            _fmt(form["vehicle_group_ml"]), "vehicle", "",
+                            _fmt(form["vehicle_group_ml"]), ""])
+    return rows
+
+
+def plan_sheet(form, overage=0.0):
+    """Printable prep sheet of one formulation, in preparation order."""
+    lines = [
+        "Formulation Plan",
+        "=" * 50,
+        f"Compound: {form['compound']}",
+        f"BEW: {form['bew']:.3g}",
+        f"Route: {form['route']} ({form['factor']:g} ml/kg)",
+        f"Plan rows: {', '.join(str(r) for r in form['rows'])}",
+        f"Overage: {overage:g}%",
+        "=" * 50,
+        f"Drug to weigh: {form['drug_mg']:.3g} mg",
+        f"Total vehicle: {form['vehicle_ml']:.3g} ml",
+        "=" * 50,
+    ]
+    for n, s in enumerate(form["steps"], start=1):
+        lines.append(f"Step {n}: {s['dose']:g} mg/kg = {s['conc']:.3g} mg/ml "
+                     f"({form['animals'][s['dose']]:g} animals, "
+                     f"{s['dosed']:.3g} ml dosed)")
+        if s["source"] == "weigh":
+            lines.append(f"Add {s['vehicle_ml']:.3g} ml of vehicle to "
+                         f"{s['drug_mg']:.3g} mg of drug")
+        else:
+            lines.append(f"Mix {s['source_ml']:.3g} ml of the "
+                         f"{s['source']} solution")
+            lines.append(f"with {s['vehicle_ml']:.3g} ml of vehicle")
+        lines.append(f"Producing a final volume of {s['prepared']:.3g} ml\n")
+    if form["vehicle_group_ml"]:
+        lines.append(f"Vehicle group ({form['animals'][0.0]:g} animals): "
+                     f"{form['vehicle_group_ml']:.3g} ml of vehicle\n")
+    lines.append("=" * 50)
+    return "\n".join(lines) + "\n"
+
+
+def run_plan(plan_path, out_dir=None, overage=0.0):
+    """Compute a study plan and write formulation_plan.csv plus one
+    '<compound>_<route>.txt' prep sheet per formulation into out_dir.
+    Every sheet is also appended to the formulation log."""
+    try:
+        bew_data = read_bew_file(BEW_FILE)
+    except OSError as exc:
+        print(f"[Note] Could not read BEW file: {exc}")
+        bew_data = {}
+    formulations = plan_formulations(read_study_plan(plan_path, bew_data),
+                                     overage)
+    if out_dir is None:
+        out_dir = os.path.splitext(plan_path)[0] + "_formulations"
+    os.makedirs(out_dir, exist_ok=True)
+
+    plan_file = os.path.join(out_dir, "formulation_plan.csv")
+    with open(plan_file, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(PLAN_FIELDS)
+        for form in formulations.values():
+            writer.writerows(plan_rows(form))
+
+    comments = f"Batch plan: {os.path.basename(plan_path)}"
+    # As in ZDrugMakerApp._record: the text log is written first and a
+    # history database failure never keeps a sheet out of it
+    try:
+        conn = open_history()
+    except (OSError, sqlite3.Error) as exc:
+        print(f"[Note] Could not open the history database: {exc}")
+        conn = None
+    try:
+        for form in formulations.values():
+            sheet = plan_sheet(form, overage)
+            name = safe_filename(f"{form['compound']}_{form['route']}")
+            with open(os.path.join(out_dir, f"{name}.txt"), "w",
+                      encoding="utf-8") as f:
+                f.write(sheet)
+            now = time.localtime()
+            append_text_log(log_block(time.strftime(LOG_TIME_FORMAT, now),
+                                      "Formulation Plan", comments, sheet))
+            if conn is not None:
+                try:
+                    append_history(conn, now, "Formulation Plan",
+                                   form["compound"], comments, sheet)
+                except (OSError, sqlite3.Error) as exc:
+                    print(f"[Note] Could not write history: {exc}")
+            print(f"{form['compound']} ({form['route']}): weigh "
+                  f"{form['drug_mg']:.3g} mg, {len(form['steps'])} "
+                  f"solution(s), {form['vehicle_ml']:.3g} ml vehicle")
+    finally:
+        if conn is not None:
+            conn.close()
+
+    print(f"\n{len(formulations)} formulation(s) written to: {out_dir}")
+    return formulations
+
+
 # -------------------------------------------------------------------- app
 
 class ZDrugMakerApp(tk.Tk):
@@ -76,7 +876,15 @@ class ZDrugMakerApp(tk.Tk):
         self.geometry(self.settings.get("geometry", "1024x768"))
 
         self.records = []          # structured history for CSV export
-        self.bew_data = {}         # compound -> (bew, date_str)
+        self.bew_store = BewStore()
+        self._bew_shown = []       # BEW tree rows in display order
+        try:
+            self.history_db = open_history()
+        except (OSError, sqlite3.Error) as exc:
+            self.history_db = None
+            messagebox.showwarning("History",
+                                   f"Could not open the history database:"
+                                   f"\n{exc}")
 
         self._setup_style()
         self._create_header()
@@ -90,13 +898,23 @@ class ZDrugMakerApp(tk.Tk):
         self._create_estimate_tab()
         self._create_vehicle_tab()
         self._create_dilution_tab()
+        self._create_scheme_tab()
         self._create_bew_tab()
+        self._create_history_tab()
         self._create_output_tab()
+        # calculation type -> (input vars, result widget), for re-loading
+        self.calc_tabs = {
+            "Estimate Drug Amount": (self.est_vars, self.est_result),
+            "Calculate Vehicle Amount": (self.veh_vars, self.veh_result),
+            "Perform Dilution": (self.dil_vars, self.dil_result),
+            "Serial Dilution Scheme": (self.sch_vars, self.sch_result),
+        }
 
         self._create_footer()
 
         self._load_bew_file()
         self._refresh_bew_tree()
+        self._refresh_history()
 
         self.protocol("WM_DELETE_WINDOW", self._on_close)
 
@@ -231,6 +1049,11 @@ class ZDrugMakerApp(tk.Tk):
         for var, _label in variables.values():
             var.set("")
 
+    @staticmethod
+    def _field_values(variables):
+        return {key: var.get().strip()
+                for key, (var, _label) in variables.items()}
+
     def _copy_result(self, widget):
         text = widget.get("1.0", tk.END).strip()
         if not text:
@@ -249,6 +1072,25 @@ class ZDrugMakerApp(tk.Tk):
 
     # ---------------------------------------------------------- validation
 
+    @staticmethod
+    def _parse_list(variables, key):
+        """Positive numbers separated by ';' (or spaces)."""
+        var, label = variables[key]
+        raw = var.get().strip()
+        if not raw:
+            raise InputError(f"'{label}' is empty.")
+        values = []
+        for item in re.split(r"[;\s]+", raw):
+            try:
+                value = float(item)
+            except ValueError:
+                raise InputError(f"'{label}' must be numbers separated by "
+                                 f"';' (got '{item}').")
+            if value <= 0:
+                raise InputError(f"'{label}' must be greater than zero.")
+            values.append(value)
+        return values
+
     @staticmethod
     def _parse_float(variables, key, positive=True):
         var, label = variables[key]
@@ -289,6 +1131,19 @@ class ZDrugMakerApp(tk.Tk):
         self.dil_vars, self.dil_result = self._build_calc_tab(
             "Perform Dilution", fields, self.perform_dilution)
 
+    def _create_scheme_tab(self):
+        fields = [("Stock concentration (mg/ml)", "conc_stock"),
+                  ("Target concentrations (mg/ml, ';')", "targets"),
+                  ("Volume of each target (ml, one or ';')", "vol_target"),
+                  ("Minimum pipettable volume (\u00b5l)", "min_ul"),
+                  ("Largest solution (ml)", "max_ml"),
+                  ("Max intermediate stocks", "max_inter")]
+        self.sch_vars, self.sch_result = self._build_calc_tab(
+            "Dilution Scheme", fields, self.solve_scheme)
+        self.sch_vars["min_ul"][0].set("10")
+        self.sch_vars["max_ml"][0].set("15")
+        self.sch_vars["max_inter"][0].set("2")
+
     def _create_bew_tab(self):
         tab = ttk.Frame(self.notebook, padding=12)
         self.notebook.add(tab, text="BEW Values")
@@ -301,7 +1156,7 @@ class ZDrugMakerApp(tk.Tk):
         ttk.Label(top, text="Search:").grid(row=0, column=0, padx=(0, 6))
         self.bew_search = tk.StringVar()
         self.bew_search.trace_add("write",
-                                  lambda *a: self._refresh_bew_tree())
+                                  lambda *a: self._filter_bew_tree())
         ttk.Entry(top, textvariable=self.bew_search).grid(row=0, column=1,
                                                           sticky="ew")
         ttk.Label(tab, text="Double-click a row to fill the compound name "
@@ -326,6 +1181,64 @@ class ZDrugMakerApp(tk.Tk):
 
         self.bew_tree.bind("<Double-1>", self._on_bew_double_click)
 
+    def _create_history_tab(self):
+        tab = ttk.Frame(self.notebook, padding=12)
+        self.notebook.add(tab, text="History")
+        tab.columnconfigure(0, weight=1)
+        tab.rowconfigure(1, weight=1)
+        tab.rowconfigure(2, weight=1)
+
+        top = ttk.Frame(tab)
+        top.grid(row=0, column=0, columnspan=2, sticky="ew", pady=(0, 8))
+        top.columnconfigure(1, weight=1)
+        self.hist_search = tk.StringVar()
+        self.hist_from = tk.StringVar()
+        self.hist_to = tk.StringVar()
+        ttk.Label(top, text="Compound:").grid(row=0, column=0, padx=(0, 6))
+        ttk.Entry(top, textvariable=self.hist_search).grid(row=0, column=1,
+                                                           sticky="ew")
+        ttk.Label(top, text="From:").grid(row=0, column=2, padx=(12, 6))
+        ttk.Entry(top, textvariable=self.hist_from, width=11).grid(row=0,
+                                                                   column=3)
+        ttk.Label(top, text="To:").grid(row=0, column=4, padx=(12, 6))
+        ttk.Entry(top, textvariable=self.hist_to, width=11).grid(row=0,
+                                                                 column=5)
+        for var in (self.hist_search, self.hist_from, self.hist_to):
+            var.trace_add("write", lambda *a: self._refresh_history())
+
+        cols = ("date", "type", "compound", "comments")
+        self.hist_tree = ttk.Treeview(tab, columns=cols, show="headings")
+        for col, text, width in (("date", "Date", 150),
+                                 ("type", "Calculation", 180),
+                                 ("compound", "Compound", 200),
+                                 ("comments", "Comments", 260)):
+            self.hist_tree.heading(col, text=text)
+            self.hist_tree.column(col, width=width)
+        self.hist_tree.grid(row=1, column=0, sticky="nsew")
+        scroll = ttk.Scrollbar(tab, orient="vertical",
+                               command=self.hist_tree.yview)
+        self.hist_tree.configure(yscrollcommand=scroll.set)
+        scroll.grid(row=1, column=1, sticky="ns")
+        self.hist_tree.bind("<<TreeviewSelect>>", self._on_history_select)
+        self.hist_tree.bind("<Double-1>", lambda _e: self._reload_history())
+
+        self.hist_result = tk.Text(tab, wrap=tk.WORD, font=FONT_MONO,
+                                   bg=COL_RESULT_BG, relief="solid",
+                                   borderwidth=1, highlightthickness=0,
+                                   padx=10, pady=8, height=10,
+                                   state="disabled")
+        self.hist_result.grid(row=2, column=0, columnspan=2, sticky="nsew",
+                              pady=(8, 0))
+
+        bottom = ttk.Frame(tab)
+        bottom.grid(row=3, column=0, columnspan=2, sticky="ew", pady=(6, 0))
+        bottom.columnconfigure(0, weight=1)
+        ttk.Label(bottom, text="Dates as YYYY, YYYY-MM or YYYY-MM-DD. "
+                               "Double-click a row to re-load it.",
+                  style="Subtle.TLabel").grid(row=0, column=0, sticky="w")
+        ttk.Button(bottom, text="Re-load", command=self._reload_history
+                   ).grid(row=0, column=1, sticky="e")
+
     def _create_output_tab(self):
         tab = ttk.Frame(self.notebook, padding=12)
         self.notebook.add(tab, text="Output")
@@ -369,7 +1282,7 @@ class ZDrugMakerApp(tk.Tk):
             messagebox.showerror("Input error", str(exc))
             return
 
-        drugtot = bew * dose * 0.001 * avgbw * animals * trials
+        drugtot = drug_amount(bew, dose, avgbw, animals, trials)
 
         lines = [
             "Estimated Drug Amount and Volumes",
@@ -384,13 +1297,14 @@ class ZDrugMakerApp(tk.Tk):
             "Volumes:",
         ]
         for name, factor in VOLUME_FACTORS:
-            vol = factor * 0.001 * avgbw * animals * trials
+            vol = dosing_volume(factor, avgbw, animals, trials)
             lines.append(f"- {name} ({factor} ml/kg): {vol:.3g} ml")
         lines.append("=" * 40)
         result = "\n".join(lines) + "\n"
 
         self._set_result(self.est_result, result)
-        self._record("Estimate Drug Amount", result)
+        self._record("Estimate Drug Amount", result,
+                     self._field_values(self.est_vars))
         self._add_bew(self.compound_name.get(), bew)
 
     def calculate_vehicle_amount(self):
@@ -412,7 +1326,7 @@ class ZDrugMakerApp(tk.Tk):
             "=" * 50,
         ]
         for name, factor in VOLUME_FACTORS:
-            vol = (factor * amt) / (dose * bew)
+            vol = vehicle_volume(factor, bew, dose, amt)
             lines.append(f"Add {vol:.3g} ml of vehicle to your {amt:.3g} mg "
                          f"of drug")
             lines.append(f"to produce a {factor} ml/kg solution "
@@ -421,7 +1335,8 @@ class ZDrugMakerApp(tk.Tk):
         result = "\n".join(lines) + "\n"
 
         self._set_result(self.veh_result, result)
-        self._record("Calculate Vehicle Amount", result)
+        self._record("Calculate Vehicle Amount", result,
+                     self._field_values(self.veh_vars))
         self._add_bew(self.compound_name.get(), bew)
 
     def perform_dilution(self):
@@ -441,8 +1356,8 @@ class ZDrugMakerApp(tk.Tk):
                 "concentration.\nA dilution cannot increase concentration.")
             return
 
-        vol_needed = (conc_final / conc_stock) * vol_final
-        vol_vehicle = vol_final - vol_needed
+        vol_needed, vol_vehicle = dilution_volumes(conc_stock, conc_final,
+                                                   vol_final)
         vol_remaining = vol_stock - vol_needed
 
         warning = ""
@@ -473,18 +1388,83 @@ class ZDrugMakerApp(tk.Tk):
         result = "\n".join(lines) + warning + "\n"
 
         self._set_result(self.dil_result, result)
-        self._record("Perform Dilution", result)
+        self._record("Perform Dilution", result,
+                     self._field_values(self.dil_vars))
+
+    def solve_scheme(self):
+        try:
+            conc_stock = self._parse_float(self.sch_vars, "conc_stock")
+            targets = self._parse_list(self.sch_vars, "targets")
+            volumes = self._parse_list(self.sch_vars, "vol_target")
+            min_ul = self._parse_float(self.sch_vars, "min_ul")
+            max_ml = self._parse_float(self.sch_vars, "max_ml")
+            max_inter = self._parse_float(self.sch_vars, "max_inter",
+                                          positive=False)
+            if len(volumes) == 1:
+                volumes = volumes * len(targets)
+            elif len(volumes) != len(targets):
+                raise InputError(f"{len(volumes)} volumes given for "
+                                 f"{len(targets)} target concentrations.")
+            if not (0 <= max_inter <= MAX_SCHEME_INTERMEDIATES
+                    and max_inter == int(max_inter)):
+                raise InputError("'Max intermediate stocks' must be a "
+                                 "whole number from 0 to "
+                                 f"{MAX_SCHEME_INTERMEDIATES}.")
+            scheme = solve_dilution_scheme(conc_stock,
+                                           list(zip(targets, volumes)),
+                                           min_ul / 1000.0, int(max_inter),
+                                           max_ml)
+        except InputError as exc:
+            messagebox.showerror("Input error", str(exc))
+            return
+
+        steps = scheme["steps"]
+        n_targets = sum(1 for step in steps if step["target_ml"])
+        lines = [
+            "Serial Dilution Scheme",
+            "=" * 40,
+            f"Compound: {self.compound_name.get()}",
+            f"Stock concentration: {conc_stock:.3g} mg/ml",
+            f"Targets: {', '.join(f'{c:.3g}' for c in targets)} mg/ml",
+            f"Minimum pipetted volume: {min_ul:.3g} \u00b5l",
+            f"Largest solution: {max_ml:.3g} ml",
+            "=" * 40,
+            f"Stock used: {scheme['stock_ml']:.3g} ml "
+            f"({scheme['mg']:.3g} mg of compound)",
+            f"Solutions to prepare: {len(steps)} "
+            f"({len(steps) - n_targets} intermediate)",
+            "=" * 40,
+        ]
+        for n, step in enumerate(steps, start=1):
+            kind = "target" if step["target_ml"] else "intermediate"
+            source = ("stock" if step["source_conc"] == conc_stock
+                      else "solution")
+            lines.append(f"Step {n}: {step['conc']:.3g} mg/ml ({kind})")
+            lines.append(f"Mix {step['source_ml']:.3g} ml of the "
+                         f"{step['source_conc']:.3g} mg/ml {source}")
+            lines.append(f"with {step['vehicle_ml']:.3g} ml of vehicle")
+            lines.append(f"Producing a final volume of {step['volume']:.3g} "
+                         f"ml" + (f" (keep {step['target_ml']:.3g} ml)"
+                                  if step["target_ml"] else "") + "\n")
+        lines.append("=" * 40)
+        others = [f"{n} solutions: {mg:.3g} mg"
+                  for n, mg in scheme["alternatives"] if n != len(steps)]
+        if others:
+            lines.append("Other schemes: " + "; ".join(others))
+            lines.append("=" * 40)
+        result = "\n".join(lines) + "\n"
+
+        self._set_result(self.sch_result, result)
+        self._record("Serial Dilution Scheme", result,
+                     self._field_values(self.sch_vars))
 
     # ------------------------------------------------------ output and log
 
-    def _record(self, calc_type, result):
-        timestamp = time.strftime("%Y/%m/%d - %H:%M:%S")
+    def _record(self, calc_type, result, inputs=None):
+        now = time.localtime()
+        timestamp = time.strftime(LOG_TIME_FORMAT, now)
         comments = self.comments.get("1.0", tk.END).strip()
-
-        block = (f"Date: {timestamp}\n"
-                 f"Calculation Type: {calc_type}\n"
-                 f"Comments: {comments}\n"
-                 f"{result}\n" + "=" * 50 + "\n\n")
+        block = log_block(timestamp, calc_type, comments, result)
 
         self.output_text.insert(tk.END, block)
         self.output_text.see(tk.END)
@@ -497,13 +1477,76 @@ class ZDrugMakerApp(tk.Tk):
             "result": result.strip(),
         })
 
+        # The text log and the history database are written independently,
+        # so a failure of one never skips the other.
+        errors = []
         try:
-            with open(LOG_FILE, "a", encoding="utf-8") as log_file:
-                log_file.write(block)
+            append_text_log(block)
         except OSError as exc:
-            self.status_var.set(f"Could not write log file: {exc}")
+            errors.append(f"Could not write log file: {exc}")
+        if self.history_db is not None:
+            try:
+                append_history(self.history_db, now, calc_type,
+                               self.compound_name.get(), comments, result,
+                               inputs)
+            except (OSError, sqlite3.Error) as exc:
+                errors.append(f"Could not write history: {exc}")
+        if errors:
+            self.status_var.set("; ".join(errors))
         else:
             self.status_var.set(f"{calc_type} logged at {timestamp}.")
+        self._refresh_history()
+
+    # ------------------------------------------------------------- history
+
+    def _refresh_history(self):
+        self.hist_tree.delete(*self.hist_tree.get_children())
+        if self.history_db is None:
+            return
+        dates = []
+        for var in (self.hist_from, self.hist_to):
+            value = var.get().strip()
+            if value and not re.fullmatch(r"\d{4}(-\d{2}(-\d{2})?)?", value):
+                value = ""   # still being typed
+            dates.append(value)
+        rows = search_history(self.history_db, self.hist_search.get().strip(),
+                              *dates)
+        for row_id, date, calc_type, compound, comments in rows:
+            self.hist_tree.insert("", tk.END, iid=str(row_id),
+                                  values=(date, calc_type, compound,
+                                          comments.replace("\n", " ")))
+
+    def _selected_history(self):
+        selection = self.hist_tree.selection()
+        if not selection or self.history_db is None:
+            return None
+        return get_history(self.history_db, int(selection[0]))
+
+    def _on_history_select(self, _event):
+        entry = self._selected_history()
+        if entry is not None:
+            self._set_result(self.hist_result, entry["result"] + "\n")
+
+    def _reload_history(self):
+        entry = self._selected_history()
+        if entry is None:
+            self.status_var.set("Select a history row to re-load.")
+            return
+        self.compound_name.set(entry["compound"])
+        self.comments.delete("1.0", tk.END)
+        self.comments.insert("1.0", entry["comments"])
+        tab = self.calc_tabs.get(entry["type"])
+        if tab is None:
+            self.status_var.set(f"Loaded '{entry['compound']}' from "
+                                f"{entry['date']} ({entry['type']}).")
+            return
+        variables, result = tab
+        for key, (var, _label) in variables.items():
+            var.set(entry["inputs"].get(key, ""))
+        self._set_result(result, entry["result"] + "\n")
+        self.notebook.select(result.master)
+        self.status_var.set(f"Re-loaded {entry['type']} of "
+                            f"'{entry['compound']}' from {entry['date']}.")
 
     def export_output(self):
         compound = self.compound_name.get().strip()
@@ -516,8 +1559,7 @@ class ZDrugMakerApp(tk.Tk):
             messagebox.showerror("Export error", "There is nothing to export.")
             return
 
-        safe_name = re.sub(r"[^\w\-]+", "_", compound).strip("_")
-        filename = f"{time.strftime('%Y%m%d_%H%M')}_{safe_name}"
+        filename = f"{time.strftime('%Y%m%d_%H%M')}_{safe_filename(compound)}"
 
         file_path = filedialog.asksaveasfilename(
             defaultextension=".txt",
@@ -548,41 +1590,15 @@ class ZDrugMakerApp(tk.Tk):
     # ------------------------------------------------------------ BEW file
 
     def _load_bew_file(self):
-        """Load BEW values. Supports the old 'name - value' format and the
-        new tab-separated 'name<TAB>value<TAB>date' format."""
-        self.bew_data = {}
-        if not os.path.exists(BEW_FILE):
-            return
         try:
-            with open(BEW_FILE, "r", encoding="utf-8") as f:
-                for line in f:
-                    line = line.strip()
-                    if not line:
-                        continue
-                    name = value = date = None
-                    if "\t" in line:
-                        parts = line.split("\t")
-                        if len(parts) >= 2:
-                            name, value = parts[0], parts[1]
-                            date = parts[2] if len(parts) > 2 else ""
-                    elif " - " in line:
-                        name, value = line.rsplit(" - ", 1)
-                        date = ""
-                    if name is None:
-                        continue
-                    try:
-                        self.bew_data[name.strip()] = (float(value), date)
-                    except ValueError:
-                        continue
+            self.bew_store = BewStore.load(BEW_FILE)
         except OSError as exc:
+            self.bew_store = BewStore()
             self.status_var.set(f"Could not read BEW file: {exc}")
 
     def _save_bew_file(self):
         try:
-            with open(BEW_FILE, "w", encoding="utf-8") as f:
-                for name in sorted(self.bew_data, key=str.lower):
-                    bew, date = self.bew_data[name]
-                    f.write(f"{name}\t{bew:.6g}\t{date}\n")
+            self.bew_store.save(BEW_FILE)
         except OSError as exc:
             self.status_var.set(f"Could not write BEW file: {exc}")
 
@@ -590,27 +1606,63 @@ class ZDrugMakerApp(tk.Tk):
         compound = compound.strip()
         if not compound:
             return
-        existing = self.bew_data.get(compound)
+        existing = self.bew_store.get(compound)
         date = time.strftime("%Y-%m-%d")
         # Only rewrite the file when the value is new or has changed
-        if existing is None or abs(existing[0] - bew) > 1e-9:
-            self.bew_data[compound] = (bew, date)
-            self._save_bew_file()
-            self._refresh_bew_tree()
-        elif existing[1] != date:
-            self.bew_data[compound] = (bew, date)
+        if (existing is None or abs(existing[0] - bew) > 1e-9
+                or existing[1] != date):
+            self.bew_store.set(compound, bew, date)
             self._save_bew_file()
-            self._refresh_bew_tree()
+            self._update_bew_row(compound)
+
+    @staticmethod
+    def _bew_values(name, entry):
+        bew, date = entry
+        return (name, f"{bew:.6g}", date or "-")
 
     def _refresh_bew_tree(self):
-        query = self.bew_search.get().strip().lower()
+        """Rebuild the BEW table from the store (after loading the file).
+        Every compound gets one row, keyed by its name; searching only
+        detaches and moves these rows."""
         self.bew_tree.delete(*self.bew_tree.get_children())
-        for name in sorted(self.bew_data, key=str.lower):
-            if query and query not in name.lower():
-                continue
-            bew, date = self.bew_data[name]
-            self.bew_tree.insert("", tk.END,
-                                 values=(name, f"{bew:.6g}", date or "-"))
+        for name in self.bew_store.names():
+            self.bew_tree.insert("", tk.END, iid=name,
+                                 values=self._bew_values(
+                                     name, self.bew_store.get(name)))
+        self._bew_shown = self.bew_store.names()
+        self._filter_bew_tree()
+
+    def _filter_bew_tree(self):
+        shown = self.bew_store.search(self.bew_search.get())
+        keep = set(shown)
+        hidden = [name for name in self._bew_shown if name not in keep]
+        if hidden:
+            self.bew_tree.detach(*hidden)
+        # Rows that keep their place at the top are left alone
+        same = 0
+        for old, new in zip(self._bew_shown, shown):
+            if old != new:
+                break
+            same += 1
+        for index in range(same, len(shown)):
+            self.bew_tree.move(shown[index], "", index)
+        self._bew_shown = shown
+
+    def _update_bew_row(self, name):
+        """Update or add a single row of the BEW table."""
+        values = self._bew_values(name, self.bew_store.get(name))
+        if self.bew_tree.exists(name):
+            self.bew_tree.item(name, values=values)
+            return
+        # A new name does not change the order of the other matches, so it
+        # only has to be placed at its own position (or left detached)
+        self.bew_tree.insert("", tk.END, iid=name, values=values)
+        shown = self.bew_store.search(self.bew_search.get())
+        if name in shown:
+            self.bew_tree.move(name, "", shown.index(name))
+        else:
+            self.bew_tree.detach(name)
+        self._bew_shown = shown
 
     def _on_bew_double_click(self, _event):
         selection = self.bew_tree.selection()
@@ -649,9 +1701,33 @@ class ZDrugMakerApp(tk.Tk):
 
     def _on_close(self):
         self._save_settings()
+        if self.history_db is not None:
+            self.history_db.close()
         self.destroy()
 
 
-if __name__ == "__main__":
+def main():
+    ap = argparse.ArgumentParser(
+        description="zDrugMaker dilution calculator; --plan runs the batch "
+                    "formulation planner without opening a window")
+    ap.add_argument("--plan", metavar="CSV",
+                    help="study plan CSV to compute headlessly")
+    ap.add_argument("--out", default=None,
+                    help="output folder for --plan "
+                         "(default: <plan>_formulations)")
+    ap.add_argument("--overage", type=float, default=0.0,
+                    help="extra %% prepared on top of every dosed volume")
+    args = ap.parse_args()
+    if args.plan:
+        try:
+            run_plan(args.plan, args.out, args.overage)
+        except (InputError, OSError, sqlite3.Error) as exc:
+            ap.exit(1, f"Error: {exc}\n")
+        return
+
     app = ZDrugMakerApp()
     app.mainloop()
+
+
+if __name__ == "__main__":
+    main()
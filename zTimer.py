@@ -4,18 +4,58 @@ import os
 import ctypes
 from collections import defaultdict
 
+
+def read_animal_keys(filename='zTimerKeys.txt'):
+    """
+    Read the animal -> key map from a file with one animal per line:
+        W, A, S, D ; graph=A ; seizure=W
+    The graph key is plotted in the live block graphs (defaults to the first
+    key) and the seizure key is the one zTimerOutput2Matcher splits into
+    seizure / non-seizure events (optional). Lines starting with # are ignored.
+    Returns a list of dicts {'keys': [...], 'graph': key, 'seizure': key or None},
+    or None if the file is missing or holds no valid lines.
+    """
+    animals = []
+    try:
+        with open(filename, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                parts = [part.strip() for part in line.split(';')]
+                keys = [key.strip().upper() for key in parts[0].split(',') if key.strip()]
+                options = {}
+                for part in parts[1:]:
+                    if '=' in part:
+                        name, value = part.split('=', 1)
+                        options[name.strip().lower()] = value.strip().upper()
+                if not keys or any(value not in keys for value in options.values()):
+                    print(f"Warning: Skipping invalid line in {filename}: {line}")
+                    continue
+                animals.append({
+                    'keys': keys,
+                    'graph': options.get('graph', keys[0]),
+                    'seizure': options.get('seizure'),
+                })
+    except FileNotFoundError:
+        return None
+    return animals or None
+
+
 class BehaviorTimer:
     """
     A timer to record durations for which specific keys are held.
     
     Animal 1 keys: W, A, S, D  
     Animal 2 keys: J, K, L, I  
+    Further animals / other key maps: see zTimerKeys.txt (read_animal_keys)
     Quit: T (requires double press confirmation)  
     Pause: P
     """
     
     DEFAULT_RECORD_KEYS_ANIMAL_1 = ['W', 'A', 'S', 'D']
     DEFAULT_RECORD_KEYS_ANIMAL_2 = ['J', 'K', 'L', 'I']
+    DEFAULT_GRAPH_KEYS = ['A', 'J']
     DEFAULT_QUIT_KEY = 'T'
     DEFAULT_PAUSE_KEY = 'P'
     # Lower the refresh rate to 0.1 seconds
@@ -36,19 +76,46 @@ class BehaviorTimer:
         'L': '\033[94m',  # Blue
         'I': '\033[91m',  # Red
     }
+    # Colors for keys not listed above, by position in the animal's key list
+    KEY_COLOR_CYCLE = ['\033[93m', '\033[92m', '\033[94m', '\033[91m', '\033[95m', '\033[96m']
     RESET_COLOR = '\033[0m'  # Reset color code
 
     def __init__(self, animal_name, trial_name, key_labels_file='zTimer.txt', 
                  record_keys_animal_1=None, record_keys_animal_2=None, 
-                 quit_key=DEFAULT_QUIT_KEY, pause_key=DEFAULT_PAUSE_KEY):
+                 quit_key=DEFAULT_QUIT_KEY, pause_key=DEFAULT_PAUSE_KEY,
+                 key_state_func=None, clock=time.time, animals=None):
         self.animal_name = animal_name
         self.trial_name = trial_name
         self.key_labels = self.read_key_labels(key_labels_file)
-        self.record_keys_animal_1 = [key.upper() for key in (record_keys_animal_1 or self.DEFAULT_RECORD_KEYS_ANIMAL_1)]
-        self.record_keys_animal_2 = [key.upper() for key in (record_keys_animal_2 or self.DEFAULT_RECORD_KEYS_ANIMAL_2)]
+        if animals is None:
+            # Classic two-animal layout
+            animals = []
+            for keys, graph_key in zip((record_keys_animal_1 or self.DEFAULT_RECORD_KEYS_ANIMAL_1,
+                                        record_keys_animal_2 or self.DEFAULT_RECORD_KEYS_ANIMAL_2),
+                                       self.DEFAULT_GRAPH_KEYS):
+                keys = [key.upper() for key in keys]
+                animals.append({'keys': keys, 'graph': graph_key if graph_key in keys else keys[0]})
+        self.animal_keys = [[key.upper() for key in animal['keys']] for animal in animals]
+        self.graph_keys = [(animal.get('graph') or keys[0]).upper()
+                           for animal, keys in zip(animals, self.animal_keys)]
+        # Flat list of every record key, in animal order
+        self.record_keys = [key for keys in self.animal_keys for key in keys]
         self.quit_key = quit_key.upper()
         self.pause_key = pause_key.upper()
 
+        if len(set(self.record_keys)) != len(self.record_keys):
+            raise ValueError("Each key can only be assigned to one animal")
+        if self.quit_key in self.record_keys or self.pause_key in self.record_keys:
+            raise ValueError("Quit/pause keys cannot also be record keys")
+        # Kept for callers that still address the classic two animals
+        self.record_keys_animal_1 = self.animal_keys[0]
+        self.record_keys_animal_2 = self.animal_keys[1] if len(self.animal_keys) > 1 else []
+
+        self.key_colors = {}
+        for keys in self.animal_keys:
+            for i, key in enumerate(keys):
+                self.key_colors[key] = self.KEY_COLORS.get(key, self.KEY_COLOR_CYCLE[i % len(self.KEY_COLOR_CYCLE)])
+
         self.start_time = None
         self.is_running = False
         self.is_paused = False
@@ -56,26 +123,28 @@ class BehaviorTimer:
         self.pause_start_time = None
         self.events = []
 
-        # For tracking which keys are currently pressed
-        self.key_down = {key: False for key in self.record_keys_animal_1 + self.record_keys_animal_2}
-        self.current_event_start = {key: None for key in self.record_keys_animal_1 + self.record_keys_animal_2}
+        # For tracking which keys are currently pressed. pressed_keys keeps the
+        # held keys in press order so per-tick work scales with what is held.
+        self.key_down = {key: False for key in self.record_keys}
+        self.current_event_start = {key: None for key in self.record_keys}
+        self.pressed_keys = {}
         # To store timeline markers (each marker is a dot or colored key)
         self.timeline_buffer = []
 
-        self.record_vk = {key: ord(key) for key in self.record_keys_animal_1 + self.record_keys_animal_2}
+        self.record_vk = {key: ord(key) for key in self.record_keys}
         self.quit_vk = ord(self.quit_key)
         self.pause_vk = ord(self.pause_key)
 
-        # Windows API for checking key state
-        self.GetAsyncKeyState = ctypes.windll.user32.GetAsyncKeyState
+        # Windows API for checking key state (a replacement with the same
+        # signature can be passed in, e.g. by the zTimerBench replay harness)
+        self.GetAsyncKeyState = key_state_func or ctypes.windll.user32.GetAsyncKeyState
+        self.clock = clock
 
-        # For the graphs: track block durations for keys 'A' and 'J'
+        # For the graphs: track block durations for each animal's graph key
         # Each BLOCK_DURATION-second block records the total seconds the key was held.
         self.block_start = 0.0  # Relative elapsed time when current block started
-        self.current_block_duration_A = 0.0
-        self.current_block_duration_J = 0.0
-        self.a_block_durations = []  # List of completed block durations for key A
-        self.j_block_durations = []  # List for key J
+        self.current_block_durations = {key: 0.0 for key in self.graph_keys}
+        self.block_durations = {key: [] for key in self.graph_keys}  # Completed blocks per graph key
 
         self.current_segment_behaviors = defaultdict(int)
 
@@ -126,11 +195,11 @@ class BehaviorTimer:
         """
         if not self.is_paused:
             self.is_paused = True
-            self.pause_start_time = time.time()
+            self.pause_start_time = self.clock()
             self.end_current_events()
         else:
             self.is_paused = False
-            pause_duration = time.time() - self.pause_start_time
+            pause_duration = self.clock() - self.pause_start_time
             self.total_pause_time += pause_duration
             self.pause_start_time = None
         return self.is_paused
@@ -139,8 +208,8 @@ class BehaviorTimer:
         """
         End any keys that are currently being held.
         """
-        elapsed = time.time() - self.start_time - self.total_pause_time
-        for key in self.record_keys_animal_1 + self.record_keys_animal_2:
+        elapsed = self.clock() - self.start_time - self.total_pause_time
+        for key in list(self.pressed_keys):
             if self.key_down[key] and self.current_event_start[key] is not None:
                 end_time = elapsed
                 duration = end_time - self.current_event_start[key]
@@ -151,67 +220,64 @@ class BehaviorTimer:
                     'duration': duration
                 })
                 self.current_event_start[key] = None
-                self.key_down[key] = False
+            self.key_down[key] = False
+            del self.pressed_keys[key]
 
     def update_graph(self):
         """
-        Display twin graphs (side-by-side) for keys 'A' (Animal 1) and 'J' (Animal 2).
+        Display one graph per animal (side-by-side) for its graph key
+        ('A' for Animal 1 and 'J' for Animal 2 by default).
         Each graph is based on BLOCK_DURATION-second blocks (30 seconds now).
         The y-axis (height) represents the total seconds (0–30) the key was pressed
         in that particular block.
         """
         # Create temporary copies that include the current (ongoing) block if not paused.
-        a_data = self.a_block_durations.copy()
-        j_data = self.j_block_durations.copy()
+        data = {key: self.block_durations[key].copy() for key in self.graph_keys}
         if not self.is_paused:
-            a_data.append(self.current_block_duration_A)
-            j_data.append(self.current_block_duration_J)
+            for key in self.graph_keys:
+                data[key].append(self.current_block_durations[key])
 
-        if len(a_data) == 0 or len(j_data) == 0:
-            print("Not enough data for twin graphs.")
+        if not self.graph_keys or len(data[self.graph_keys[0]]) == 0:
+            print("Not enough data for block graphs.")
             return
 
         # Show the last up-to 10 blocks.
-        window_size = min(10, len(a_data))
-        a_blocks = a_data[-window_size:]
-        j_blocks = j_data[-window_size:]
+        window_size = min(10, len(data[self.graph_keys[0]]))
+        blocks = {key: data[key][-window_size:] for key in self.graph_keys}
         graph_height = 10  # number of rows
+        titles = [f"Graph for '{key}' (Animal {i + 1})" for i, key in enumerate(self.graph_keys)]
+        widths = [max(window_size, len(title)) for title in titles]
+        gap = "      "
 
         # Build the graph rows (each column represents one block)
-        a_graph_rows = []
-        j_graph_rows = []
+        graph_rows = []
         for row in range(graph_height, 0, -1):
-            a_row = ""
-            j_row = ""
-            for block in a_blocks:
+            cells = []
+            for key, width in zip(self.graph_keys, widths):
                 # Calculate filled height relative to BLOCK_DURATION (max possible is BLOCK_DURATION seconds)
-                filled = int((block / self.BLOCK_DURATION) * graph_height)
-                a_row += "#" if filled >= row else " "
-            for block in j_blocks:
-                filled = int((block / self.BLOCK_DURATION) * graph_height)
-                j_row += "#" if filled >= row else " "
-            a_graph_rows.append(a_row)
-            j_graph_rows.append(j_row)
-
-        # Print the twin graphs side by side.
-        print("\nTwin Graphs (30-second blocks):")
-        print("Graph for 'A' (Animal 1)         Graph for 'J' (Animal 2)")
-        for i in range(graph_height):
-            print(f"{a_graph_rows[i]}      {j_graph_rows[i]}")
+                cell = "".join("#" if int((block / self.BLOCK_DURATION) * graph_height) >= row else " "
+                               for block in blocks[key])
+                cells.append(cell.ljust(width))
+            graph_rows.append(gap.join(cells))
+
+        # Print the graphs side by side.
+        print(f"\nBlock Graphs ({self.BLOCK_DURATION:.0f}-second blocks):")
+        print(gap.join(title.ljust(width) for title, width in zip(titles, widths)))
+        for graph_row in graph_rows:
+            print(graph_row.rstrip())
         # x-axis labels (simple dashes)
-        print("-" * window_size + "      " + "-" * window_size)
+        print(gap.join(("-" * window_size).ljust(width) for width in widths).rstrip())
         # Optionally, print numerical values below each graph.
-        a_values = " ".join(f"{val:4.1f}" for val in a_blocks)
-        j_values = " ".join(f"{val:4.1f}" for val in j_blocks)
-        print(f"A durations: {a_values}")
-        print(f"J durations: {j_values}")
+        for key in self.graph_keys:
+            values = " ".join(f"{val:4.1f}" for val in blocks[key])
+            print(f"{key} durations: {values}")
 
     def update_ui(self, elapsed):
         """
         Clear the screen and display an updated UI panel with:
           • Header info (animal, trial, elapsed time, instructions)
           • Current segment statistics (per-key counts and most frequent key)
-          • Twin graphs for keys 'A' and 'J' based on 30-second blocks
+          • One block graph per animal (its graph key) based on 30-second blocks
           • A timeline marker (history of key presses)
         """
         os.system('cls' if os.name=='nt' else 'clear')
@@ -219,10 +285,10 @@ class BehaviorTimer:
         print("=== Behavior Observation Timer ===")
         print(f"Animal: {self.animal_name} | Trial: {self.trial_name} | Elapsed: {elapsed:.2f} sec")
         print("Press 'T' twice to quit, 'P' to pause/resume")
-        print(f"Animal 1 keys: {', '.join(self.record_keys_animal_1)}")
-        print(f"Animal 2 keys: {', '.join(self.record_keys_animal_2)}")
+        for i, keys in enumerate(self.animal_keys, 1):
+            print(f"Animal {i} keys: {', '.join(keys)}")
         print("\n--- Current Segment Statistics ---")
-        for key in self.record_keys_animal_1 + self.record_keys_animal_2:
+        for key in self.record_keys:
             count = self.current_segment_behaviors.get(key, 0)
             print(f"  {key} ({self.key_labels.get(key, '')}): {count} presses")
         if self.current_segment_behaviors:
@@ -230,31 +296,89 @@ class BehaviorTimer:
             most_freq_label = self.key_labels.get(most_freq_key, "")
             print(f"Most frequent in segment: {most_freq_key} ({most_freq_label}) with {freq} presses")
         
-        # Display twin graphs
+        # Display block graphs
         self.update_graph()
 
         # Display timeline markers (the last 100 markers)
         print("\n--- Timeline Markers ---")
         print("".join(self.timeline_buffer[-100:]))
 
-    def start(self):
+    def reset_session(self):
         """
-        Start monitoring key states and updating the UI.
+        Reset all per-session state and mark the session start time.
         """
-        self.start_time = time.time()
+        self.start_time = self.clock()
         self.is_running = True
         self.total_pause_time = 0
         self.is_paused = False
+        self.events = []
+        self.key_down = {key: False for key in self.record_keys}
+        self.current_event_start = {key: None for key in self.record_keys}
+        self.pressed_keys = {}
         self.current_segment_behaviors = defaultdict(int)
         self.timeline_buffer = []
         self.block_start = 0.0
-        self.current_block_duration_A = 0.0
-        self.current_block_duration_J = 0.0
-        self.a_block_durations = []
-        self.j_block_durations = []
+        self.current_block_durations = {key: 0.0 for key in self.graph_keys}
+        self.block_durations = {key: [] for key in self.graph_keys}
+
+    def poll_keys(self, elapsed):
+        """
+        Poll every record key once at the given elapsed time, opening and
+        closing events on key transitions and updating the timeline and
+        graph block accumulators. This is the per-tick core of start().
+        """
+        # Poll each key's state and update per-key event counts
+        for key in self.record_keys:
+            vk = self.record_vk[key]
+            pressed = self.key_pressed(vk)
+
+            if pressed:
+                self.current_segment_behaviors[key] += 1
+                if not self.key_down[key]:
+                    self.key_down[key] = True
+                    self.pressed_keys[key] = True
+                    self.current_event_start[key] = elapsed
+            elif self.key_down[key]:
+                self.key_down[key] = False
+                del self.pressed_keys[key]
+                if self.current_event_start[key] is not None:
+                    end_time = elapsed
+                    duration = end_time - self.current_event_start[key]
+                    self.events.append({
+                        'key': key,
+                        'start': self.current_event_start[key],
+                        'end': end_time,
+                        'duration': duration
+                    })
+                    self.current_event_start[key] = None
+
+        # Update timeline marker: show pressed keys (with colors) or a dot if none pressed
+        marker = ''.join(f"{self.key_colors[key]}{key}{self.RESET_COLOR}" for key in self.pressed_keys) if self.pressed_keys else "."
+        self.timeline_buffer.append(marker)
+        if len(self.timeline_buffer) > 1000:
+            self.timeline_buffer = self.timeline_buffer[-1000:]
+
+        # --- Update block durations for the graphs ---
+        # For each held graph key, accumulate duration.
+        for key in self.pressed_keys:
+            if key in self.current_block_durations:
+                self.current_block_durations[key] += self.TIMELINE_INTERVAL
+
+        # Check if the current BLOCK_DURATION-second block is complete (handle possible multiple blocks)
+        while elapsed - self.block_start >= self.BLOCK_DURATION:
+            for key in self.graph_keys:
+                self.block_durations[key].append(self.current_block_durations[key])
+                self.current_block_durations[key] = 0.0
+            self.block_start += self.BLOCK_DURATION
+
+    def start(self):
+        """
+        Start monitoring key states and updating the UI.
+        """
+        self.reset_session()
 
         while self.is_running:
-            current_time = time.time()
+            current_time = self.clock()
             elapsed = current_time - self.start_time - self.total_pause_time
             
             # Check for pause key press (with a short debounce)
@@ -268,8 +392,8 @@ class BehaviorTimer:
                 while self.key_pressed(self.quit_vk):
                     time.sleep(0.05)
                 confirmed = False
-                timeout = time.time() + 3
-                while time.time() < timeout:
+                timeout = self.clock() + 3
+                while self.clock() < timeout:
                     if self.key_pressed(self.quit_vk):
                         confirmed = True
                         break
@@ -280,50 +404,7 @@ class BehaviorTimer:
                     break
 
             if not self.is_paused:
-                # Poll each key's state and update per-key event counts
-                for key in self.record_keys_animal_1 + self.record_keys_animal_2:
-                    vk = self.record_vk[key]
-                    pressed = self.key_pressed(vk)
-                    
-                    if pressed:
-                        self.current_segment_behaviors[key] += 1
-                        if not self.key_down[key]:
-                            self.key_down[key] = True
-                            self.current_event_start[key] = elapsed
-                    elif self.key_down[key]:
-                        self.key_down[key] = False
-                        if self.current_event_start[key] is not None:
-                            end_time = elapsed
-                            duration = end_time - self.current_event_start[key]
-                            self.events.append({
-                                'key': key,
-                                'start': self.current_event_start[key],
-                                'end': end_time,
-                                'duration': duration
-                            })
-                            self.current_event_start[key] = None
-
-                # Update timeline marker: show pressed keys (with colors) or a dot if none pressed
-                pressed_keys = [key for key in self.record_keys_animal_1 + self.record_keys_animal_2 if self.key_down[key]]
-                marker = ''.join(f"{self.KEY_COLORS.get(key, '')}{key}{self.RESET_COLOR}" for key in pressed_keys) if pressed_keys else "."
-                self.timeline_buffer.append(marker)
-                if len(self.timeline_buffer) > 1000:
-                    self.timeline_buffer = self.timeline_buffer[-1000:]
-
-                # --- Update block durations for the graphs ---
-                # For key A and key J, accumulate duration if pressed.
-                if self.key_pressed(self.record_vk['A']):
-                    self.current_block_duration_A += self.TIMELINE_INTERVAL
-                if self.key_pressed(self.record_vk['J']):
-                    self.current_block_duration_J += self.TIMELINE_INTERVAL
-
-                # Check if the current BLOCK_DURATION-second block is complete (handle possible multiple blocks)
-                while elapsed - self.block_start >= self.BLOCK_DURATION:
-                    self.a_block_durations.append(self.current_block_duration_A)
-                    self.j_block_durations.append(self.current_block_duration_J)
-                    self.current_block_duration_A = 0.0
-                    self.current_block_duration_J = 0.0
-                    self.block_start += self.BLOCK_DURATION
+                self.poll_keys(elapsed)
 
             self.update_ui(elapsed)
             time.sleep(self.TIMELINE_INTERVAL)
@@ -342,10 +423,10 @@ class BehaviorTimer:
             sanitized_animal_name = "".join(c if c.isalnum() else "_" for c in self.animal_name)
             sanitized_trial_name = "".join(c if c.isalnum() else "_" for c in self.trial_name)
             filename = os.path.join(log_dir, f"behavior_log_{sanitized_animal_name}_{sanitized_trial_name}_{timestamp}.txt")
-            session_duration = time.time() - self.start_time - self.total_pause_time
+            session_duration = self.clock() - self.start_time - self.total_pause_time
 
-            total_recorded_time_by_key = {key: 0.0 for key in self.record_keys_animal_1 + self.record_keys_animal_2}
-            count_by_key = {key: 0 for key in self.record_keys_animal_1 + self.record_keys_animal_2}
+            total_recorded_time_by_key = {key: 0.0 for key in self.record_keys}
+            count_by_key = {key: 0 for key in self.record_keys}
             for event in self.events:
                 total_recorded_time_by_key[event['key']] += event['duration']
                 count_by_key[event['key']] += 1
@@ -359,7 +440,7 @@ class BehaviorTimer:
                 f.write(f"Total Pause Time: {self.total_pause_time:.2f} seconds\n\n")
 
                 f.write("Key events summary:\n")
-                for key in self.record_keys_animal_1 + self.record_keys_animal_2:
+                for key in self.record_keys:
                     total_time = total_recorded_time_by_key[key]
                     count = count_by_key[key]
                     percentage = (total_time / session_duration * 100) if session_duration > 0 else 0
@@ -389,7 +470,7 @@ class BehaviorTimer:
         file.write("\nDetailed Visual Timeline (each line represents 15 minutes):\n")
         file.write("Legend: '.' = no activity, letter = key pressed\n\n")
         
-        for key in self.record_keys_animal_1 + self.record_keys_animal_2:
+        for key in self.record_keys:
             file.write(f"\n{key} ({self.key_labels.get(key, '')}):\n")
             for segment in range(num_segments):
                 segment_start = segment * self.SEGMENT_DURATION
@@ -416,20 +497,26 @@ class BehaviorTimer:
             file.write("\n")
 
 def main():
+    animals = read_animal_keys('zTimerKeys.txt') or [
+        {'keys': BehaviorTimer.DEFAULT_RECORD_KEYS_ANIMAL_1, 'graph': 'A'},
+        {'keys': BehaviorTimer.DEFAULT_RECORD_KEYS_ANIMAL_2, 'graph': 'J'},
+    ]
+    key_lines = "".join(f"Animal {i} is assigned keys: {', '.join(animal['keys'])}.\n"
+                        for i, animal in enumerate(animals, 1))
     welcome_message = (
         "Welcome to the Behavior Observation Timer!\n"
         "This tool records and analyzes behavior by monitoring key presses.\n"
-        "Animal 1 is assigned keys: W, A, S, D.\n"
-        "Animal 2 is assigned keys: J, K, L, I.\n"
+        f"{key_lines}"
         "Press 'T' twice to quit, 'P' to pause/resume.\n"
         "Key labels are read from 'zTimer.txt' (or default labels are used).\n"
+        "Animal key maps are read from 'zTimerKeys.txt' (or the two defaults above are used).\n"
     )
     print(welcome_message)
 
     animal_name = input("Enter animal name: ID1 ID2")
     trial_name = input("Enter trial name: ")
 
-    timer = BehaviorTimer(animal_name, trial_name)
+    timer = BehaviorTimer(animal_name, trial_name, animals=animals)
     try:
         timer.start()
     except KeyboardInterrupt:
@@ -0,0 +1,386 @@
+"""zTimerBench.py — scripted replay and latency benchmark for zTimer.BehaviorTimer.
+
+Generates a synthetic key-transition trace (overlapping presses on every record
+key of every animal), feeds it to BehaviorTimer.poll_keys() through a fake
+GetAsyncKeyState, and compares the events the timer recorded with the trace.
+
+For each refresh rate (TIMELINE_INTERVAL) it reports:
+  - start / end boundary error distributions (recorded minus true, in ms)
+  - dropped transitions (press/release pairs the polling loop never saw,
+    either because the press was shorter than a tick or two presses merged)
+  - poll period jitter (real-time / scaled runs only)
+  - CPU time per tick and CPU usage as a share of wall time
+
+The default layout is the classic two animals (W A S D / J K L I);
+--animals N adds cages with spare letter keys, --keymap reads a
+zTimerKeys.txt-style file instead.
+
+Speed 0 replays on a virtual clock as fast as possible (pure quantisation
+error); speed 1 is real time; speed N sleeps 1/N of each interval.
+These replays call poll_keys() in their own loop, so they leave out the
+screen redraw (update_ui) that start() does on every tick.
+
+--loop runs the real start() loop instead, in real time: the trace is fed
+through the key-state hook, a double 'T' quits after --duration, and
+update_ui is wrapped to time every tick. Screen output goes to the null
+device at file-descriptor level, so the cls / clear child process still
+runs and its CPU time is counted.
+
+Run:  python zTimerBench.py [--duration 1800] [--rates 0.02,0.05,0.1,0.2]
+                            [--speed 0 | --loop] [--seed 1] [--csv bench.csv]
+                            [--animals 4 | --keymap zTimerKeys.txt]
+"""
+
+import argparse
+import bisect
+import contextlib
+import csv
+import os
+import random
+import statistics
+import sys
+import time
+
+from zTimer import BehaviorTimer, read_animal_keys
+
+PRESSED = 0x8000
+# Letters handed out, four at a time, to animals beyond the default two
+EXTRA_KEYS = "QERYUOFGHZXCVBNM"
+
+
+class VirtualClock:
+    """Clock advanced explicitly by the replay loop (speed 0)."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class ScaledClock:
+    """Real clock running `speed` times faster than wall time."""
+
+    def __init__(self, speed):
+        self.speed = speed
+        self.origin = time.perf_counter()
+
+    def __call__(self):
+        return (time.perf_counter() - self.origin) * self.speed
+
+
+class ReplayKeyboard:
+    """
+    Stand-in for GetAsyncKeyState that answers from a press trace.
+    Polls are assumed to arrive in non-decreasing time order, so each key
+    keeps a cursor into its sorted press list and lookups are O(1) amortised.
+    """
+
+    def __init__(self, trace, clock):
+        self.clock = clock
+        self.presses = {}
+        for key, start, end in trace:
+            self.presses.setdefault(ord(key), []).append((start, end))
+        for vk in self.presses:
+            self.presses[vk].sort()
+        self.cursor = {vk: 0 for vk in self.presses}
+
+    def __call__(self, vk):
+        presses = self.presses.get(vk)
+        if not presses:
+            return 0
+        now = self.clock()
+        i = self.cursor[vk]
+        while i < len(presses) and presses[i][1] <= now:
+            i += 1
+        self.cursor[vk] = i
+        if i < len(presses) and presses[i][0] <= now:
+            return PRESSED
+        return 0
+
+
+def generate_trace(keys, duration, mean_hold, mean_gap, min_hold, seed):
+    """
+    Build a list of (key, start, end) presses. Every key runs its own
+    alternating gap/hold process, so presses overlap freely across keys.
+    """
+    rng = random.Random(seed)
+    trace = []
+    for key in keys:
+        t = rng.expovariate(1.0 / mean_gap)
+        while True:
+            hold = max(min_hold, rng.expovariate(1.0 / mean_hold))
+            if t + hold >= duration:
+                break
+            trace.append((key, t, t + hold))
+            t += hold + max(min_hold, rng.expovariate(1.0 / mean_gap))
+    trace.sort(key=lambda p: p[1])
+    return trace
+
+
+def bench_animals(n_animals):
+    """Key map for n animals: the two defaults plus spare letters."""
+    animals = [
+        {'keys': BehaviorTimer.DEFAULT_RECORD_KEYS_ANIMAL_1, 'graph': 'A'},
+        {'keys': BehaviorTimer.DEFAULT_RECORD_KEYS_ANIMAL_2, 'graph': 'J'},
+    ][:n_animals]
+    for i in range(max(0, n_animals - 2)):
+        keys = list(EXTRA_KEYS[4 * i:4 * i + 4])
+        if len(keys) < 4:
+            raise ValueError(f"At most {2 + len(EXTRA_KEYS) // 4} animals are supported without --keymap")
+        animals.append({'keys': keys, 'graph': keys[0]})
+    return animals
+
+
+def replay(trace, animals, interval, duration, speed):
+    """
+    Drive a fresh BehaviorTimer through the trace at one refresh rate.
+    Returns (timer, tick_periods, cpu_seconds, wall_seconds, ticks).
+    """
+    clock = VirtualClock() if speed == 0 else ScaledClock(speed)
+    keyboard = ReplayKeyboard(trace, clock)
+    timer = BehaviorTimer("bench", f"{interval:g}s", animals=animals,
+                          key_state_func=keyboard, clock=clock)
+    timer.TIMELINE_INTERVAL = interval
+    timer.reset_session()
+
+    tick_periods = []
+    ticks = 0
+    last_elapsed = None
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    while True:
+        elapsed = clock() - timer.start_time - timer.total_pause_time
+        if elapsed > duration:
+            break
+        timer.poll_keys(elapsed)
+        ticks += 1
+        if last_elapsed is not None:
+            tick_periods.append(elapsed - last_elapsed)
+        last_elapsed = elapsed
+        if speed == 0:
+            clock.now += interval
+        else:
+            time.sleep(interval / speed)
+    timer.end_current_events()
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+    return timer, tick_periods, cpu, wall, ticks
+
+
+@contextlib.contextmanager
+def silenced_stdout():
+    """Send file descriptor 1 (prints and child processes) to the null device."""
+    sys.stdout.flush()
+    saved = os.dup(1)
+    with open(os.devnull, 'w') as devnull:
+        os.dup2(devnull.fileno(), 1)
+        try:
+            yield
+        finally:
+            sys.stdout.flush()
+            os.dup2(saved, 1)
+            os.close(saved)
+
+
+def child_cpu():
+    times = os.times()
+    return times.children_user + times.children_system
+
+
+def loop_replay(trace, animals, interval, duration):
+    """
+    Drive the real BehaviorTimer.start() loop (with its per-tick redraw)
+    through the trace in real time, quitting with a double 'T' press after
+    `duration`. Returns (timer, tick_periods, cpu_seconds, wall_seconds,
+    ticks) like replay(); cpu_seconds includes child processes (cls / clear).
+    """
+    clock = ScaledClock(1.0)
+    # Hold the first T long enough for a tick to see it, release, press again
+    hold = max(0.5, 2 * interval)
+    quit_presses = [('T', duration, duration + hold),
+                    ('T', duration + hold + 0.2, duration + hold + 0.5)]
+    keyboard = ReplayKeyboard(list(trace) + quit_presses, clock)
+    timer = BehaviorTimer("bench", f"{interval:g}s", animals=animals,
+                          key_state_func=keyboard, clock=clock)
+    timer.TIMELINE_INTERVAL = interval
+
+    tick_times = []
+    redraw = timer.update_ui
+
+    def timed_update_ui(elapsed):
+        tick_times.append(clock())
+        redraw(elapsed)
+
+    timer.update_ui = timed_update_ui
+    cpu_start = time.process_time() + child_cpu()
+    wall_start = time.perf_counter()
+    with silenced_stdout():
+        timer.start()
+    cpu = time.process_time() + child_cpu() - cpu_start
+    wall = time.perf_counter() - wall_start
+    periods = [b - a for a, b in zip(tick_times, tick_times[1:])]
+    return timer, periods, cpu, wall, len(tick_times)
+
+
+def boundary_errors(trace, events):
+    """
+    Match every recorded event to the nearest true press start and the
+    nearest true release of the same key. Returns (start_errors, end_errors)
+    in seconds, signed as recorded minus true.
+    """
+    starts_by_key = {}
+    ends_by_key = {}
+    for key, start, end in trace:
+        starts_by_key.setdefault(key, []).append(start)
+        ends_by_key.setdefault(key, []).append(end)
+    for key in starts_by_key:
+        starts_by_key[key].sort()
+        ends_by_key[key].sort()
+
+    def nearest(values, x):
+        i = bisect.bisect_left(values, x)
+        candidates = values[max(0, i - 1):i + 1]
+        return min(candidates, key=lambda v: abs(v - x))
+
+    start_errors = []
+    end_errors = []
+    for event in events:
+        starts = starts_by_key.get(event['key'])
+        if not starts:
+            continue
+        start_errors.append(event['start'] - nearest(starts, event['start']))
+        end_errors.append(event['end'] - nearest(ends_by_key[event['key']], event['end']))
+    return start_errors, end_errors
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def describe(values):
+    """Summary of a list of seconds as milliseconds."""
+    if not values:
+        return {'mean': 0.0, 'median': 0.0, 'p95': 0.0, 'max': 0.0}
+    ms = [v * 1000 for v in values]
+    abs_ms = [abs(v) for v in ms]
+    return {
+        'mean': statistics.mean(ms),
+        'median': statistics.median(ms),
+        'p95': percentile(abs_ms, 0.95),
+        'max': max(abs_ms),
+    }
+
+
+def run_benchmark(rates, duration, speed, mean_hold, mean_gap, min_hold, seed, animals, loop=False):
+    keys = [key for animal in animals for key in animal['keys']]
+    trace = generate_trace(keys, duration, mean_hold, mean_gap, min_hold, seed)
+    if loop:
+        speed = 1.0
+        print(f"Synthetic trace: {len(trace)} presses on {len(keys)} keys ({len(animals)} animals) "
+              f"over {duration:.0f} s (seed {seed}), real start() loop with screen redraw\n")
+    else:
+        print(f"Synthetic trace: {len(trace)} presses on {len(keys)} keys ({len(animals)} animals) "
+              f"over {duration:.0f} s (seed {seed}, speed {speed:g})")
+        print("Note: poll_keys() replay only; the start() loop's screen redraw is not included "
+              "(use --loop to measure it).\n")
+
+    results = []
+    for interval in rates:
+        if loop:
+            timer, periods, cpu, wall, ticks = loop_replay(trace, animals, interval, duration)
+        else:
+            timer, periods, cpu, wall, ticks = replay(trace, animals, interval, duration, speed)
+        start_errors, end_errors = boundary_errors(trace, timer.events)
+        true_transitions = 2 * len(trace)
+        seen_transitions = 2 * len(timer.events)
+        start_stats = describe(start_errors)
+        end_stats = describe(end_errors)
+        jitter = [p - interval for p in periods] if speed > 0 else []
+        jitter_stats = describe(jitter)
+        results.append({
+            'animals': len(animals),
+            'interval_s': interval,
+            'ticks': ticks,
+            'presses': len(trace),
+            'events': len(timer.events),
+            'dropped_transitions': max(0, true_transitions - seen_transitions),
+            'dropped_pct': 100.0 * max(0, true_transitions - seen_transitions) / true_transitions if true_transitions else 0.0,
+            'start_err_mean_ms': start_stats['mean'],
+            'start_err_median_ms': start_stats['median'],
+            'start_err_p95_ms': start_stats['p95'],
+            'start_err_max_ms': start_stats['max'],
+            'end_err_mean_ms': end_stats['mean'],
+            'end_err_median_ms': end_stats['median'],
+            'end_err_p95_ms': end_stats['p95'],
+            'end_err_max_ms': end_stats['max'],
+            'jitter_mean_ms': jitter_stats['mean'],
+            'jitter_p95_ms': jitter_stats['p95'],
+            'cpu_per_tick_us': (cpu / ticks * 1e6) if ticks else 0.0,
+            'cpu_pct': (100.0 * cpu / wall) if speed > 0 and wall > 0 else 0.0,
+        })
+    return results
+
+
+def print_report(results, speed):
+    print(f"{'rate(s)':>8} {'ticks':>7} {'events':>7} {'dropped':>12} "
+          f"{'start err ms (mean/p95/max)':>28} {'end err ms (mean/p95/max)':>27} "
+          f"{'cpu/tick us':>11} {'cpu%':>6} {'jitter p95':>10}")
+    for r in results:
+        dropped = f"{r['dropped_transitions']} ({r['dropped_pct']:.1f}%)"
+        start = f"{r['start_err_mean_ms']:.1f}/{r['start_err_p95_ms']:.1f}/{r['start_err_max_ms']:.1f}"
+        end = f"{r['end_err_mean_ms']:.1f}/{r['end_err_p95_ms']:.1f}/{r['end_err_max_ms']:.1f}"
+        cpu_pct = f"{r['cpu_pct']:.1f}" if speed > 0 else "-"
+        jitter = f"{r['jitter_p95_ms']:.1f}" if speed > 0 else "-"
+        print(f"{r['interval_s']:>8g} {r['ticks']:>7} {r['events']:>7} {dropped:>12} "
+              f"{start:>28} {end:>27} {r['cpu_per_tick_us']:>11.1f} {cpu_pct:>6} {jitter:>10}")
+
+
+def write_csv(results, path):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=list(results[0].keys()))
+        writer.writeheader()
+        writer.writerows(results)
+    print(f"\nResults written to {path}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="zTimerBench — replay benchmark for the behavior timer")
+    ap.add_argument("--duration", type=float, default=1800.0, help="trace length in seconds")
+    ap.add_argument("--rates", default="0.02,0.05,0.1,0.2",
+                    help="comma-separated refresh intervals (seconds) to test")
+    ap.add_argument("--speed", type=float, default=0.0,
+                    help="0 = virtual clock, 1 = real time, N = N times faster than real time")
+    ap.add_argument("--loop", action="store_true",
+                    help="run the real start() loop with its screen redraw, in real time")
+    ap.add_argument("--mean-hold", type=float, default=1.5, help="mean key hold time (s)")
+    ap.add_argument("--mean-gap", type=float, default=3.0, help="mean gap between presses of one key (s)")
+    ap.add_argument("--min-hold", type=float, default=0.02, help="shortest hold / gap allowed (s)")
+    ap.add_argument("--seed", type=int, default=1, help="RNG seed for the synthetic trace")
+    ap.add_argument("--csv", default=None, help="optional CSV file for the results table")
+    ap.add_argument("--animals", type=int, default=2, help="number of animals scored at once")
+    ap.add_argument("--keymap", default=None, help="zTimerKeys.txt-style animal key map (overrides --animals)")
+    args = ap.parse_args()
+
+    if args.keymap:
+        animals = read_animal_keys(args.keymap)
+        if not animals:
+            print(f"No valid animal key map found in {args.keymap}")
+            return
+    else:
+        animals = bench_animals(args.animals)
+
+    rates = [float(r) for r in args.rates.split(",") if r.strip()]
+    results = run_benchmark(rates, args.duration, args.speed, args.mean_hold,
+                            args.mean_gap, args.min_hold, args.seed, animals, args.loop)
+    print_report(results, 1.0 if args.loop else args.speed)
+    if args.csv:
+        write_csv(results, args.csv)
+
+
+if __name__ == "__main__":
+    main()
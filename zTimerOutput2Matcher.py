@@ -1,5 +1,20 @@
-import os
+import argparse
 import csv
+import datetime
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+
+from zTimer import read_animal_keys
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Classic two-rat layout used when no zTimerKeys.txt is found.
+# Twitch keys (W, I) are split into seizure / non-seizure events.
+DEFAULT_ANIMALS = [
+    {'keys': ['A', 'S', 'D', 'W'], 'seizure': 'W'},
+    {'keys': ['J', 'K', 'L', 'I'], 'seizure': 'I'},
+]
 
 def list_csv_files():
     files = [f for f in os.listdir() if f.endswith('.csv')]
@@ -21,147 +36,281 @@ def select_csv_file(files):
         print("Invalid input. Please enter a number.")
         exit()
 
-def clean_and_split_csv(filename, rat1_id, rat2_id):
-    base_name = os.path.splitext(filename)[0]
-    with open(filename, 'r', newline='', encoding='utf-8') as infile:
-        reader = csv.reader(infile)
-        rows = list(reader)
-
-    header = rows[0]
-    cleaned_rows = [header]
-    for row in rows[1:]:
-        if row != header:
-            cleaned_rows.append(row)
-
-    # Categories
-    categories = {
-        "KEYA": [],
-        "KEYS": [],
-        "KEYD": [],
-        "KEYW": [],
-        "KEYJ": [],
-        "KEYK": [],
-        "KEYL": [],
-        "KEYI": [],
-        "Seize1": [],
-        "Seize2": []
+def load_animals():
+    """
+    Animal -> key map shared with zTimer (zTimerKeys.txt in the working folder,
+    then next to this script), falling back to the classic two-rat layout.
+    """
+    return (read_animal_keys('zTimerKeys.txt')
+            or read_animal_keys(os.path.join(SCRIPT_DIR, 'zTimerKeys.txt'))
+            or DEFAULT_ANIMALS)
+
+def split_csv(filename, rat_ids, animals=None):
+    """
+    Split an extraction CSV into one file per key (plus seizure files) in a
+    single streaming pass: repeated headers are dropped as they are met, each
+    row goes straight to its already-open category writer, and chronology is
+    checked against the previous row of the same animal, so memory use does
+    not grow with the size of the export. Rows with fewer than the six
+    output fields are skipped and their line numbers reported. Output files
+    are written next to the input. Returns a result dict for print_report /
+    the batch report.
+    """
+    animals = animals or DEFAULT_ANIMALS
+    folder, base_file = os.path.split(filename)
+    base_name = os.path.splitext(base_file)[0]
+    result = {
+        'filename': filename,
+        'rat_ids': list(rat_ids),
+        'output_stats': {},
+        'chronology_errors': [],
+        'malformed_rows': [],
+        'seizure_events': 0,
+        'non_seizure_events': 0,
+        'error': None,
     }
 
+    # Categories: one per key, plus one seizure category per animal with a seizure key.
+    # Each key maps to (animal index, category) so routing a row is a single lookup.
+    category_rat = {}
+    key_route = {}
+    for n, (animal, rat_id) in enumerate(zip(animals, rat_ids), 1):
+        for key in animal['keys']:
+            category_rat[f"KEY{key}"] = rat_id
+            key_route[key] = (n - 1, f"KEY{key}")
+        if animal.get('seizure'):
+            category_rat[f"Seize{n}"] = rat_id
+    seizure_keys = {animal['seizure']: f"Seize{n}"
+                    for n, animal in enumerate(animals, 1) if animal.get('seizure')}
+
     seizure_events = 0
     non_seizure_events = 0
 
-    # Separate rows into two groups for chronology checking
-    rat1_rows = []
-    rat2_rows = []
-
-    for row in cleaned_rows[1:]:
-        key = row[4].upper().strip()
-        seizure_label = row[6].strip().lower() if len(row) > 6 and row[6] else ""
-
-        short_row = [row[0], row[1], row[2], row[3], row[4], row[5]]
-
-        if key in ["A", "S", "D", "W"]:
-            rat1_rows.append(row)
-        elif key in ["J", "K", "L", "I"]:
-            rat2_rows.append(row)
-
-        if key == "A":
-            categories["KEYA"].append(short_row)
-        elif key == "S":
-            categories["KEYS"].append(short_row)
-        elif key == "D":
-            categories["KEYD"].append(short_row)
-        elif key == "W":
-            if "seizure event" not in seizure_label:
-                categories["KEYW"].append(short_row)
-                non_seizure_events += 1
-            else:
-                categories["Seize1"].append(short_row)
-                seizure_events += 1
-        elif key == "J":
-            categories["KEYJ"].append(short_row)
-        elif key == "K":
-            categories["KEYK"].append(short_row)
-        elif key == "L":
-            categories["KEYL"].append(short_row)
-        elif key == "I":
-            if "seizure event" not in seizure_label:
-                categories["KEYI"].append(short_row)
-                non_seizure_events += 1
-            else:
-                categories["Seize2"].append(short_row)
-                seizure_events += 1
-
-    # Chronology errors checking (separately for RAT1 and RAT2)
+    # Chronology errors checking (separately for each rat): only the previous
+    # row and the running row count of each animal are kept.
     chronology_errors = []
+    previous_rows = [None] * len(animals)
+    rows_seen = [0] * len(animals)
 
-    def check_chronology(subset_rows, rat_label):
-        errors = []
-        for i in range(len(subset_rows) - 1):
-            try:
-                current_start = float(subset_rows[i][0])
-                next_start = float(subset_rows[i + 1][0])
-                current_end = float(subset_rows[i][1])
-                next_end = float(subset_rows[i + 1][1])
-                if next_start < current_start or next_end < current_end:
-                    errors.append((rat_label, i + 1, subset_rows[i], subset_rows[i + 1]))
-            except ValueError:
-                continue
-        return errors
-
-    chronology_errors.extend(check_chronology(rat1_rows, rat1_id))
-    chronology_errors.extend(check_chronology(rat2_rows, rat2_id))
+    def check_chronology(animal_idx, row):
+        previous = previous_rows[animal_idx]
+        rows_seen[animal_idx] += 1
+        previous_rows[animal_idx] = row
+        if previous is None:
+            return
+        try:
+            current_start = float(previous[0])
+            next_start = float(row[0])
+            current_end = float(previous[1])
+            next_end = float(row[1])
+        except ValueError:
+            return
+        if next_start < current_start or next_end < current_end:
+            chronology_errors.append((animal_idx, rat_ids[animal_idx], rows_seen[animal_idx] - 1, previous, row))
 
-    # Write output files
     output_stats = {}
     output_header = ['StartTime', 'EndTime', 'Dur', 'EventGlobal', 'Key', 'Label']
+    malformed_rows = []
 
-    for category, rows_list in categories.items():
-        # Decide which rat ID to prepend
-        if category in ["KEYA", "KEYS", "KEYD", "KEYW", "Seize1"]:
-            rat_prefix = rat1_id
-        elif category in ["KEYJ", "KEYK", "KEYL", "KEYI", "Seize2"]:
-            rat_prefix = rat2_id
-        else:
-            rat_prefix = ""
+    with ExitStack() as stack:
+        infile = stack.enter_context(open(filename, 'r', newline='', encoding='utf-8'))
+        reader = csv.reader(infile)
+        header = next(reader, None)
+        if header is None:
+            result['error'] = f"{filename} is empty."
+            return result
+
+        # Open every category writer up front; output files are created even if empty
+        writers = {}
+        output_names = {}
+        for category, rat_prefix in category_rat.items():
+            # Prepend the ID of the rat this category belongs to
+            output_filename = os.path.join(folder, f"{rat_prefix}_{base_name}_{category}.csv")
+            outfile = stack.enter_context(open(output_filename, 'w', newline='', encoding='utf-8'))
+            writers[category] = csv.writer(outfile)
+            writers[category].writerow(output_header)
+            output_names[category] = output_filename
+            output_stats[output_filename] = 0
+
+        for line_no, row in enumerate(reader, start=2):
+            if row == header:
+                continue
+            if len(row) < len(output_header):
+                if any(cell.strip() for cell in row):
+                    malformed_rows.append(line_no)
+                continue
+            key = row[4].upper().strip()
+            route = key_route.get(key)
+            if route is None:
+                continue
+            animal_idx, category = route
+            check_chronology(animal_idx, row)
 
-        output_filename = f"{rat_prefix}_{base_name}_{category}.csv"
-        with open(output_filename, 'w', newline='', encoding='utf-8') as outfile:
-            writer = csv.writer(outfile)
-            writer.writerow(output_header)
-            writer.writerows(rows_list)
-        output_stats[output_filename] = len(rows_list)
+            if key in seizure_keys:
+                seizure_label = row[6].strip().lower() if len(row) > 6 and row[6] else ""
+                if "seizure event" not in seizure_label:
+                    non_seizure_events += 1
+                else:
+                    category = seizure_keys[key]
+                    seizure_events += 1
 
-    # First, Print Chronology Errors
-    print("\n=== Chronology Error Check ===")
+            writers[category].writerow(row[:6])
+            output_stats[output_names[category]] += 1
+
+    # Report errors grouped by rat, in file order within each rat
+    chronology_errors.sort(key=lambda error: error[0])
+    result['chronology_errors'] = [error[1:] for error in chronology_errors]
+    result['output_stats'] = output_stats
+    result['malformed_rows'] = malformed_rows
+    result['seizure_events'] = seizure_events
+    result['non_seizure_events'] = non_seizure_events
+    return result
+
+def report_lines(result):
+    """
+    Chronology error check and extraction report for one split_csv result.
+    """
+    if result['error']:
+        return [f"\n=== {result['filename']} ===", f"ERROR: {result['error']}"]
+
+    lines = ["\n=== Chronology Error Check ==="]
+    chronology_errors = result['chronology_errors']
     if chronology_errors:
-        print(f"⚠️ Chronology Errors Detected ({len(chronology_errors)} cases):")
+        lines.append(f"⚠️ Chronology Errors Detected ({len(chronology_errors)} cases):")
         for rat_label, idx, before, after in chronology_errors:
-            print(f"  {rat_label} - Line {idx}:")
-            print(f"    Before: {before}")
-            print(f"    After:  {after}")
+            lines.append(f"  {rat_label} - Line {idx}:")
+            lines.append(f"    Before: {before}")
+            lines.append(f"    After:  {after}")
     else:
-        print("No chronology errors detected.")
+        lines.append("No chronology errors detected.")
 
-    # Then, Print Extraction Report
-    print("\n=== Extraction Report ===")
-    print(f"Processed file: {filename}")
-    print("\nGenerated files and event counts:")
-    for file, count in output_stats.items():
-        print(f"  {file}: {count} events")
+    malformed_rows = result.get('malformed_rows', [])
+    if malformed_rows:
+        shown = ', '.join(str(n) for n in malformed_rows[:20])
+        more = f" (+{len(malformed_rows) - 20} more)" if len(malformed_rows) > 20 else ""
+        lines.append(f"\n⚠️ Skipped {len(malformed_rows)} row(s) with fewer than 6 fields, "
+                     f"line(s): {shown}{more}")
 
-    print(f"\nTotal seizure events detected: {seizure_events}")
-    print(f"Total non-seizure twitch events: {non_seizure_events}")
+    lines.append("\n=== Extraction Report ===")
+    lines.append(f"Processed file: {result['filename']}")
+    lines.append("\nGenerated files and event counts:")
+    for file, count in result['output_stats'].items():
+        lines.append(f"  {file}: {count} events")
 
+    lines.append(f"\nTotal seizure events detected: {result['seizure_events']}")
+    lines.append(f"Total non-seizure twitch events: {result['non_seizure_events']}")
+    return lines
+
+def clean_and_split_csv(filename, rat_ids, animals=None):
+    result = split_csv(filename, rat_ids, animals)
+    print("\n".join(report_lines(result)))
     input("\nPress Enter to exit...")
 
+def read_batch_mapping(mapping_file):
+    """
+    Read a batch mapping file with one extraction CSV per line:
+        filename.csv,RAT_ID1,RAT_ID2
+    Blank lines, lines starting with # and a leading 'file...' header are skipped.
+    Returns a list of (filename, [rat IDs]).
+    """
+    jobs = []
+    with open(mapping_file, 'r', newline='', encoding='utf-8') as f:
+        for i, row in enumerate(csv.reader(f)):
+            row = [cell.strip() for cell in row]
+            if not row or not row[0] or row[0].startswith('#'):
+                continue
+            if i == 0 and row[0].lower().startswith('file'):
+                continue
+            jobs.append((row[0], [cell for cell in row[1:] if cell]))
+    return jobs
+
+def _batch_worker(job):
+    filename, rat_ids, animals = job
+    if len(rat_ids) != len(animals):
+        return {'filename': filename, 'rat_ids': rat_ids,
+                'error': f"expected {len(animals)} rat IDs, got {len(rat_ids)}"}
+    if not os.path.isfile(filename):
+        return {'filename': filename, 'rat_ids': rat_ids, 'error': "file not found"}
+    try:
+        return split_csv(filename, rat_ids, animals)
+    except (OSError, ValueError, csv.Error, IndexError) as e:
+        return {'filename': filename, 'rat_ids': rat_ids, 'error': str(e)}
+
+def batch_split(mapping_file, animals=None, workers=None):
+    """
+    Split every CSV listed in the mapping file in parallel worker processes
+    and write one consolidated report next to the mapping file.
+    CSV names in the mapping are relative to the mapping file's folder.
+    """
+    animals = animals or load_animals()
+    folder = os.path.dirname(os.path.abspath(mapping_file))
+    jobs = [(os.path.join(folder, filename), rat_ids, animals)
+            for filename, rat_ids in read_batch_mapping(mapping_file)]
+    if not jobs:
+        print(f"No files listed in {mapping_file}.")
+        return None
+
+    print(f"Splitting {len(jobs)} files...")
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(_batch_worker, jobs))
+
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    report_file = os.path.join(folder, f"extraction_report_{timestamp}.txt")
+    total_seizures = sum(r.get('seizure_events', 0) for r in results)
+    total_twitches = sum(r.get('non_seizure_events', 0) for r in results)
+    total_errors = sum(len(r.get('chronology_errors', [])) for r in results)
+    failed = [r for r in results if r.get('error')]
+
+    with open(report_file, 'w', encoding='utf-8') as f:
+        f.write("Batch Extraction Report\n")
+        f.write(f"Mapping file: {mapping_file}\n")
+        f.write(f"Date: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+        f.write(f"Files: {len(results)} ({len(failed)} failed)\n")
+        f.write(f"Total seizure events: {total_seizures}\n")
+        f.write(f"Total non-seizure twitch events: {total_twitches}\n")
+        f.write(f"Total chronology errors: {total_errors}\n\n")
+
+        f.write("File\tRat IDs\tEvents\tSeizures\tTwitches\tChronology errors\tStatus\n")
+        for r in results:
+            name = os.path.basename(r['filename'])
+            if r.get('error'):
+                f.write(f"{name}\t{' '.join(r['rat_ids'])}\t-\t-\t-\t-\tERROR: {r['error']}\n")
+                continue
+            events = sum(r['output_stats'].values())
+            skipped = len(r['malformed_rows'])
+            status = f"OK ({skipped} malformed rows skipped)" if skipped else "OK"
+            f.write(f"{name}\t{' '.join(r['rat_ids'])}\t{events}\t{r['seizure_events']}\t"
+                    f"{r['non_seizure_events']}\t{len(r['chronology_errors'])}\t{status}\n")
+
+        for r in results:
+            if r.get('error'):
+                f.write(f"\n=== {r['filename']} ===\nERROR: {r['error']}\n")
+            else:
+                f.write("\n".join(report_lines(r)) + "\n")
+
+    print(f"Done: {len(results) - len(failed)} files split, {len(failed)} failed, "
+          f"{total_errors} chronology errors, {total_seizures} seizure events.")
+    print(f"Report saved as: {report_file}")
+    return results
+
 def main():
+    ap = argparse.ArgumentParser(description="Split zTimer extraction CSVs into per-key files")
+    ap.add_argument("--batch", metavar="MAPPING",
+                    help="mapping file of 'filename.csv,RAT_ID1,RAT_ID2' lines to split in one run")
+    ap.add_argument("--workers", type=int, default=None, help="worker processes for --batch (default: CPU count)")
+    args = ap.parse_args()
+    if args.batch:
+        batch_split(args.batch, workers=args.workers)
+        return
+
     files = list_csv_files()
     selected_file = select_csv_file(files)
-    print("\nPlease enter the IDs for the two animals:")
-    rat1_id = input("Enter ID for RAT1 (example: RAT1): ").strip()
-    rat2_id = input("Enter ID for RAT2 (example: RAT2): ").strip()
-    clean_and_split_csv(selected_file, rat1_id, rat2_id)
+    animals = load_animals()
+    print(f"\nPlease enter the IDs for the {len(animals)} animals:")
+    rat_ids = []
+    for n, animal in enumerate(animals, 1):
+        rat_ids.append(input(f"Enter ID for RAT{n} (keys {', '.join(animal['keys'])}, example: RAT{n}): ").strip())
+    clean_and_split_csv(selected_file, rat_ids, animals)
 
 if __name__ == "__main__":
     main()
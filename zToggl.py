@@ -1,5 +1,10 @@
+import bisect
 import csv
+import hashlib
+import heapq
 import os
+import pickle
+import sqlite3
 import sys
 import time
 from datetime import datetime, timedelta, time as datetime_time
@@ -21,6 +26,23 @@ FOLDER = os.path.dirname(os.path.abspath(__file__))
 # script's own products don't clutter the list.
 KNOWN_OUTPUTS = {'output_zT.csv', 'tasks_zT.csv', 'client_hours_report.csv'}
 
+# Parsed exports are cached here, keyed by a hash of the CSV contents.
+# Bump CACHE_VERSION whenever the cached column layout changes.
+CACHE_DIR = os.path.join(FOLDER, '.zToggl_cache')
+CACHE_VERSION = 1
+
+# Append-only history store: every export is ingested once (tracked by file
+# hash) and overlapping exports are deduplicated on (start, end, description).
+WAREHOUSE_DB = os.path.join(FOLDER, 'zToggl_warehouse.sqlite')
+
+# Returned by choose_input_csv when the user picks the warehouse history.
+HISTORY = 'history'
+
+# Returned by choose_search_term for the "all recurring events" mode, which
+# charts every description seen at least MIN_RECURRING times.
+ALL_EVENTS = 'all events'
+MIN_RECURRING = 3
+
 
 # Helper function to parse time.
 def parse_time(time_str):
@@ -32,14 +54,433 @@ def parse_date(date_str):
     return datetime.strptime(date_str, '%Y-%m-%d').date()
 
 
-# Build full start/end datetimes for a row using both the Start date and
-# End date columns, so entries that cross midnight are handled correctly.
-def entry_times(row):
-    start = datetime.combine(parse_date(row['Start date']), parse_time(row['Start time']))
-    end = datetime.combine(parse_date(row['End date']), parse_time(row['End time']))
-    if end < start:
-        end += timedelta(days=1)
-    return start, end, end - start
+# Columnar view of one or more Toggl exports: one list per column, entry i
+# is (start[i], end[i], duration[i], project[i], task[i], description[i]).
+# Dates are parsed once on load and repeated text values are interned, so
+# every menu option can loop over the columns without touching the CSV.
+class TogglData:
+    COLUMNS = ('start', 'end', 'duration', 'project', 'task', 'description')
+
+    def __init__(self, columns=None):
+        columns = columns or {}
+        for name in self.COLUMNS:
+            setattr(self, name, columns.get(name, []))
+
+    def __len__(self):
+        return len(self.start)
+
+    def columns(self):
+        return {name: getattr(self, name) for name in self.COLUMNS}
+
+    # Iterate (start, end, duration, project, task, description) tuples,
+    # optionally only for one project.
+    def entries(self, project=None):
+        rows = zip(self.start, self.end, self.duration, self.project, self.task, self.description)
+        if project is None:
+            return rows
+        return (row for row in rows if row[3] == project)
+
+    def project_counts(self):
+        return Counter(name for name in self.project if name)
+
+    # DescriptionIndex over this data, built on first use and then reused.
+    def description_index(self):
+        index = getattr(self, '_description_index', None)
+        if index is None:
+            index = self._description_index = DescriptionIndex(self)
+        return index
+
+    @classmethod
+    def concat(cls, datasets):
+        combined = cls()
+        for data in datasets:
+            for name in cls.COLUMNS:
+                getattr(combined, name).extend(getattr(data, name))
+        return combined
+
+
+# Normalized description (stripped, lower-case) -> its entries, built in
+# one pass: the chronologically sorted (start, end, duration) instances,
+# weekly count/hour buckets keyed by the week's Monday, and the most common
+# spelling for display. Picking another event or charting every recurring
+# event then needs no rescan of the data.
+class DescriptionIndex:
+    def __init__(self, data):
+        self.instances = defaultdict(list)
+        self.weekly_count = defaultdict(lambda: defaultdict(int))
+        self.weekly_hours = defaultdict(lambda: defaultdict(float))
+        spellings = defaultdict(Counter)
+
+        for start, end, duration, _, _, description in data.entries():
+            label = description.strip()
+            if not label:
+                continue
+            key = label.lower()
+            self.instances[key].append((start, end, duration))
+            monday = start.date() - timedelta(days=start.weekday())
+            self.weekly_count[key][monday] += 1
+            self.weekly_hours[key][monday] += duration.total_seconds() / 3600
+            spellings[key][label] += 1
+
+        for instances in self.instances.values():
+            instances.sort()
+        self.labels = {key: counter.most_common(1)[0][0] for key, counter in spellings.items()}
+
+    # Instance counts per description, under each one's display spelling.
+    def counts(self):
+        return Counter({self.labels[key]: len(instances) for key, instances in self.instances.items()})
+
+    # Every entry whose description contains term (case-insensitive), in
+    # chronological order, with the combined weekly buckets. Only the
+    # distinct descriptions are tested, not every entry.
+    def search(self, term):
+        term_lower = term.strip().lower()
+        keys = [key for key in self.instances if term_lower in key]
+        if len(keys) == 1:
+            key = keys[0]
+            return self.instances[key], self.weekly_count[key], self.weekly_hours[key]
+
+        weekly_count = defaultdict(int)
+        weekly_hours = defaultdict(float)
+        for key in keys:
+            for week, count in self.weekly_count[key].items():
+                weekly_count[week] += count
+            for week, hours in self.weekly_hours[key].items():
+                weekly_hours[week] += hours
+        instances = list(heapq.merge(*(self.instances[key] for key in keys)))
+        return instances, weekly_count, weekly_hours
+
+
+# Parse a Toggl export into TogglData. Start/end datetimes use both the
+# Start date and End date columns, so entries that cross midnight are
+# handled correctly. Date and time strings repeat a lot, so each distinct
+# string is parsed only once.
+def parse_export(input_file):
+    data = TogglData()
+    dates = {}
+    times = {}
+    intern = sys.intern
+
+    def to_datetime(date_str, time_str):
+        day = dates.get(date_str)
+        if day is None:
+            day = dates[date_str] = parse_date(date_str)
+        clock = times.get(time_str)
+        if clock is None:
+            clock = times[time_str] = parse_time(time_str)
+        return datetime.combine(day, clock)
+
+    with open(input_file, 'r') as csv_file:
+        for row in csv.DictReader(csv_file):
+            start = to_datetime(row['Start date'], row['Start time'])
+            end = to_datetime(row['End date'], row['End time'])
+            if end < start:
+                end += timedelta(days=1)
+            data.start.append(start)
+            data.end.append(end)
+            data.duration.append(end - start)
+            data.project.append(intern(row['Project']))
+            data.task.append(intern(row['Task']))
+            data.description.append(intern(row['Description']))
+    return data
+
+
+def file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Load one export, reusing the parsed cache when the file is unchanged.
+# The cache stores plain column lists so it does not depend on how the
+# script was started.
+def load_export(input_file):
+    cache_file = os.path.join(CACHE_DIR, f'{file_hash(input_file)}_v{CACHE_VERSION}.pickle')
+    try:
+        with open(cache_file, 'rb') as f:
+            return TogglData(pickle.load(f))
+    except (OSError, pickle.UnpicklingError, EOFError):
+        pass
+
+    data = parse_export(input_file)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_file = cache_file + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(data.columns(), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        print(f'{DIM}Could not write cache for {os.path.basename(input_file)}: {e}{RST}')
+    return data
+
+
+# Load and combine every chosen export.
+def load_exports(input_files):
+    datasets = [load_export(path) for path in input_files]
+    return datasets[0] if len(datasets) == 1 else TogglData.concat(datasets)
+
+
+# Entries closer than this are treated as one continuous stay in the lab.
+MERGE_GAP = timedelta(hours=1)
+# Suggested time windows never start before this time of day.
+DAY_START = datetime_time(6, 0)
+
+
+# One day of a DayIndex: the raw ranges, the merged presence blocks, and
+# per-group totals for whatever grouping the index was built with.
+class DayStats:
+    def __init__(self, day):
+        self.date = day
+        self.ranges = []
+        self.blocks = []
+        # group key -> [total duration, earliest start], in first-seen order
+        self.groups = {}
+        self.grouped_total = timedelta()
+        self.first_grouped_start = None
+
+    # Hours present, i.e. the sum of the merged blocks.
+    def presence(self):
+        return sum((end - start for start, end in self.blocks), timedelta())
+
+    # Suggested windows: each group laid end to end from its first start
+    # (pushed to the day's first start after DAY_START when it began
+    # earlier). Returns ([(key, duration, start, end)] busiest first,
+    # (start, end) of the whole day's window).
+    def suggested_windows(self):
+        day_start = self.first_grouped_start or datetime.combine(self.date, DAY_START)
+        windows = []
+        for key, (duration, first_start) in sorted(self.groups.items(), key=lambda x: x[1][0], reverse=True):
+            window_start = first_start if first_start.time() >= DAY_START else day_start
+            windows.append((key, duration, window_start, window_start + duration))
+        return windows, (day_start, day_start + self.grouped_total)
+
+
+# Sorted-interval engine over TogglData, built in one pass. For every day it
+# holds the merged lab presence (ranges split by gaps over MERGE_GAP),
+# per-group totals and suggested windows; group_key(description) returns a
+# group key or None to leave the entry out of the grouping. Prefix sums over
+# the days answer "hours in lab between X and Y" in O(log n) with
+# lab_hours(), by whole days (blocks count on the day they start, as in the
+# option 1 summary).
+class DayIndex:
+    def __init__(self, data, project=None, group_key=None, merge_gap=MERGE_GAP):
+        self.merge_gap = merge_gap
+        self.days = {}
+        # group key -> total duration over every day, in first-seen order
+        self.group_totals = {}
+
+        for start, end, duration, _, _, description in data.entries(project):
+            day = self.days.get(start.date())
+            if day is None:
+                day = self.days[start.date()] = DayStats(start.date())
+            day.ranges.append((start, end))
+
+            key = group_key(description) if group_key else None
+            if key is None:
+                continue
+            group = day.groups.get(key)
+            if group is None:
+                day.groups[key] = [duration, start]
+            else:
+                group[0] += duration
+                if start < group[1]:
+                    group[1] = start
+            day.grouped_total += duration
+            if start.time() >= DAY_START and (day.first_grouped_start is None or start < day.first_grouped_start):
+                day.first_grouped_start = start
+            self.group_totals[key] = self.group_totals.get(key, timedelta()) + duration
+
+        self.dates = sorted(self.days)
+        for day in self.days.values():
+            day.blocks = self.merge(day.ranges)
+        self._build_prefix()
+
+    # Merge ranges whose gap is at most merge_gap into presence blocks.
+    def merge(self, ranges):
+        ranges.sort(key=lambda x: x[0])
+        if not ranges:
+            return []
+        blocks = []
+        start, end = ranges[0]
+        for next_start, next_end in ranges[1:]:
+            if next_start - end > self.merge_gap:
+                blocks.append((start, end))
+                start = next_start
+            end = max(end, next_end)
+        blocks.append((start, end))
+        return blocks
+
+    def _build_prefix(self):
+        self._day_prefix = [0.0]
+        for day in self.dates:
+            self._day_prefix.append(self._day_prefix[-1] + self.days[day].presence().total_seconds())
+
+    def _date_slice(self, date_from, date_to):
+        lo = bisect.bisect_left(self.dates, date_from) if date_from else 0
+        hi = bisect.bisect_right(self.dates, date_to) if date_to else len(self.dates)
+        return lo, max(lo, hi)
+
+    # Dates (with entries) between date_from and date_to, inclusive.
+    def dates_between(self, date_from=None, date_to=None):
+        lo, hi = self._date_slice(date_from, date_to)
+        return self.dates[lo:hi]
+
+    # Hours of presence on the days date_from to date_to, inclusive.
+    def lab_hours(self, date_from=None, date_to=None):
+        lo, hi = self._date_slice(date_from, date_to)
+        return (self._day_prefix[hi] - self._day_prefix[lo]) / 3600
+
+
+# Open (and create if needed) the history warehouse.
+def open_warehouse():
+    conn = sqlite3.connect(WAREHOUSE_DB)
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS imports (
+            file_hash   TEXT PRIMARY KEY,
+            filename    TEXT NOT NULL,
+            imported_at TEXT NOT NULL,
+            row_count   INTEGER NOT NULL,
+            added       INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS entries (
+            id          INTEGER PRIMARY KEY,
+            start       TEXT NOT NULL,
+            "end"       TEXT NOT NULL,
+            description TEXT NOT NULL,
+            project     TEXT NOT NULL,
+            task        TEXT NOT NULL,
+            UNIQUE (start, "end", description)
+        );
+        CREATE INDEX IF NOT EXISTS entries_start ON entries (start);
+        CREATE INDEX IF NOT EXISTS entries_project_start ON entries (project, start);
+    ''')
+    return conn
+
+
+# Ingest one export unless a file with the same contents was ingested
+# before. Returns (rows in file, new rows added), or None if skipped.
+def ingest_export(conn, input_file):
+    digest = file_hash(input_file)
+    if conn.execute('SELECT 1 FROM imports WHERE file_hash = ?', (digest,)).fetchone():
+        return None
+
+    data = load_export(input_file)
+    before = conn.total_changes
+    with conn:
+        conn.executemany(
+            'INSERT OR IGNORE INTO entries (start, "end", description, project, task) VALUES (?, ?, ?, ?, ?)',
+            ((start.isoformat(' '), end.isoformat(' '), description, project, task)
+             for start, end, _, project, task, description in data.entries()),
+        )
+        added = conn.total_changes - before
+        conn.execute('INSERT INTO imports VALUES (?, ?, ?, ?, ?)',
+                     (digest, os.path.basename(input_file), datetime.now().isoformat(' ', 'seconds'),
+                      len(data), added))
+    return len(data), added
+
+
+# Ingest every export in the script folder that is not in the warehouse yet.
+def ingest_folder(quiet=False):
+    conn = open_warehouse()
+    try:
+        new_files = 0
+        for name in list_input_csvs():
+            try:
+                result = ingest_export(conn, os.path.join(FOLDER, name))
+            except (KeyError, ValueError) as e:
+                if not quiet:
+                    print(f'{RED}Skipped {name}: not a Toggl export ({e}){RST}')
+                continue
+            if result is None:
+                if not quiet:
+                    print(f'{DIM}{name}: already ingested{RST}')
+                continue
+            rows, added = result
+            new_files += 1
+            if not quiet:
+                print(f'{GRN}{name}{RST}: {rows} entries, {GRN}{added} new{RST}, '
+                      f'{DIM}{rows - added} duplicate(s) skipped{RST}')
+            elif new_files == 1:
+                print(f'{DIM}Ingesting new exports into the warehouse...{RST}')
+        total = conn.execute('SELECT COUNT(*), MIN(start), MAX(start) FROM entries').fetchone()
+        n_imports = conn.execute('SELECT COUNT(*) FROM imports').fetchone()[0]
+    finally:
+        conn.close()
+    if not quiet or new_files:
+        span = f', {total[1][:10]} to {total[2][:10]}' if total[0] else ''
+        print(f'{GRN}Warehouse: {total[0]} entries from {n_imports} export(s){span}{RST}')
+    return new_files
+
+
+def _history_filter(project=None, date_from=None, date_to=None):
+    clauses = []
+    params = []
+    if project is not None:
+        clauses.append('project = ?')
+        params.append(project)
+    if date_from is not None:
+        clauses.append('start >= ?')
+        params.append(date_from.isoformat())
+    if date_to is not None:
+        clauses.append('start < ?')
+        params.append((date_to + timedelta(days=1)).isoformat())
+    where = f'WHERE {" AND ".join(clauses)}' if clauses else ''
+    return where, params
+
+
+# Project entry counts over the warehouse history (optionally date-limited).
+def warehouse_project_counts(date_from=None, date_to=None):
+    where, params = _history_filter(None, date_from, date_to)
+    conn = open_warehouse()
+    try:
+        rows = conn.execute(f"SELECT project, COUNT(*) FROM entries {where} GROUP BY project", params).fetchall()
+    finally:
+        conn.close()
+    return Counter({project: count for project, count in rows if project})
+
+
+# Load warehouse history into TogglData, filtered in SQL by project and date
+# range (both indexed), in chronological order.
+def warehouse_data(project=None, date_from=None, date_to=None):
+    where, params = _history_filter(project, date_from, date_to)
+    conn = open_warehouse()
+    try:
+        rows = conn.execute(
+            f'SELECT start, "end", project, task, description FROM entries {where} ORDER BY start',
+            params,
+        ).fetchall()
+    finally:
+        conn.close()
+
+    data = TogglData()
+    intern = sys.intern
+    for start_str, end_str, project_name, task, description in rows:
+        start = datetime.fromisoformat(start_str)
+        end = datetime.fromisoformat(end_str)
+        data.start.append(start)
+        data.end.append(end)
+        data.duration.append(end - start)
+        data.project.append(intern(project_name))
+        data.task.append(intern(task))
+        data.description.append(intern(description))
+    return data
+
+
+# Ask for an optional date range (YYYY-MM-DD) to limit history reports.
+def choose_date_range():
+    def ask(label):
+        while True:
+            text = input(f'{CYN}{label}{RST} [YYYY-MM-DD, Enter = no limit]: ').strip()
+            if not text:
+                return None
+            try:
+                return parse_date(text)
+            except ValueError:
+                print(f'{RED}Not a valid date, try again.{RST}')
+
+    return ask('From date'), ask('To date')
 
 
 # Ask a yes/no question before printing any report to the screen.
@@ -51,20 +492,29 @@ def ask_yes_no(question, default=True):
     return answer in ('y', 'yes')
 
 
-# List the CSV files in the script's folder and let the user pick one by
-# number instead of typing the filename out. With allow_all=True an extra
-# 'a' option returns every listed file, for reports spanning several months.
-def choose_input_csv(allow_all=False):
-    csvs = sorted(
+# Candidate input exports in the script's folder.
+def list_input_csvs():
+    return sorted(
         f for f in os.listdir(FOLDER)
         if f.lower().endswith('.csv')
         and f not in KNOWN_OUTPUTS
         and 'function5output' not in f
     )
 
+
+# List the CSV files in the script's folder and let the user pick one by
+# number instead of typing the filename out. With allow_all=True an extra
+# 'a' option returns every listed file, for reports spanning several months.
+# The 'h' option returns HISTORY, i.e. every export ever ingested into the
+# warehouse.
+def choose_input_csv(allow_all=False):
+    csvs = list_input_csvs()
+
     if not csvs:
         print(f'{RED}No CSV files found in {FOLDER}.{RST}')
-        name = input('Enter a CSV filename manually: ').strip()
+        name = input('Enter a CSV filename manually (or h for warehouse history): ').strip()
+        if name.lower() == 'h':
+            return HISTORY
         return os.path.join(FOLDER, name) if name else None
 
     print(f'\n{BLD}Available CSV files:{RST}')
@@ -72,10 +522,14 @@ def choose_input_csv(allow_all=False):
         print(f'  {YEL}{i:>2}{RST}. {name}')
     if allow_all:
         print(f'  {YEL} a{RST}. ALL of the files above (combined report)')
+    print(f'  {YEL} h{RST}. Full history from the warehouse (deduplicated)')
     print(f'  {YEL} 0{RST}. Type a filename manually')
 
     while True:
         choice = input(f'{CYN}Pick a file{RST} [1-{len(csvs)}]: ').strip().lower()
+        if choice == 'h':
+            print(f'{GRN}Selected warehouse history.{RST}')
+            return HISTORY
         if allow_all and choice == 'a':
             print(f'{GRN}Selected all {len(csvs)} files.{RST}')
             return [os.path.join(FOLDER, name) for name in csvs]
@@ -89,12 +543,9 @@ def choose_input_csv(allow_all=False):
         print(f'{RED}Not a valid choice, try again.{RST}')
 
 
-# List the projects found in the chosen CSV (with entry counts) and let
-# the user pick which one to analyze. Defaults to IVS when present.
-def choose_project(input_file):
-    with open(input_file, 'r') as csv_file:
-        counts = Counter(row['Project'] for row in csv.DictReader(csv_file) if row['Project'])
-
+# List the projects (with entry counts) and let the user pick which one
+# to analyze. Defaults to IVS when present.
+def choose_project(counts):
     if not counts:
         print(f'{RED}No projects found in this file.{RST}')
         return None
@@ -130,34 +581,24 @@ def choose_output_file(default):
     return os.path.join(FOLDER, name if name else default)
 
 
-# Option 1: merge a project's time ranges per day and write a summary CSV.
-def parse_csv(input_file, output_file, project):
-    data = defaultdict(list)
-    description_data = defaultdict(lambda: defaultdict(timedelta))
-    overall_description_data = defaultdict(timedelta)
+# "Client - Bill[ - Study]" descriptions, grouped as (client, bill, study).
+def client_bill_study(description):
+    if not description:
+        return None
+    parts = description.split(' - ')
+    if len(parts) == 3:
+        return tuple(parts)
+    if len(parts) == 2:
+        return parts[0], parts[1], 'N/A'
+    return None
 
-    with open(input_file, 'r') as csv_file:
-        for row in csv.DictReader(csv_file):
-            if row['Project'] != project:
-                continue
 
-            start, end, duration = entry_times(row)
-            data[row['Start date']].append((start, end))
-
-            if row['Description']:
-                parts = row['Description'].split(' - ')
-                if len(parts) == 3:
-                    client, bill, study = parts
-                elif len(parts) == 2:
-                    client, bill = parts
-                    study = 'N/A'
-                else:
-                    continue
-                description_data[row['Start date']][(client, bill, study)] += duration
-                overall_description_data[(client, bill, study)] += duration
-
-    if not data:
-        print(f'{RED}No "{project}" entries found in this file — nothing to write.{RST}')
+# Option 1: merge a project's time ranges per day and write a summary CSV.
+def parse_csv(toggl_data, output_file, project):
+    index = DayIndex(toggl_data, project, group_key=client_bill_study)
+
+    if not index.dates:
+        print(f'{RED}No "{project}" entries found — nothing to write.{RST}')
         return
 
     show_breakdown = ask_yes_no('Print daily description breakdowns to screen?')
@@ -166,24 +607,16 @@ def parse_csv(input_file, output_file, project):
         csv_writer = csv.writer(out_file)
         csv_writer.writerow(['Date', 'Start time', 'End time', 'Total hours'])
 
-        for date, time_ranges in sorted(data.items()):
-            time_ranges.sort(key=lambda x: x[0])
-            start, end = time_ranges[0]
-
-            # Merge time ranges separated by less than an hour.
-            for next_start, next_end in time_ranges[1:]:
-                if next_start - end > timedelta(hours=1):
-                    total_hours = (end - start).total_seconds() / 3600
-                    csv_writer.writerow([date, start.time(), end.time(), f'{total_hours:.2f}'])
-                    start = next_start
-                end = max(end, next_end)
-
-            total_hours = (end - start).total_seconds() / 3600
-            csv_writer.writerow([date, start.time(), end.time(), f'{total_hours:.2f}'])
+        for date in index.dates:
+            day = index.days[date]
+            # Time ranges separated by less than an hour are already merged.
+            for start, end in day.blocks:
+                total_hours = (end - start).total_seconds() / 3600
+                csv_writer.writerow([date, start.time(), end.time(), f'{total_hours:.2f}'])
 
             if show_breakdown:
                 print(f'\n{BLD}{date}{RST} — description breakdown:')
-                for (client, bill, study), duration in sorted(description_data[date].items()):
+                for (client, bill, study), (duration, _) in sorted(day.groups.items()):
                     task_hours = duration.total_seconds() / 3600
                     print(f'{YEL}Client:{RST} {client}, {YEL}Bill:{RST} {bill}, '
                           f'{YEL}Study:{RST} {study}: {GRN}{task_hours:.2f} hours{RST}')
@@ -191,7 +624,7 @@ def parse_csv(input_file, output_file, project):
                 time.sleep(0.4)
 
         csv_writer.writerow(['Overall Description Breakdown'])
-        for (client, bill, study), duration in sorted(overall_description_data.items(), key=lambda x: x[0][0]):
+        for (client, bill, study), duration in sorted(index.group_totals.items(), key=lambda x: x[0][0]):
             total_hours = duration.total_seconds() / 3600
             csv_writer.writerow([f'Client: {client}, Bill: {bill}, Study: {study}', f'{total_hours:.2f} hours'])
 
@@ -199,21 +632,19 @@ def parse_csv(input_file, output_file, project):
 
 
 # Option 2: tally hours per project/task and per description.
-def tally_hours(input_file):
+def tally_hours(data):
     hours_data = defaultdict(timedelta)
     description_data = defaultdict(timedelta)
     total_time = timedelta()
 
-    with open(input_file, 'r') as csv_file:
-        for row in csv.DictReader(csv_file):
-            _, _, duration = entry_times(row)
-            hours_data[(row['Project'], row['Task'])] += duration
+    for _, _, duration, project, task, description in data.entries():
+        hours_data[(project, task)] += duration
 
-            # Only include non-'IVS' entries in the description tally.
-            if row['Project'] != 'IVS':
-                description_data[row['Description']] += duration
+        # Only include non-'IVS' entries in the description tally.
+        if project != 'IVS':
+            description_data[description] += duration
 
-            total_time += duration
+        total_time += duration
 
     total_seconds = total_time.total_seconds()
 
@@ -237,16 +668,14 @@ def tally_hours(input_file):
 
 
 # Option 3: append the 15 most common descriptions to a tasks file.
-def common_tasks(input_file, output_file):
+def common_tasks(data, output_file):
     description_counter = Counter()
     project_dict = {}
 
-    with open(input_file, 'r') as csv_file:
-        for row in csv.DictReader(csv_file):
-            description = row['Description']
-            description_counter[description] += 1
-            if description not in project_dict:
-                project_dict[description] = row['Project']
+    for description, project in zip(data.description, data.project):
+        description_counter[description] += 1
+        if description not in project_dict:
+            project_dict[description] = project
 
     most_common_descriptions = description_counter.most_common(15)
 
@@ -274,22 +703,18 @@ def common_tasks(input_file, output_file):
 
 
 # Option 4: tally a project's hours by client and by category.
-def report_hours_by_client_category(input_file, project):
+def report_hours_by_client_category(data, project):
     client_hours = defaultdict(timedelta)
     category_hours = defaultdict(timedelta)
     total_time = timedelta()
 
-    with open(input_file, 'r') as csv_file:
-        for row in csv.DictReader(csv_file):
-            if row['Project'] != project:
-                continue
-            parts = row['Description'].split(' - ')
-            if len(parts) < 2:
-                continue
-            _, _, duration = entry_times(row)
-            client_hours[parts[0]] += duration
-            category_hours[parts[1]] += duration
-            total_time += duration
+    for _, _, duration, _, _, description in data.entries(project):
+        parts = description.split(' - ')
+        if len(parts) < 2:
+            continue
+        client_hours[parts[0]] += duration
+        category_hours[parts[1]] += duration
+        total_time += duration
 
     if not total_time:
         print(f'{RED}No "{project}" entries with a "Client - Category" description found.{RST}')
@@ -315,40 +740,31 @@ def report_hours_by_client_category(input_file, project):
     print(f'\n{BLD}Total {project} time:{RST} {GRN}{total_hours:.2f} hours{RST}')
 
 
-# Option 5: report a project's hours by client/category/study over time.
-def report_hours_by_client_over_time(input_file, output_file, project):
-    data = defaultdict(lambda: defaultdict(list))
-    dates = set()
-
-    with open(input_file, 'r') as csv_file:
-        for row in csv.DictReader(csv_file):
-            if row['Project'] != project:
-                continue
-
-            start, end, duration = entry_times(row)
-            start_date = start.date()
+# "Client - Category" descriptions, with the study appended for studies.
+def client_category_study(description):
+    description_parts = description.split(' - ')
+    if len(description_parts) < 2:
+        return None
 
-            description_parts = row['Description'].split(' - ')
-            if len(description_parts) < 2:
-                continue
+    client = description_parts[0]
+    category = description_parts[1]
+    study = description_parts[2] if len(description_parts) > 2 else 'N/A'
 
-            client = description_parts[0]
-            category = description_parts[1]
-            study = description_parts[2] if len(description_parts) > 2 else 'N/A'
+    entry_key = f'{client} - {category}'
+    if category.lower() == 'study' and study != 'N/A':
+        entry_key += f' - {study}'
+    return entry_key
 
-            entry_key = f'{client} - {category}'
-            if category.lower() == 'study' and study != 'N/A':
-                entry_key += f' - {study}'
 
-            data[start_date][entry_key].append((start, end, duration))
-            dates.add(start_date)
+# Option 5: report a project's hours by client/category/study over time.
+def report_hours_by_client_over_time(toggl_data, output_file, project):
+    index = DayIndex(toggl_data, project, group_key=client_category_study)
+    sorted_dates = [date for date in index.dates if index.days[date].groups]
 
-    if not dates:
+    if not sorted_dates:
         print(f'{RED}No "{project}" entries with a "Client - Category" description found — nothing to write.{RST}')
         return
 
-    sorted_dates = sorted(dates)
-
     # Create the date range for the second output filename.
     start_date_str = sorted_dates[0].strftime('%Y-%m-%d')
     end_date_str = sorted_dates[-1].strftime('%Y-%m-%d')
@@ -372,37 +788,15 @@ def report_hours_by_client_over_time(input_file, output_file, project):
                 print(f'\n{BLD}Date: {date.strftime("%Y-%m-%d")}{RST}')
                 print(DIM + '-' * 60 + RST)
 
-            total_duration = timedelta()
-            earliest_start_after_6am = None
-
-            for entry_data in data[date].values():
-                for start, end, duration in entry_data:
-                    total_duration += duration
-                    if start.time() >= datetime_time(6, 0):
-                        if earliest_start_after_6am is None or start < earliest_start_after_6am:
-                            earliest_start_after_6am = start
-
-            if earliest_start_after_6am is None:
-                earliest_start_after_6am = datetime.combine(date, datetime_time(6, 0))
-
-            sorted_entries = sorted(
-                data[date].items(),
-                key=lambda x: sum((duration for _, _, duration in x[1]), timedelta()),
-                reverse=True,
-            )
-
+            day = index.days[date]
+            total_duration = day.grouped_total
             total_hours = total_duration.total_seconds() / 3600
+            windows, (day_start, day_end) = day.suggested_windows()
 
-            for entry, entry_data in sorted_entries:
-                total_entry_duration = sum((duration for _, _, duration in entry_data), timedelta())
+            for entry, total_entry_duration, window_start, window_end in windows:
                 hours = total_entry_duration.total_seconds() / 3600
                 percentage = (total_entry_duration / total_duration) * 100 if total_duration else 0
-
-                entry_start = min(start for start, _, _ in entry_data)
-                if entry_start.time() < datetime_time(6, 0):
-                    entry_start = earliest_start_after_6am
-                suggested_end = entry_start + total_entry_duration
-                time_window_str = f'{entry_start.strftime("%H:%M")}-{suggested_end.strftime("%H:%M")}'
+                time_window_str = f'{window_start.strftime("%H:%M")}-{window_end.strftime("%H:%M")}'
 
                 if show_report:
                     print(f'{entry.ljust(30)}: {GRN}{hours:.2f} hours ({percentage:.2f}%){RST} - {time_window_str}')
@@ -410,8 +804,7 @@ def report_hours_by_client_over_time(input_file, output_file, project):
                 csv_writer.writerow([date.strftime('%Y-%m-%d'), entry, f'{hours:.2f}', f'{percentage:.2f}', time_window_str])
                 new_csv_writer.writerow([date.strftime('%Y%m%d'), entry, f'{hours:.2f}', f'{percentage:.2f}', f'{total_hours:.2f}'])
 
-            suggested_end_total = earliest_start_after_6am + total_duration
-            total_time_window = f'{earliest_start_after_6am.strftime("%H:%M")}-{suggested_end_total.strftime("%H:%M")}'
+            total_time_window = f'{day_start.strftime("%H:%M")}-{day_end.strftime("%H:%M")}'
 
             if show_report:
                 print(DIM + '-' * 60 + RST)
@@ -424,19 +817,44 @@ def report_hours_by_client_over_time(input_file, output_file, project):
     print(f'{GRN}Additional report has been written to {new_output_file}{RST}')
 
 
+# Option 7: hours present in the lab (merged daily presence) between two dates.
+# date_range is the (from, to) already chosen for a history report; the
+# range is only asked for when none was given.
+def report_lab_hours(toggl_data, project, date_range=None):
+    index = DayIndex(toggl_data, project)
+    if not index.dates:
+        print(f'{RED}No "{project}" entries found.{RST}')
+        return
+
+    print(f'{DIM}Data covers {index.dates[0]} to {index.dates[-1]}.{RST}')
+    date_from, date_to = date_range or choose_date_range()
+    date_from = date_from or index.dates[0]
+    date_to = date_to or index.dates[-1]
+    if date_to < date_from:
+        print(f'{RED}The end date is before the start date.{RST}')
+        return
+
+    days = index.dates_between(date_from, date_to)
+    hours = index.lab_hours(date_from, date_to)
+    print(f'\n{BLD}{project} lab presence {date_from} to {date_to}:{RST} '
+          f'{GRN}{hours:.2f} hours over {len(days)} day(s){RST}'
+          + (f' {DIM}(avg {hours / len(days):.2f} h/day){RST}' if days else ''))
+
+    if days and ask_yes_no('Print the daily presence windows to screen?', default=False):
+        for date in days:
+            day = index.days[date]
+            windows = ', '.join(f'{start.strftime("%H:%M")}-{end.strftime("%H:%M")}' for start, end in day.blocks)
+            print(f'{date}  {GRN}{day.presence().total_seconds() / 3600:5.2f} h{RST}  {DIM}{windows}{RST}')
+
+
 # Option 6: analyze a recurring event (Metelao, Direitinha, Fernando, ...)
 # across one or several CSV files.
 
 # Show the most common recurring descriptions across the chosen files and
 # let the user pick which one to analyze. Defaults to Metelao when present.
-def choose_search_term(input_files):
-    counter = Counter()
-    for path in input_files:
-        with open(path, 'r') as csv_file:
-            for row in csv.DictReader(csv_file):
-                description = row['Description'].strip()
-                if description:
-                    counter[description] += 1
+# Descriptions that differ only in case or surrounding spaces count as one.
+def choose_search_term(data):
+    counter = data.description_index().counts()
 
     if not counter:
         print(f'{RED}No descriptions found in the chosen file(s).{RST}')
@@ -459,10 +877,14 @@ def choose_search_term(input_files):
     for i, name in enumerate(candidates, 1):
         marker = f' {DIM}(default){RST}' if name == default else ''
         print(f'  {YEL}{i:>2}{RST}. {name} {DIM}({counter[name]}×){RST}{marker}')
+    print(f'  {YEL} a{RST}. ALL recurring events (seen {MIN_RECURRING}+ times), one chart each')
     print(f'  {YEL} 0{RST}. Type a search term manually')
 
     while True:
         choice = input(f'{CYN}Pick an event{RST} [Enter = {default}]: ').strip()
+        if choice.lower() == 'a':
+            print(f'{GRN}Selected all recurring events.{RST}')
+            return ALL_EVENTS
         if not choice:
             picked = default
         elif choice == '0':
@@ -479,28 +901,10 @@ def choose_search_term(input_files):
         return picked
 
 
-# Collect every matching entry (case-insensitive substring match on the
-# description) from all the given files, sorted chronologically.
-def gather_event_instances(input_files, term):
-    instances = []
-    term_lower = term.lower()
-    for path in input_files:
-        with open(path, 'r') as csv_file:
-            for row in csv.DictReader(csv_file):
-                if term_lower in row['Description'].lower():
-                    instances.append(entry_times(row))
-    return sorted(instances)
-
-
 # Week-by-week bar chart: how often the event occurred and for how long.
-def print_weekly_chart(instances, term):
-    weekly_count = defaultdict(int)
-    weekly_hours = defaultdict(float)
-    for start, end, duration in instances:
-        monday = start.date() - timedelta(days=start.weekday())
-        weekly_count[monday] += 1
-        weekly_hours[monday] += duration.total_seconds() / 3600
-
+# weekly_count / weekly_hours are keyed by the Monday of each week.
+def print_weekly_chart(weekly_count, weekly_hours, term):
+    n_instances = sum(weekly_count.values())
     first_week = min(weekly_count)
     last_week = max(weekly_count)
     max_hours = max(weekly_hours.values())
@@ -524,14 +928,14 @@ def print_weekly_chart(instances, term):
 
     total_hours = sum(weekly_hours.values())
     n_weeks = ((last_week - first_week).days // 7) + 1
-    print(f'\n{BLD}Total:{RST} {GRN}{len(instances)} instance(s), '
+    print(f'\n{BLD}Total:{RST} {GRN}{n_instances} instance(s), '
           f'{total_hours:.2f} hours across {n_weeks} week(s){RST} '
-          f'{DIM}(avg {len(instances) / n_weeks:.1f}x/week, '
+          f'{DIM}(avg {n_instances / n_weeks:.1f}x/week, '
           f'{total_hours / n_weeks:.2f} h/week){RST}')
 
 
-def report_event_instances(input_files, term):
-    instances = gather_event_instances(input_files, term)
+def report_event_instances(data, term, n_files=1):
+    instances, weekly_count, weekly_hours = data.description_index().search(term)
 
     if not instances:
         print(f'{RED}No instances of "{term}" found in the chosen file(s).{RST}')
@@ -539,7 +943,7 @@ def report_event_instances(input_files, term):
 
     span = f'{instances[0][0].strftime("%Y-%m-%d")} to {instances[-1][0].strftime("%Y-%m-%d")}'
     print(f'\nFound {GRN}{len(instances)}{RST} instance(s) of "{term}" '
-          f'in {len(input_files)} file(s), spanning {span}.')
+          f'in {n_files} file(s), spanning {span}.')
 
     if ask_yes_no('Print each individual instance to screen?', default=False):
         print(f'\n{BLD}--- "{term}" Instances ---{RST}')
@@ -548,7 +952,22 @@ def report_event_instances(input_files, term):
                   f'Time window: {start.strftime("%H:%M")} - {end.strftime("%H:%M")}')
 
     if ask_yes_no('Show the weekly frequency chart?'):
-        print_weekly_chart(instances, term)
+        print_weekly_chart(weekly_count, weekly_hours, term)
+
+
+# Weekly chart for every description seen at least MIN_RECURRING times,
+# most frequent first, all from the one-pass description index.
+def report_all_recurring_events(data, n_files=1):
+    index = data.description_index()
+    keys = sorted((key for key, instances in index.instances.items() if len(instances) >= MIN_RECURRING),
+                  key=lambda key: (-len(index.instances[key]), key))
+    if not keys:
+        print(f'{RED}No event occurs {MIN_RECURRING}+ times in the chosen file(s).{RST}')
+        return
+
+    print(f'\nFound {GRN}{len(keys)}{RST} recurring event(s) in {n_files} file(s).')
+    for key in keys:
+        print_weekly_chart(index.weekly_count[key], index.weekly_hours[key], index.labels[key])
 
 
 MENU_ITEMS = [
@@ -558,6 +977,8 @@ MENU_ITEMS = [
     ('4', 'Project hours by client and category'),
     ('5', 'Project hours by client/category/study over time'),
     ('6', 'Recurring event report (Metelao, Direitinha, ...)'),
+    ('7', 'Project lab hours between two dates'),
+    ('w', 'Ingest all exports into the history warehouse'),
     ('q', 'Quit'),
 ]
 
@@ -590,7 +1011,12 @@ def main():
             print(f'{DIM}Goodbye.{RST}')
             break
 
-        if choice not in ('1', '2', '3', '4', '5', '6'):
+        if choice == 'w':
+            ingest_folder()
+            input(f'\n{DIM}Press Enter to return to the menu...{RST}')
+            continue
+
+        if choice not in ('1', '2', '3', '4', '5', '6', '7'):
             print(f'{RED}Not a valid option.{RST}')
             continue
 
@@ -599,35 +1025,66 @@ def main():
         if not selection:
             print(f'{RED}No input file chosen.{RST}')
             continue
-        input_files = selection if isinstance(selection, list) else [selection]
-        missing = [f for f in input_files if not os.path.isfile(f)]
-        if missing:
-            print(f'{RED}File not found: {missing[0]}{RST}')
-            continue
-        input_file = input_files[0]
+        input_files = []
+        if selection != HISTORY:
+            input_files = selection if isinstance(selection, list) else [selection]
+            missing = [f for f in input_files if not os.path.isfile(f)]
+            if missing:
+                print(f'{RED}File not found: {missing[0]}{RST}')
+                continue
 
         try:
-            # Options 1, 4 and 5 analyze one project — let the user pick it.
+            # Options 1, 4, 5 and 7 analyze one project — let the user pick it.
             project = None
-            if choice in ('1', '4', '5'):
-                project = choose_project(input_file)
-                if not project:
-                    continue
+            date_range = None
+            if selection == HISTORY:
+                # Pick up any new exports first, then query only what the
+                # chosen option needs.
+                ingest_folder(quiet=True)
+                date_from, date_to = date_range = choose_date_range()
+                if choice in ('1', '4', '5', '7'):
+                    project = choose_project(warehouse_project_counts(date_from, date_to))
+                    if not project:
+                        continue
+                data = warehouse_data(project, date_from, date_to)
+                conn = open_warehouse()
+                n_files = conn.execute('SELECT COUNT(*) FROM imports').fetchone()[0]
+                conn.close()
+            else:
+                # Parse (or fetch from cache) the chosen export(s) once; every
+                # option below works on the loaded columns.
+                data = load_exports(input_files)
+                n_files = len(input_files)
+                if choice in ('1', '4', '5', '7'):
+                    project = choose_project(data.project_counts())
+                    if not project:
+                        continue
 
             if choice == '1':
-                parse_csv(input_file, choose_output_file('output_zT.csv'), project)
+                parse_csv(data, choose_output_file('output_zT.csv'), project)
             elif choice == '2':
-                tally_hours(input_file)
+                tally_hours(data)
             elif choice == '3':
-                common_tasks(input_file, choose_output_file('tasks_zT.csv'))
+                common_tasks(data, choose_output_file('tasks_zT.csv'))
             elif choice == '4':
-                report_hours_by_client_category(input_file, project)
+                report_hours_by_client_category(data, project)
             elif choice == '5':
-                report_hours_by_client_over_time(input_file, choose_output_file('client_hours_report.csv'), project)
+                report_hours_by_client_over_time(data, choose_output_file('client_hours_report.csv'), project)
+            elif choice == '7':
+                report_lab_hours(data, project, date_range)
             elif choice == '6':
-                term = choose_search_term(input_files)
-                if term:
-                    report_event_instances(input_files, term)
+                # The description index is built once, so switching to
+                # another event is instant.
+                while True:
+                    term = choose_search_term(data)
+                    if not term:
+                        break
+                    if term == ALL_EVENTS:
+                        report_all_recurring_events(data, n_files)
+                    else:
+                        report_event_instances(data, term, n_files)
+                    if not ask_yes_no('Look at another event?', default=False):
+                        break
         except KeyError as e:
             print(f'{RED}The CSV is missing an expected column: {e}{RST}')
 